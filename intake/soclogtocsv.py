@@ -385,6 +385,32 @@ def mk_turn(turn_id, timestamp, speaker, text, state=None):
                          comment=YUCK)
 
 
+def line_timestamp(line):
+    """Timestamp of a soclog line, as HH:MM:SS:mmm.
+
+    Parameters
+    ----------
+    line : string
+        Line from a soclog
+
+    Returns
+    -------
+    timestamp : string or None
+        None if the line has no timestamp (eg. spectator messages)
+    """
+    # line: <timestamp>:<SOCevent>:<description>
+    # the entire timestamp in the soclogs is in fact formatted as
+    # year:month:day:hour:minute:second:millisecond:utcoffset
+    # i.e. a format specification approximately like:
+    # YYYY:MM:DD:HH:MM:SS:mmm:+HHMM
+    # here, we keep only part of it, forgetting the year, month, day
+    # and signed UTC offset
+    timestamp_ht = line.split(":+", 1)
+    if len(timestamp_ht) < 2:
+        return None
+    return ":".join(timestamp_ht[0].split(":")[-4:])
+
+
 def parse_line(ctr, line, sel_gen=3, parsing_state=None):
     """Parse timestamped line.
 
@@ -417,15 +443,7 @@ def parse_line(ctr, line, sel_gen=3, parsing_state=None):
     line_prev = parsing_state.get('line_prev', '')
     parsing_state['line_prev'] = line
 
-    # line: <timestamp>:<SOCevent>:<description>
-    # the entire timestamp in the soclogs is in fact formatted as
-    # year:month:day:hour:minute:second:millisecond:utcoffset
-    # i.e. a format specification approximately like:
-    # YYYY:MM:DD:HH:MM:SS:mmm:+HHMM
-    # here, we keep only part of it, forgetting the year, month, day
-    # and signed UTC offset
-    timestamp = line.split(":+", 1)[0]
-    timestamp = ":".join(timestamp.split(":")[-4:])
+    timestamp = line_timestamp(line)
 
     # server message
     match_server = SERVER.search(line)
@@ -748,9 +766,7 @@ def soclog_to_turns(soclog, sel_gen=3):
             match_spect = SPECTATOR.search(line)
             if match_spect:
                 # get timestamp from the next line (we won't use it anyway)
-                next_line = next(soclog)
-                timestamp = next_line.split(":+", 1)[0]
-                timestamp = ":".join(timestamp.split(":")[-4:])
+                timestamp = line_timestamp(next(soclog))
                 # increase counter, 2nd generation
                 ctr.incr_at_gen(gen)
                 # these messages have no game state
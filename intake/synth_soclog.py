@@ -0,0 +1,553 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Generate synthetic soclog files, for testing how the intake scripts,
+feature extraction and decoders scale with the length of a game.
+
+The games are nonsense, but the lines are built to the formats that
+`soclogtocsv.py` (and the regular expressions in
+`nonling_annotations.py`) recognise: player chat with game state,
+server messages, spectator messages (gen 2), and game interface events
+(gen 3). Each game turn is
+
+    - a dice roll, with resource distribution (or the robber on a 7)
+    - some chat, in bursts of `--chat-density` messages on average
+    - sometimes a trade negotiation: `--negotiation-length` chat
+      messages followed by an offer that is accepted or rejected
+    - a build, if the player can afford a road
+
+The output only depends on the parameters and `--seed`, eg. ::
+
+    python synth_soclog.py --turns 600 --chat-density 4 big.soclog
+"""
+
+from __future__ import print_function
+
+import argparse
+import codecs
+from collections import namedtuple, OrderedDict
+import datetime
+import random
+import sys
+
+RESOURCES = ['clay', 'ore', 'sheep', 'wheat', 'wood']
+
+ROAD_COST = {'clay': 1, 'wood': 1}
+
+_SYLLABLES = ['cat', 'an', 'zor', 'burt', 'raef', 'bris', 'bin', 'ghet',
+              'to', 'ette', 'wood', 'sheep', 'dmm', 'tomm', 'dave', 'gon',
+              'ka', 'lu', 'mir', 'os']
+
+_CHAT = [
+    'anyone have {res}?',
+    'i need {res}',
+    'who has {res}?',
+    'ok',
+    'hmm',
+    'sorry, taking a while',
+    'good luck everyone',
+    'nice roll',
+    'argh, the robber again',
+    'i have too many {res}',
+    'lol',
+    'my turn?',
+    'go go go!',
+]
+
+_NEGOTIATE = [
+    '{other}: would you give {res} for {res2}?',
+    'i can give {res2} for {res}',
+    'anyone want {res2}?',
+    'no {res} sorry',
+    'how about 2 {res2} for 1 {res}?',
+    'i could do 1 for 1',
+    'deal?',
+    'ok sounds good',
+    'not now',
+]
+
+GEN_SPECTATORS = 2
+"first generation with spectator messages"
+
+GEN_EVENTS = 3
+"first generation with game interface events (robber, turns...)"
+
+
+class Params(namedtuple('Params',
+                        ['players',
+                         'turns',
+                         'chat_density',
+                         'negotiation_length',
+                         'trade_rate',
+                         'spectator_rate',
+                         'gen',
+                         'seed'])):
+    """
+    What sort of game to generate
+
+    Fields
+    ------
+    players : int
+        Number of players (2 to 6)
+    turns : int
+        Number of game turns (after the initial placements)
+    chat_density : float
+        Mean number of chat messages per burst (two bursts per turn)
+    negotiation_length : int
+        Number of chat messages before a trade offer
+    trade_rate : float
+        Probability that a turn has a trade negotiation
+    spectator_rate : float
+        Probability of a spectator message after a chat message
+        (gen 2 and up)
+    gen : int
+        Generation of intake features to exercise (1 to 3)
+    seed : int
+    """
+    pass
+
+
+class Player(object):
+    "what the soclog shows of a player"
+
+    def __init__(self, name, number):
+        self.name = name
+        self.number = number
+        self.resources = OrderedDict((r, 0) for r in RESOURCES)
+        self.roads = []
+        self.settlements = []
+        self.knights = 0
+        self.dev_cards = 0
+
+    def state_string(self):
+        "game state as found in a GAME-TEXT-MESSAGE line"
+        items = list(self.resources.items())
+        items.append(('unknown', 0))
+        items.append(('knights', self.knights))
+        items.append(('roads', self.roads))
+        items.append(('settlements', self.settlements))
+        items.append(('cities', []))
+        items.append(('dev-cards', self.dev_cards))
+        return '|'.join('{}={}'.format(k, _num_list(v)
+                                       if isinstance(v, list) else v)
+                        for k, v in items)
+
+    def total(self):
+        "number of resource cards"
+        return sum(self.resources.values())
+
+
+def _num_list(nums):
+    "[1,2,3] (no spaces)"
+    return '[{}]'.format(','.join(str(x) for x in nums))
+
+
+def _res_list(counts):
+    "trade description: clay=0|ore=1|..."
+    return '|'.join('{}={}'.format(r, counts.get(r, 0))
+                    for r in RESOURCES + ['unknown'])
+
+
+def _res_text(counts):
+    "trade description: 1 ore, 2 wheat"
+    return ', '.join('{} {}'.format(n, r) for r, n in counts.items())
+
+
+def _player_names(rng, num):
+    "some distinct made up nicknames"
+    names = []
+    while len(names) < num:
+        name = ''.join(rng.choice(_SYLLABLES)
+                       for _ in range(rng.randint(2, 3)))
+        if name not in names:
+            names.append(name)
+    return names
+
+
+class SynthGame(object):
+    """
+    Generator for a single game; call `lines` to get the soclog
+    """
+
+    def __init__(self, params):
+        if not 2 <= params.players <= 6:
+            raise ValueError('need between 2 and 6 players')
+        self.params = params
+        self.rng = random.Random(params.seed)
+        self.game = 'Synthetic Game {}'.format(params.seed)
+        self.clock = datetime.datetime(2012, 11, 11, 19, 27, 48)
+        self.players = [Player(n, i) for i, n in
+                        enumerate(_player_names(self.rng, params.players))]
+        self.spectators = ['kibitz' + n for n in
+                           _player_names(self.rng, 2)]
+        self.nodes = list(range(17, 220))
+        self.rng.shuffle(self.nodes)
+        self._out = []
+
+    # -----------------------------------------------------------------
+    # output
+    # -----------------------------------------------------------------
+
+    def _tick(self, max_secs=0.):
+        "move the clock on a bit (by up to `max_secs` seconds)"
+        secs = self.rng.uniform(0, max_secs) if max_secs else 0.
+        self.clock += datetime.timedelta(seconds=secs,
+                                         milliseconds=1)
+
+    def _timestamp(self):
+        "YYYY:MM:DD:HH:MM:SS:mmm:+0000"
+        return '{}:{:03d}:+0000'.format(
+            self.clock.strftime('%Y:%m:%d:%H:%M:%S'),
+            self.clock.microsecond // 1000)
+
+    def _emit(self, event, body):
+        "a timestamped soclog line"
+        self._out.append('{}:{}:{}'.format(self._timestamp(), event, body))
+
+    def _soc(self, event, fmt='', **kwargs):
+        "a SOC... event in the current game"
+        body = 'game=' + self.game
+        if fmt:
+            body += '|' + fmt.format(**kwargs)
+        self._emit(event, body)
+
+    def _server(self, text, gen=1):
+        "a server text message (if we're emitting that generation)"
+        if gen <= self.params.gen:
+            self._soc('SOCGameTextMsg', 'nickname=Server|text={text}',
+                      text=text)
+
+    def _events(self):
+        "True if we should emit gen 3 events"
+        return self.params.gen >= GEN_EVENTS
+
+    # -----------------------------------------------------------------
+    # chat
+    # -----------------------------------------------------------------
+
+    def _say(self, player, text):
+        "a player chat message, with the echoes the server makes"
+        self._tick(20)
+        self._emit('GAME-TEXT-MESSAGE',
+                   '[game={}|player={}|speaking-queue=[]|{}|text={}]'
+                   ''.format(self.game, player.name,
+                             player.state_string(), text))
+        self._soc('SOCSpeakingQueueChanged', 'param=[]')
+        self._soc('SOCGameTextMsg', 'nickname={name}|text={text}',
+                  name=player.name, text=text)
+        self._out.append('')
+        if self.params.gen >= GEN_SPECTATORS and\
+                self.rng.random() < self.params.spectator_rate:
+            self._spectate()
+
+    def _spectate(self):
+        """
+        a spectator message: these are not timestamped, but followed
+        by timestamped lines
+        """
+        name = self.rng.choice(self.spectators)
+        text = self.rng.choice(['nice', 'lol', 'go {}!'.format(
+            self.rng.choice(self.players).name), 'what a game'])
+        self._out.append('player={}|speaking-queue=[]|text={}'
+                         ''.format(name, text))
+        self._tick(2)
+        self._soc('SOCSpeakingQueueChanged', 'param=[]')
+        self._soc('SOCGameTextMsg', 'nickname={name}|text={text}',
+                  name=name, text=text)
+
+    def _fill(self, template, speaker):
+        "instantiate a chat template"
+        others = [p for p in self.players if p is not speaker]
+        res, res2 = self.rng.sample(RESOURCES, 2)
+        return template.format(res=res, res2=res2,
+                               other=self.rng.choice(others).name)
+
+    def _chat(self):
+        "a burst of chat"
+        density = self.params.chat_density
+        if density <= 0:
+            return
+        for _ in range(int(self.rng.expovariate(1. / density) + 0.5)):
+            speaker = self.rng.choice(self.players)
+            self._say(speaker, self._fill(self.rng.choice(_CHAT), speaker))
+
+    # -----------------------------------------------------------------
+    # game
+    # -----------------------------------------------------------------
+
+    def _setup(self):
+        "players join and sit down, then the board is set up"
+        for player in self.players:
+            self._tick(60)
+            for host in ['10.0.0.{}'.format(player.number + 1),
+                         'dummyhost']:
+                self._emit('SOCJoinGame',
+                           'nickname={}|password=***|host={}|game={}'
+                           ''.format(player.name, host, self.game))
+            self._tick(10)
+            for name in ['dummy', player.name]:
+                self._soc('SOCSitDown',
+                          'nickname={name}|playerNumber={num}'
+                          '|robotFlag=false',
+                          name=name, num=player.number)
+            for elt in range(1, 7):
+                self._soc('SOCPlayerElement',
+                          'playerNum={num}|actionType=100'
+                          '|elementType={elt}|value=0',
+                          num=player.number, elt=elt)
+            self._soc('SOCGameState', 'state=0')
+        self._tick(30)
+        self._soc('SOCStartGame')
+        self._soc('SOCBoardLayout', 'hexLayout={{ 51 6 10 6 }}')
+        self._server('Randomly picking a starting player...', GEN_EVENTS)
+        self._soc('SOCStartGame')
+        self._soc('SOCGameState', 'state=5')
+
+    def _begin_turn(self, player, what):
+        "it's somebody's turn to do something"
+        self._server("It's {}'s turn to {}.".format(player.name, what),
+                     GEN_EVENTS)
+        self._soc('SOCTurn', 'playerNumber={num}', num=player.number)
+
+    def _build(self, player, piece):
+        "a player builds a road or settlement"
+        self._tick(30)
+        node = self.nodes.pop() if self.nodes else 0
+        (player.roads if piece == 'road' else
+         player.settlements).append(node)
+        self._soc('SOCPutPiece', 'playerNumber={num}|pieceType={pt}'
+                  '|coord={node}', num=player.number,
+                  pt=0 if piece == 'road' else 1, node=node)
+        self._server('{} built a {}.'.format(player.name, piece))
+
+    def _placements(self):
+        "initial settlements and roads (snake order)"
+        order = self.players + self.players[::-1]
+        for player in order:
+            self._begin_turn(player, 'build a settlement')
+            self._build(player, 'settlement')
+            self._server("It's {}'s turn to build a road."
+                         "".format(player.name), GEN_EVENTS)
+            self._build(player, 'road')
+
+    def _distribute(self):
+        "resources after a dice roll"
+        gains = []
+        for player in self.players:
+            if self.rng.random() < 0.5:
+                res = self.rng.choice(RESOURCES)
+                num = self.rng.choice([1, 1, 1, 2])
+                player.resources[res] += num
+                gains.append((player, res, num))
+        for player in self.players:
+            self._soc('SOCResourceCount', 'playerNumber={num}|count={cnt}',
+                      num=player.number, cnt=player.total())
+        if gains:
+            self._server(' '.join('{} gets {} {}.'.format(p.name, n, r)
+                                  for p, r, n in gains))
+        else:
+            self._server('No player gets anything.')
+
+    def _robber(self, player):
+        "a 7 was rolled"
+        for victim in self.players:
+            if victim.total() > 7:
+                self._server('{} needs to discard.'.format(victim.name),
+                             GEN_EVENTS)
+                lost = victim.total() // 2
+                for _ in range(lost):
+                    res = self.rng.choice([r for r, n in
+                                           victim.resources.items() if n])
+                    victim.resources[res] -= 1
+                self._server('{} discarded {} resources.'
+                             ''.format(victim.name, lost), GEN_EVENTS)
+        self._server('{} will move the robber.'.format(player.name),
+                     GEN_EVENTS)
+        self._tick(20)
+        self._soc('SOCMoveRobber', 'playerNumber={num}|coord={coord}',
+                  num=player.number, coord=self.rng.randint(17, 220))
+        victims = [p for p in self.players
+                   if p is not player and p.total()]
+        if not victims:
+            self._server('{} moved the robber.'.format(player.name),
+                         GEN_EVENTS)
+            return
+        self._server('{} moved the robber, must choose a victim.'
+                     ''.format(player.name), GEN_EVENTS)
+        victim = self.rng.choice(victims)
+        res = self.rng.choice([r for r, n in victim.resources.items() if n])
+        victim.resources[res] -= 1
+        player.resources[res] += 1
+        # the private messages are there to be ignored by the intake
+        self._server('You stole a {} resource from {}.'
+                     ''.format(res, victim.name), GEN_EVENTS)
+        self._server('{} stole a resource from {}'
+                     ''.format(player.name, victim.name), GEN_EVENTS)
+
+    def _roll(self, player):
+        "a player rolls the dice"
+        self._tick(10)
+        dice = (self.rng.randint(1, 6), self.rng.randint(1, 6))
+        self._soc('SOCRollDice')
+        self._soc('SOCDiceResult', 'param={}'.format(sum(dice)))
+        self._server('{} rolled a {} and a {}.'.format(player.name, *dice))
+        if sum(dice) == 7:
+            self._robber(player)
+        else:
+            self._distribute()
+
+    def _offer(self, player, partner):
+        "what a player offers a partner (give, get) if anything"
+        give = [r for r, n in player.resources.items() if n]
+        get = [r for r, n in partner.resources.items() if n]
+        if not give or not get:
+            return None
+        give_res = self.rng.choice(give)
+        get_res = self.rng.choice([r for r in get if r != give_res] or get)
+        if give_res == get_res:
+            return None
+        return (OrderedDict([(give_res, 1)]),
+                OrderedDict([(get_res, min(partner.resources[get_res],
+                                           self.rng.choice([1, 1, 2])))]))
+
+    def _negotiate(self, player):
+        "chat about a trade, then make an offer"
+        partner = self.rng.choice([p for p in self.players
+                                   if p is not player])
+        for i in range(self.params.negotiation_length):
+            speaker = player if i % 2 == 0 else partner
+            self._say(speaker,
+                      self._fill(self.rng.choice(_NEGOTIATE), speaker))
+        offer = self._offer(player, partner)
+        if offer is None:
+            return
+        give, get = offer
+        targets = ','.join('true' if p is partner else 'false'
+                           for p in self.players)
+        offer_line = ('offer=game={game}|from={num}|to={to}'
+                      '|give={give}|get={get}')
+        fields = dict(game=self.game, num=player.number, to=targets,
+                      give=_res_list(give), get=_res_list(get))
+        self._tick(20)
+        self._soc('SOCPlayerStartsTrading', 'param={}'.format(player.name))
+        self._soc('SOCMakeOffer', offer_line, **fields)
+        self._server('{} made an offer to trade {} for {}.'
+                     ''.format(player.name, _res_text(give),
+                               _res_text(get)))
+        self._soc('SOCMakeOffer', offer_line, **fields)
+        self._soc('SOCClearTradeMsg', 'playerNumber=-1')
+        self._tick(10)
+        if self.rng.random() < 0.6:
+            self._soc('SOCAcceptOffer', 'accepting={}|offering={}'
+                      ''.format(partner.number, player.number))
+            for res, num in give.items():
+                player.resources[res] -= num
+                partner.resources[res] += num
+            for res, num in get.items():
+                partner.resources[res] -= num
+                player.resources[res] += num
+            self._server('{} traded {} for {} from {}.'
+                         ''.format(player.name, _res_text(give),
+                                   _res_text(get), partner.name))
+            self._soc('SOCClearOffer', 'playerNumber=-1')
+        elif self._events():
+            for _ in range(2):
+                self._soc('SOCRejectOffer', 'playerNumber={}'
+                          ''.format(partner.number))
+
+    def _turn(self, player):
+        "a full game turn"
+        self._begin_turn(player, 'roll the dice')
+        self._roll(player)
+        self._chat()
+        if self.rng.random() < self.params.trade_rate:
+            self._negotiate(player)
+        if all(player.resources[r] >= n for r, n in ROAD_COST.items()):
+            for res, num in ROAD_COST.items():
+                player.resources[res] -= num
+            self._build(player, 'road')
+        self._chat()
+        self._tick(10)
+        self._soc('SOCEndTurn')
+
+    def lines(self):
+        "the lines of the soclog (without newlines)"
+        self._out = []
+        self._setup()
+        self._placements()
+        for i in range(self.params.turns):
+            self._turn(self.players[i % len(self.players)])
+        winner = max(self.players, key=lambda p: len(p.settlements) +
+                     len(p.roads))
+        self._server('>>> {} has won the game with 10 points.'
+                     ''.format(winner.name), GEN_EVENTS)
+        self._soc('SOCGameState', 'state=1000')
+        return self._out
+
+
+def synth_soclog(params):
+    """
+    Lines (without newlines) of a synthetic soclog
+
+    Parameters
+    ----------
+    params : Params
+    """
+    return SynthGame(params).lines()
+
+
+def main():
+    """
+    Parse CLI args, write the soclog
+    """
+    psr = argparse.ArgumentParser(description='generate a synthetic soclog')
+    psr.add_argument('output', metavar='FILE', nargs='?',
+                     help='where to write the soclog (default: stdout)')
+    psr.add_argument('--players', type=int, default=4)
+    psr.add_argument('--turns', type=int, default=40,
+                     help='number of game turns (default: 40, which is '
+                     'about the length of the bundled samples)')
+    psr.add_argument('--chat-density', type=float, default=1.5,
+                     metavar='N',
+                     help='mean number of chat messages per burst '
+                     '(two bursts per turn)')
+    psr.add_argument('--negotiation-length', type=int, default=4,
+                     metavar='N',
+                     help='chat messages before each trade offer')
+    psr.add_argument('--trade-rate', type=float, default=0.3,
+                     metavar='P',
+                     help='probability of a negotiation in a turn')
+    psr.add_argument('--spectator-rate', type=float, default=0.05,
+                     metavar='P',
+                     help='probability of a spectator message after '
+                     'a chat message (gen 2 and up)')
+    psr.add_argument('--gen', metavar='N', type=int, default=3,
+                     choices=[1, 2, 3],
+                     help='generation of intake features to exercise')
+    psr.add_argument('--seed', type=int, default=0)
+    args = psr.parse_args()
+
+    params = Params(players=args.players,
+                    turns=args.turns,
+                    chat_density=args.chat_density,
+                    negotiation_length=args.negotiation_length,
+                    trade_rate=args.trade_rate,
+                    spectator_rate=args.spectator_rate,
+                    gen=args.gen,
+                    seed=args.seed)
+    if args.output is None:
+        ostream = codecs.getwriter('utf-8')(getattr(sys.stdout, 'buffer',
+                                                    sys.stdout))
+        for line in synth_soclog(params):
+            print(line, file=ostream)
+    else:
+        with codecs.open(args.output, 'w', 'utf-8') as ostream:
+            for line in synth_soclog(params):
+                print(line, file=ostream)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,12 +20,14 @@ from educe.stac.annotation import\
 from educe.stac.util.args import\
     add_usual_output_args,\
     get_output_dir,\
-    announce_output_dir,\
-    read_corpus
+    announce_output_dir
 from educe.stac.util.output import\
     mk_parent_dirs, output_path_stub
+import educe.stac
 import educe.util
 
+import stac.corpus_cache as corpus_cache
+
 
 class ResourceAnnos(namedtuple("ResourceAnnos",
                               ["resources", "anaphora", "several"])):
@@ -355,9 +357,23 @@ def mk_argparser():
                      default='units',
                      help='which section of the corpus to read')
     add_usual_output_args(psr)
+    corpus_cache.add_snapshot_args(psr)
     return psr
 
 
+def read_corpus(args):
+    """
+    Read the selected part of the corpus (from binary snapshots
+    if we have fresh ones)
+    """
+    reader = educe.stac.Reader(args.corpus)
+    anno_files = reader.filter(reader.files(),
+                               educe.util.mk_is_interesting(args))
+    return corpus_cache.slurp(reader, anno_files,
+                              snapshot_dir=args.snapshot_dir,
+                              verbose=True)
+
+
 def main():
     "create a .seg file for every file in the corpus"
     args = mk_argparser().parse_args()
@@ -0,0 +1,219 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Binary snapshots of parsed corpus documents
+
+Reading the glozz `.aa` XML and `.ac` text files for a whole corpus
+is slow, and many of our tools do it over and over for the same
+corpus. Here we keep a pickle of each parsed document, along with a
+manifest recording the size, modification time and hash of the files
+it was read from. Documents whose sources have not changed are loaded
+from their snapshot; anything else goes through the usual XML reader
+(and gets a fresh snapshot).
+"""
+
+from __future__ import print_function
+from os import path as fp
+import hashlib
+import json
+import os
+import sys
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+SNAPSHOT_ENV = 'STAC_CORPUS_CACHE'
+"environment variable for the default snapshot directory"
+
+_MANIFEST = 'manifest.json'
+
+_UNPICKLING_ERRORS = (EOFError, pickle.UnpicklingError, AttributeError,
+                      ImportError, IndexError, TypeError, ValueError)
+"what a truncated or out of date snapshot can make `pickle.load` raise"
+
+
+def add_snapshot_args(psr):
+    """
+    Add a `--snapshot-dir` flag to an argparser (defaults to the
+    `STAC_CORPUS_CACHE` environment variable, no snapshots if unset)
+    """
+    psr.add_argument('--snapshot-dir', metavar='DIR',
+                     default=os.environ.get(SNAPSHOT_ENV),
+                     help='load/save binary snapshots of the corpus '
+                     'here (default: ${})'.format(SNAPSHOT_ENV))
+
+
+def _key_string(key):
+    "human readable identifier for a corpus key"
+    return '.'.join(str(x) for x in
+                    [key.doc, key.subdoc, key.stage, key.annotator])
+
+
+def _entry_name(key):
+    "file name for a snapshot entry"
+    return hashlib.sha1(_key_string(key).encode('utf-8')).hexdigest()
+
+
+def _source_paths(paths):
+    "the files a document is read from"
+    if isinstance(paths, (tuple, list)):
+        return [fp.abspath(p) for p in paths if p is not None]
+    else:
+        return [fp.abspath(paths)]
+
+
+def _file_hash(path):
+    "sha1 of a file's contents"
+    digest = hashlib.sha1()
+    with open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _describe(path, digest=None):
+    "manifest record for a source file"
+    stat = os.stat(path)
+    return {'path': path,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': digest or _file_hash(path)}
+
+
+def _is_fresh(record, path):
+    """
+    Whether the manifest record still describes the source file.
+    We only hash the file if its size/mtime have changed (the
+    record is updated in place if the contents turn out the same)
+
+    Returns
+    -------
+    fresh : bool
+
+    touched : bool
+        True if we updated the record
+    """
+    if record['path'] != path or not fp.exists(path):
+        return False, False
+    stat = os.stat(path)
+    if stat.st_size != record['size']:
+        return False, False
+    if stat.st_mtime == record['mtime']:
+        return True, False
+    if _file_hash(path) == record['sha1']:
+        record['mtime'] = stat.st_mtime
+        return True, True
+    return False, False
+
+
+def _load_manifest(snapshot_dir):
+    "read the manifest (empty if there is none yet)"
+    mpath = fp.join(snapshot_dir, _MANIFEST)
+    if not fp.exists(mpath):
+        return {}
+    with open(mpath) as stream:
+        return json.load(stream)
+
+
+def _atomic_write(path, write):
+    "write to a temporary file and move it into place"
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as stream:
+        write(stream)
+    os.rename(tmp_path, path)
+
+
+def _save_manifest(snapshot_dir, manifest):
+    "write the manifest"
+    payload = json.dumps(manifest, indent=1, sort_keys=True)
+    _atomic_write(fp.join(snapshot_dir, _MANIFEST),
+                  lambda s: s.write(payload.encode('utf-8')))
+
+
+def slurp(reader, anno_files, snapshot_dir=None, verbose=False):
+    """
+    Drop-in replacement for `reader.slurp(anno_files)` which reads
+    documents from binary snapshots when they are fresh
+
+    Parameters
+    ----------
+    reader : educe.corpus.Reader
+        Reader to fall back to for new or modified documents
+
+    anno_files : dict(FileId, paths)
+        As returned by `reader.files()` (possibly filtered)
+
+    snapshot_dir : string or None
+        Where to keep the snapshots. If None, this is just
+        `reader.slurp`
+
+    Returns
+    -------
+    corpus : dict(FileId, Document)
+    """
+    if snapshot_dir is None:
+        return reader.slurp(anno_files, verbose=verbose)
+    if not fp.exists(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    manifest = _load_manifest(snapshot_dir)
+
+    start = time.time()
+    corpus = {}
+    stale = {}
+    touched = False
+    for key, paths in anno_files.items():
+        name = _entry_name(key)
+        entry = manifest.get(name)
+        sources = _source_paths(paths)
+        snap_path = fp.join(snapshot_dir, name + '.pickle')
+        fresh = (entry is not None and
+                 fp.exists(snap_path) and
+                 len(entry['sources']) == len(sources))
+        for record, path in zip(entry['sources'] if fresh else [],
+                                sources):
+            fresh, touched_record = _is_fresh(record, path)
+            touched = touched or touched_record
+            if not fresh:
+                break
+        if fresh:
+            try:
+                with open(snap_path, 'rb') as stream:
+                    corpus[key] = pickle.load(stream)
+                continue
+            except _UNPICKLING_ERRORS as oops:
+                # interrupted write, or saved by another version of
+                # educe: read the XML again
+                print('[snapshot] could not load {} ({}: {}), '
+                      'reading it again'.format(_key_string(key),
+                                                type(oops).__name__, oops),
+                      file=sys.stderr)
+        stale[key] = paths
+    loaded_time = time.time() - start
+
+    start = time.time()
+    if stale:
+        parsed = reader.slurp(stale, verbose=verbose)
+        for key, doc in parsed.items():
+            name = _entry_name(key)
+            _atomic_write(fp.join(snapshot_dir, name + '.pickle'),
+                          lambda s, d=doc:
+                          pickle.dump(d, s, pickle.HIGHEST_PROTOCOL))
+            manifest[name] = {'key': _key_string(key),
+                              'sources': [_describe(p) for p in
+                                          _source_paths(stale[key])]}
+            corpus[key] = doc
+    if stale or touched:
+        _save_manifest(snapshot_dir, manifest)
+    parsed_time = time.time() - start
+
+    if verbose:
+        print(('[snapshot] {} documents from snapshot ({:.2f}s), '
+               '{} parsed and saved ({:.2f}s)'
+               '').format(len(corpus) - len(stale), loaded_time,
+                          len(stale), parsed_time),
+              file=sys.stderr)
+    return corpus
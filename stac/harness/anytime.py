@@ -0,0 +1,365 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Anytime constrained decoding
+
+A beam search decoder enforcing (most of) the constraints of the ILP
+decoder (see `ilp/template.zpl`), without the external solver:
+
+* right frontier: an EDU can only attach forwards to the last EDU, or
+  to an EDU from which the last one can be reached by subordinating
+  links
+* turns: no backwards links between turns, no cycles within a turn,
+  and (optionally, like the template) each EDU attached to the
+  previous one in its turn
+* a single link from the fake root, at most `max_out_degree` links
+  from any EDU, and no links or labels with a score of zero
+
+Unlike the ILP, we only build trees (one head per EDU), scored like
+the ILP objective (attachment plus label score of each link).
+
+The search goes through the EDUs from left to right, choosing a head
+and label for each. It starts with a greedy pass (beam of 1), and then
+keeps doubling the beam until the node (or time) budget runs out,
+or until a pass with nothing pruned shows that the best structure has
+been found. Whatever happens, we return the best structure from the
+passes that did finish. The greedy pass counts against the budget
+too: if the budget runs out during it, the EDUs it has not got to are
+left unattached, so there is always an answer.
+
+Only the node budget gives the same results from one run to the
+next; a time budget depends on the machine and on its load.
+
+Without label scores (ie. in postlabelling pipelines), every link
+counts as subordinating: the right frontier is the path from the last
+EDU to the root.
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import heapq
+import itertools as itr
+import time
+
+import numpy as np
+
+from attelo.decoding import (Decoder)
+from attelo.edu import (FAKE_ROOT_ID)
+from attelo.table import (UNKNOWN, UNRELATED)
+from educe.stac.annotation import (SUBORDINATING_RELATIONS)
+
+_UNATTACHED_PENALTY = -2.
+"score for leaving an EDU with no head (worse than any link)"
+
+# pylint: disable=too-few-public-methods, too-many-instance-attributes
+
+
+class SearchStats(namedtuple('SearchStats',
+                             'passes beam nodes exhaustive seconds')):
+    """
+    What a decoding took
+
+    Parameters
+    ----------
+    passes : int
+        Number of completed passes (including a greedy pass cut
+        short by the budget)
+
+    beam : int
+        Beam size of the last completed pass
+
+    nodes : int
+        Number of partial structures considered (over all passes)
+
+    exhaustive : bool
+        True if the last pass pruned nothing (so the structure
+        found is the best one)
+
+    seconds : float
+        Time spent searching
+    """
+    pass
+
+
+class _Choice(namedtuple('_Choice', 'head pair label score sub')):
+    "a possible head and label for an EDU"
+    pass
+
+
+class _State(object):
+    "a partial structure"
+
+    def __init__(self, size):
+        self.score = 0.
+        self.heads = [-1] * size
+        self.choices = [None] * size
+        self.out_degree = [0] * size
+
+    def extend(self, edu, choice):
+        "copy of this state with an extra link (or unattached EDU)"
+        res = _State.__new__(_State)
+        res.heads = list(self.heads)
+        res.choices = list(self.choices)
+        res.out_degree = list(self.out_degree)
+        if choice is None:
+            res.score = self.score + _UNATTACHED_PENALTY
+        else:
+            res.score = self.score + choice.score
+            res.heads[edu] = choice.head
+            res.choices[edu] = choice
+            res.out_degree[choice.head] += 1
+        return res
+
+    def frontier(self, edu):
+        """EDUs on the right frontier when attaching `edu` (from the
+        last EDU, following subordinating links upwards)"""
+        node = edu - 1
+        while True:
+            yield node
+            choice = self.choices[node]
+            if choice is None or choice.head > node or not choice.sub:
+                return
+            node = choice.head
+
+    def reaches(self, start, target):
+        "True if following heads from `start` leads to `target`"
+        node = start
+        for _ in range(len(self.heads)):
+            if node == target:
+                return True
+            if node < 0:
+                return False
+            node = self.heads[node]
+        return False
+
+
+class _Problem(object):
+    """
+    The EDUs of a datapack in textual order, with the possible
+    links for each of them
+    """
+
+    def __init__(self, dpack, last_intra):
+        order = sorted(range(len(dpack.edus)),
+                       key=lambda i: dpack.edus[i].span())
+        position = {dpack.edus[i].id: p for p, i in enumerate(order)}
+        self.size = len(order)
+        self.turn = [(dpack.edus[i].grouping, dpack.edus[i].subgrouping)
+                     for i in order]
+        self.root = position.get(FAKE_ROOT_ID)
+        self.last_intra = last_intra
+        self.choices = [[] for _ in order]
+        best = self._best_labels(dpack)
+        for pair, (edu1, edu2) in enumerate(dpack.pairings):
+            head = position[edu1.id]
+            edu = position[edu2.id]
+            attach = dpack.graph.attach[pair]
+            if head == edu or attach <= 0:
+                continue
+            if head > edu and self.turn[head] != self.turn[edu]:
+                continue
+            for sub, (labels, scores) in best.items():
+                if scores[pair] >= 0:
+                    self.choices[edu].append(
+                        _Choice(head=head, pair=pair,
+                                label=labels[pair],
+                                score=attach + scores[pair],
+                                sub=sub))
+
+    @staticmethod
+    def _best_labels(dpack):
+        """
+        For subordinating (True) and coordinating (False) links,
+        the best label for each pair and its score (negative if no
+        label is allowed for the pair)
+        """
+        npairs = len(dpack.pairings)
+        if dpack.graph.label is None:
+            return {True: (np.full(npairs, dpack.label_number(UNKNOWN),
+                                   dtype=int),
+                           np.zeros(npairs))}
+        scores = np.asarray(dpack.graph.label)
+        names = list(dpack.labels)
+        res = {}
+        for sub in (True, False):
+            cols = np.array([i for i, x in enumerate(names)
+                             if x not in (UNRELATED, UNKNOWN) and
+                             (x in SUBORDINATING_RELATIONS) == sub],
+                            dtype=int)
+            if cols.size:
+                sub_scores = scores[:, cols]
+                best = sub_scores.max(axis=1)
+                best[best <= 0] = -1
+                res[sub] = (cols[sub_scores.argmax(axis=1)], best)
+        return res
+
+    def forced_previous(self, edu):
+        "True if the EDU has to attach to the previous one (same turn)"
+        return self.last_intra and edu - 1 != self.root and\
+            self.turn[edu - 1] == self.turn[edu] and\
+            any(c.head == edu - 1 for c in self.choices[edu])
+
+    def expand(self, state, edu, max_out_degree):
+        "the states that follow from choosing a link for the EDU"
+        frontier = frozenset(state.frontier(edu))
+        forced = self.forced_previous(edu)
+        res = []
+        for choice in self.choices[edu]:
+            head = choice.head
+            if forced and head != edu - 1:
+                continue
+            if head < edu and head not in frontier:
+                continue
+            if head > edu and self.last_intra:
+                continue
+            if head == self.root and state.out_degree[head] >= 1:
+                continue
+            if state.out_degree[head] >= max_out_degree:
+                continue
+            if state.reaches(head, edu):
+                continue
+            res.append(state.extend(edu, choice))
+        return res or [state.extend(edu, None)]
+
+
+class _OutOfBudget(Exception):
+    "the search budget has run out"
+    pass
+
+
+class AnytimeDecoder(Decoder):
+    """
+    Beam search decoder with right frontier and turn constraints
+    (see module docs)
+
+    Parameters
+    ----------
+    time_budget : float or None
+        Seconds to spend on a document (not reproducible)
+
+    node_budget : int or None
+        Partial structures to consider on a document
+
+    max_beam : int
+        Stop widening the beam here
+
+    last_intra : bool
+        Attach each EDU to the previous one in the same turn
+        (as in the ILP template)
+
+    max_out_degree : int
+        Links from any one EDU
+    """
+
+    def __init__(self, time_budget=None, node_budget=100000,
+                 max_beam=256, last_intra=True, max_out_degree=7):
+        self._time_budget = time_budget
+        self._node_budget = node_budget
+        self._max_beam = max_beam
+        self._last_intra = last_intra
+        self._max_out_degree = max_out_degree
+
+    def _search_pass(self, problem, beam, check, truncate=False):
+        """
+        One left to right pass with the given beam size
+
+        Parameters
+        ----------
+        truncate : bool
+            If the budget runs out, leave the remaining EDUs
+            unattached instead of giving up on the pass
+
+        Returns
+        -------
+        best : _State
+        pruned : bool
+            If any states were dropped from the beam (or EDUs left
+            out because of the budget)
+        """
+        states = [_State(problem.size)]
+        pruned = False
+        out_of_budget = False
+        for edu in range(problem.size):
+            if edu == problem.root:
+                continue
+            if out_of_budget:
+                states = [s.extend(edu, None) for s in states]
+                continue
+            following = list(itr.chain.from_iterable(
+                problem.expand(s, edu, self._max_out_degree)
+                for s in states))
+            try:
+                check(len(following))
+            except _OutOfBudget:
+                if not truncate:
+                    raise
+                out_of_budget = True
+                pruned = True
+            if len(following) > beam:
+                pruned = True
+                following = heapq.nlargest(beam, following,
+                                           key=lambda s: s.score)
+            states = following
+        return max(states, key=lambda s: s.score), pruned
+
+    def search(self, problem):
+        """
+        Best structure we can find in the budget
+
+        Returns
+        -------
+        best : _State
+        stats : SearchStats
+        """
+        start = time.time()
+        counter = {'nodes': 0, 'over': False}
+
+        def check(nodes):
+            "raise `_OutOfBudget` if we have gone over"
+            counter['nodes'] += nodes
+            if self._node_budget is not None and\
+                    counter['nodes'] > self._node_budget:
+                counter['over'] = True
+            if self._time_budget is not None and\
+                    time.time() - start > self._time_budget:
+                counter['over'] = True
+            if counter['over']:
+                raise _OutOfBudget()
+
+        best = None
+        passes = 0
+        beam = 1
+        done_beam = 0
+        exhaustive = False
+        while True:
+            try:
+                found, pruned = self._search_pass(problem, beam, check,
+                                                  truncate=best is None)
+            except _OutOfBudget:
+                break
+            passes += 1
+            done_beam = beam
+            if best is None or found.score > best.score:
+                best = found
+            if not pruned or beam >= self._max_beam or counter['over']:
+                exhaustive = not pruned
+                break
+            beam *= 2
+        stats = SearchStats(passes=passes,
+                            beam=done_beam,
+                            nodes=counter['nodes'],
+                            exhaustive=exhaustive,
+                            seconds=time.time() - start)
+        return best, stats
+
+    def decode(self, dpack, nonfixed_pairs=None):
+        problem = _Problem(dpack, self._last_intra)
+        best, _ = self.search(problem)
+        prediction = np.full(len(dpack), dpack.label_number(UNRELATED),
+                             dtype=int)
+        for choice in best.choices:
+            if choice is not None:
+                prediction[choice.pair] = choice.label
+        graph = dpack.graph.tweak(prediction=prediction)
+        return dpack.set_graph(graph)
@@ -0,0 +1,126 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Batched scoring across documents
+
+attelo parses each datapack (document) of a multipack on its own, so
+every model ends up being asked for scores hundreds of times, on
+small feature matrices; for sklearn learners like LogisticRegression
+the per-call overhead dwarfs the actual work. Before handing the
+parse jobs out, we instead stack the datapacks of the whole batch (a
+test fold in evaluation, all the input in standalone parsing), score
+them with one prediction per model, and put the scores for each
+datapack in the score cache (see `stac.harness.scores`), where the
+parsers find them when they get round to decoding.
+
+Only models wrapped with `tc_learner` (stacking) take part; anything
+else just scores document by document as usual.
+"""
+
+from __future__ import print_function
+from contextlib import contextmanager
+import types
+
+import attelo.harness.parse as ath_parse
+from attelo.parser.intra import (IntraInterPair)
+
+from .trace import (traced)
+from .util import (swapped)
+
+
+def _has_prime(obj):
+    "True if the object knows how to batch its scoring"
+    # looking on the type, not the object, so that we don't trip
+    # over wrappers that forward attribute lookups
+    return not isinstance(obj, type) and\
+        callable(getattr(type(obj), 'prime_scores', None))
+
+
+def _children(obj):
+    "objects we should look into for models"
+    if isinstance(obj, IntraInterPair):
+        # intra-sentential parsers score sentence-sized bits of the
+        # datapacks, not the datapacks we would batch up
+        return []
+    elif isinstance(obj, (list, tuple)):
+        return list(obj)
+    elif isinstance(obj, dict):
+        return list(obj.values())
+    elif isinstance(obj, (type, types.ModuleType, types.FunctionType)):
+        return []
+    elif hasattr(obj, '__dict__'):
+        return list(vars(obj).values())
+    else:
+        return []
+
+
+def scoring_models(parser):
+    """
+    Models within a parser (eg. in the steps of a pipeline) that can
+    batch their scoring
+    """
+    seen = set()
+    todo = [parser]
+    found = []
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if _has_prime(obj):
+            found.append(obj)
+        else:
+            todo.extend(_children(obj))
+    return found
+
+
+def prime_parser(parser, dpacks):
+    """
+    Score the datapacks in one go for every model in the parser that
+    supports it, so that parsing them one at a time afterwards only
+    hits the score cache
+
+    Returns
+    -------
+    primed : int
+        Number of (model, datapack) scores computed
+    """
+    dpacks = list(dpacks)
+    if len(dpacks) < 2:
+        return 0
+    primed = 0
+    with traced('score:batched', docs=len(dpacks)):
+        for model in scoring_models(parser):
+            primed += model.prime_scores(dpacks)
+    return primed
+
+
+def _batched(jobs):
+    """
+    Drop-in replacement for a job generator like
+    `attelo.harness.parse.jobs`, scoring the whole multipack before
+    generating the parse jobs
+    """
+    def batched_jobs(mpack, parser, output_path):
+        "score everything, then generate the jobs as usual"
+        prime_parser(parser, mpack.values())
+        return jobs(mpack, parser, output_path)
+    return batched_jobs
+
+
+@contextmanager
+def batched_scoring(enable=True):
+    """
+    Within this block, make attelo score each multipack in one batch
+    before parsing it (if `enable` is False, this does nothing)
+    """
+    if not enable:
+        yield
+        return
+    # attelo does not give us a hook between fitting (loading) the
+    # parser for a fold and parsing its documents, so we swap in our
+    # own job generator
+    jobs = getattr(ath_parse, 'jobs', None)
+    with swapped(ath_parse, 'jobs', _batched(jobs)):
+        yield
@@ -0,0 +1,244 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Binary (memory-mapped) version of the multipacks written by gather
+
+Loading the svmlight `.relations.sparse` text files is slow, and we
+do it for every fold, every worker and every subcommand. Here we keep
+a binary copy next to the text files:
+
+* `<features>.bin.{data,indices,indptr,target}.npy`: the feature
+  matrices and targets of all documents, stacked into one CSR matrix
+* `<features>.bin.skeleton.pickle`: everything else (EDUs, pairings,
+  labels, vocabulary), along with the rows each document occupies
+* `<features>.bin.manifest.json`: the sizes and modification times of
+  the text files the binary copy was made from
+
+The arrays are opened with copy-on-write memory mapping, so parallel
+workers share the same pages (until one of them writes to them), and
+only the parts of the matrix that are actually used get read in.
+
+Note that all of these are plain files, so they are hard-linked into
+evaluation and snapshot directories like the rest of the gathered
+data.
+"""
+
+from __future__ import print_function
+from multiprocessing import (Process, Queue)
+from os import path as fp
+import json
+import os
+import resource
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from attelo.io import (load_multipack)
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+_ARRAYS = ['data', 'indices', 'indptr', 'target']
+
+
+def _bin_path(features_path, suffix):
+    "path to a component of the binary multipack"
+    return '{}.bin.{}'.format(features_path, suffix)
+
+
+def _sources(edu_path, pairings_path, features_path, vocab_path):
+    "description of the text files a multipack is read from"
+    res = {}
+    for path in [edu_path, pairings_path, features_path, vocab_path]:
+        stat = os.stat(path)
+        res[fp.basename(path)] = [stat.st_size, stat.st_mtime]
+    return res
+
+
+def is_fresh(edu_path, pairings_path, features_path, vocab_path):
+    """
+    True if there is a binary copy of this multipack and it was made
+    from the current version of the text files
+    """
+    mpath = _bin_path(features_path, 'manifest.json')
+    if not fp.exists(mpath):
+        return False
+    with open(mpath) as stream:
+        manifest = json.load(stream)
+    try:
+        current = _sources(edu_path, pairings_path,
+                           features_path, vocab_path)
+    except OSError:
+        return False
+    return manifest == current
+
+
+def _atomic_save(path, save):
+    "write to a temporary file and move it into place"
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as stream:
+        save(stream)
+    os.rename(tmp_path, path)
+
+
+def save_binary_multipack(mpack, edu_path, pairings_path, features_path,
+                          vocab_path):
+    """
+    Write a binary copy of a multipack (which should have been read
+    from the given text files)
+    """
+    index = []
+    skeleton = {}
+    chunks = {k: [] for k in _ARRAYS}
+    row = 0
+    nnz = 0
+    for doc in sorted(mpack):
+        dpack = mpack[doc]
+        data = csr_matrix(dpack.data)
+        nrows, ncols = data.shape
+        index.append((doc, row, row + nrows, ncols))
+        chunks['data'].append(data.data)
+        chunks['indices'].append(data.indices)
+        chunks['indptr'].append(data.indptr[:-1] + nnz)
+        chunks['target'].append(np.asarray(dpack.target))
+        skeleton[doc] = dpack._replace(data=None, target=None)
+        row += nrows
+        nnz += data.nnz
+    chunks['indptr'].append(np.array([nnz]))
+
+    for key in _ARRAYS:
+        array = np.concatenate(chunks[key]) if chunks[key]\
+            else np.array([])
+        _atomic_save(_bin_path(features_path, key + '.npy'),
+                     lambda s, a=array: np.save(s, a))
+    _atomic_save(_bin_path(features_path, 'skeleton.pickle'),
+                 lambda s: pickle.dump((index, skeleton), s,
+                                       pickle.HIGHEST_PROTOCOL))
+    # manifest last: its presence says the rest is complete
+    manifest = _sources(edu_path, pairings_path, features_path, vocab_path)
+    _atomic_save(_bin_path(features_path, 'manifest.json'),
+                 lambda s: s.write(json.dumps(manifest).encode('utf-8')))
+
+
+def load_binary_multipack(features_path):
+    """
+    Read the binary copy of a multipack (without checking it is
+    fresh; see `load_multipack_fast`)
+    """
+    arrays = {k: np.load(_bin_path(features_path, k + '.npy'),
+                         mmap_mode='c')
+              for k in _ARRAYS}
+    with open(_bin_path(features_path, 'skeleton.pickle'), 'rb') as stream:
+        index, skeleton = pickle.load(stream)
+    mpack = {}
+    for doc, start, end, ncols in index:
+        indptr = np.array(arrays['indptr'][start:end + 1])
+        first, last = indptr[0], indptr[-1]
+        data = csr_matrix((arrays['data'][first:last],
+                           arrays['indices'][first:last],
+                           indptr - first),
+                          shape=(end - start, ncols))
+        mpack[doc] = skeleton[doc]._replace(data=data,
+                                            target=arrays['target'][start:end])
+    return mpack
+
+
+def load_multipack_fast(edu_path, pairings_path, features_path, vocab_path,
+                        verbose=False):
+    """
+    Drop-in replacement for `attelo.io.load_multipack`, using the
+    binary copy if it is up to date (and the text files otherwise)
+    """
+    if is_fresh(edu_path, pairings_path, features_path, vocab_path):
+        return load_binary_multipack(features_path)
+    return load_multipack(edu_path, pairings_path, features_path,
+                          vocab_path, verbose=verbose)
+
+
+def gather_binary_multipack(edu_path, pairings_path, features_path,
+                            vocab_path):
+    """
+    Read a multipack from its text files and save a binary copy
+    """
+    mpack = load_multipack(edu_path, pairings_path, features_path,
+                           vocab_path, verbose=True)
+    save_binary_multipack(mpack, edu_path, pairings_path, features_path,
+                          vocab_path)
+
+
+# ---------------------------------------------------------------------
+# measurements
+# ---------------------------------------------------------------------
+
+
+def _status_kb(field):
+    "memory counter from /proc/self/status (None if not available)"
+    try:
+        with open('/proc/self/status') as stream:
+            for line in stream:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def _measure_load(binary, paths, queue):
+    """
+    (in a child process) load a multipack and walk its feature
+    matrices, sending back the time taken and how much the peak
+    resident memory grew
+    """
+    try:
+        # reset peak RSS to the current RSS (Linux)
+        with open('/proc/self/clear_refs', 'w') as stream:
+            stream.write('5')
+    except IOError:
+        pass
+    before = _status_kb('VmRSS')
+    start = time.time()
+    if binary:
+        mpack = load_binary_multipack(paths[2])
+    else:
+        mpack = load_multipack(*paths)
+    loaded = time.time() - start
+    for dpack in mpack.values():
+        dpack.data.sum()
+    walked = time.time() - start
+    peak = _status_kb('VmHWM')
+    if peak is None or before is None:
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    else:
+        peak_kb = peak - before
+    queue.put((loaded, walked, peak_kb))
+
+
+def compare_loads(edu_path, pairings_path, features_path, vocab_path):
+    """
+    Load a multipack in both formats (each in a fresh process) and
+    return a dict from format name to (load time, load and read time,
+    peak RSS increase in kB)
+    """
+    paths = (edu_path, pairings_path, features_path, vocab_path)
+    res = {}
+    for name, binary in [('text', False), ('binary', True)]:
+        queue = Queue()
+        proc = Process(target=_measure_load, args=(binary, paths, queue))
+        proc.start()
+        res[name] = queue.get()
+        proc.join()
+    return res
+
+
+def print_comparison(features_path, comparison):
+    "print the output of `compare_loads`"
+    print('multipack load times for', fp.basename(features_path))
+    for name in ['text', 'binary']:
+        loaded, walked, peak_kb = comparison[name]
+        print(('  {:<7} load {:7.2f}s  load+read {:7.2f}s  '
+               'peak RSS +{:.1f} MB'
+               '').format(name, loaded, walked, peak_kb / 1024.))
@@ -0,0 +1,298 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Candidate pair policies
+
+Feature extraction produces a row for every pair of EDUs in a
+dialogue, most of which could never be attached anyway. A candidate
+policy says which of these pairs are worth keeping; pruning the
+extracted files right after extraction means the other rows are never
+stored, loaded, scored or decoded.
+
+Policies are named by a spec string:
+
+* `tc`: the turn constraint (see `stac.harness.turn_constraint`): the
+  pair points forwards or has the same speaker
+* `window:N`: the EDUs are at most N EDUs apart in the dialogue
+* `adjacent-turns`: the EDUs are in the same or in consecutive turns
+
+Specs can be combined with `+` (eg. `tc+window:10`) to keep only the
+pairs that all of them keep. Pairs from the fake root are always
+kept.
+
+Each pruning comes with a report of how many rows were saved, and
+how many gold edges were lost with them (if the data has gold labels).
+"""
+
+from __future__ import print_function
+from collections import namedtuple, defaultdict
+from os import path as fp
+import codecs
+import csv
+import json
+import os
+
+from attelo.table import (UNKNOWN, UNRELATED)
+
+from .turn_constraint import (SAME_SPEAKER)
+
+_ROOT = 'ROOT'
+
+# pylint: disable=too-few-public-methods
+
+
+class Policy(namedtuple('Policy', 'spec keep')):
+    """
+    A candidate policy
+
+    :type keep: `(PairContext, string, string, string) -> bool`
+                (context, edu1 id, edu2 id, features line)
+    """
+    pass
+
+
+class _Edu(namedtuple('_Edu', 'grouping subgrouping start end')):
+    "what we need to know about an EDU"
+
+    def span(self):
+        "(start, end)"
+        return (self.start, self.end)
+
+
+class PairContext(object):
+    """
+    Information about the EDUs in a multipack that the policies use
+    to decide on pairs
+    """
+
+    def __init__(self, edu_path, vocab_path):
+        self.edus = {}
+        with open(edu_path, 'r') as stream:
+            for row in csv.reader(stream, dialect=csv.excel_tab):
+                self.edus[row[0]] = _Edu(grouping=row[2],
+                                         subgrouping=row[3],
+                                         start=int(row[4]),
+                                         end=int(row[5]))
+        by_group = defaultdict(list)
+        for edu_id, edu in self.edus.items():
+            by_group[edu.grouping].append((edu.span(), edu_id))
+        self.position = {}
+        self.turn_index = {}
+        for members in by_group.values():
+            members.sort()
+            turns = []
+            for i, (_, edu_id) in enumerate(members):
+                self.position[edu_id] = i
+                turn = self.edus[edu_id].subgrouping
+                if turn not in turns:
+                    turns.append(turn)
+                self.turn_index[edu_id] = turns.index(turn)
+        self.same_speaker = _feature_index(vocab_path, SAME_SPEAKER)
+
+
+def _feature_index(vocab_path, feature):
+    "index of a feature in the vocabulary (None if not there)"
+    with codecs.open(vocab_path, 'r', 'utf-8') as stream:
+        for i, line in enumerate(stream):
+            if line.split('\t')[0].strip() == feature:
+                return i
+    return None
+
+
+def _has_feature(line, index):
+    "True if an svmlight row has the feature with the given index"
+    prefix = '{}:'.format(index)
+    return any(x.startswith(prefix) for x in line.split()[1:])
+
+
+# ---------------------------------------------------------------------
+# policies
+# ---------------------------------------------------------------------
+
+
+def _turn_constraint(ctx, id1, id2, line):
+    "forwards or same speaker"
+    if ctx.edus[id2].span() > ctx.edus[id1].span():
+        return True
+    return ctx.same_speaker is not None and\
+        _has_feature(line, ctx.same_speaker)
+
+
+def _window(size):
+    "EDUs at most `size` apart"
+    def keep(ctx, id1, id2, _):
+        "EDUs close enough"
+        return abs(ctx.position[id1] - ctx.position[id2]) <= size
+    return keep
+
+
+def _adjacent_turns(ctx, id1, id2, _):
+    "EDUs in the same or in consecutive turns"
+    return abs(ctx.turn_index[id1] - ctx.turn_index[id2]) <= 1
+
+
+def _single_policy(spec):
+    "policy for a spec with no `+`"
+    name, _, arg = spec.partition(':')
+    if name == 'tc' and not arg:
+        return _turn_constraint
+    elif name == 'window' and arg.isdigit():
+        return _window(int(arg))
+    elif name == 'adjacent-turns' and not arg:
+        return _adjacent_turns
+    else:
+        raise ValueError('Unknown candidate policy: ' + spec)
+
+
+def read_policy(spec):
+    """
+    Policy corresponding to a spec string (see module docs)
+    """
+    parts = [_single_policy(x) for x in spec.split('+')]
+
+    def keep(ctx, id1, id2, line):
+        "keep the pair if all the parts do"
+        if id1 == _ROOT or id2 == _ROOT:
+            return True
+        return all(p(ctx, id1, id2, line) for p in parts)
+    return Policy(spec=spec, keep=keep)
+
+
+# ---------------------------------------------------------------------
+# pruning
+# ---------------------------------------------------------------------
+
+
+def _labels(header):
+    "labels from the svmlight header comment (if any)"
+    prefix = '# labels: '
+    for line in header:
+        if line.startswith(prefix):
+            return line[len(prefix):].split()
+    return None
+
+
+def _read_features(path):
+    "header (comment) lines, then body lines of an svmlight file"
+    header = []
+    body = []
+    with open(path, 'r') as stream:
+        for line in stream:
+            if not body and line.startswith('#'):
+                header.append(line)
+            else:
+                body.append(line)
+    return header, body
+
+
+def _is_gold(labels, line):
+    """
+    True if an svmlight row is a gold edge
+
+    Targets are 1-based: the header leaves out UNKNOWN, which is 0
+    """
+    if labels is None:
+        return False
+    target = int(float(line.split(None, 1)[0]))
+    if target == 0:
+        return False
+    return labels[target - 1] not in (UNRELATED, UNKNOWN)
+
+
+def _filter_file(path, keep, header=None, body=None):
+    "keep only the selected lines (after the header) of a file"
+    if header is None:
+        header, body = _read_features(path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as stream:
+        stream.writelines(header)
+        stream.writelines(l for l, k in zip(body, keep) if k)
+    os.rename(tmp_path, path)
+
+
+def _tally(rows, golds, keep):
+    "report for one policy"
+    kept = sum(1 for k in keep if k)
+    gold = sum(1 for g in golds if g)
+    gold_kept = sum(1 for g, k in zip(golds, keep) if g and k)
+    return {'rows': rows,
+            'kept': kept,
+            'rows_saved': 1. - float(kept) / rows if rows else 0.,
+            'gold': gold,
+            'gold_kept': gold_kept,
+            'recall_lost': 1. - float(gold_kept) / gold if gold else 0.}
+
+
+def prune_candidates(edu_path, pairings_path, features_path, vocab_path,
+                     policy=None, compare=None):
+    """
+    Prune the extracted pairs of a multipack in place (the pairings,
+    features, and stripped features if any), keeping only the pairs
+    the policy accepts
+
+    Parameters
+    ----------
+    policy : string or None
+        Spec of the policy to apply (None to just report)
+
+    compare : [string], optional
+        Specs of other policies to report on (without applying them)
+
+    Returns
+    -------
+    report : dict(string, dict)
+        For each policy, the number of rows before and after, and of
+        gold edges before and after (see `print_report`)
+    """
+    specs = list(compare or [])
+    if policy is not None and policy not in specs:
+        specs.append(policy)
+    if not specs:
+        return {}
+    policies = [read_policy(s) for s in specs]
+    ctx = PairContext(edu_path, vocab_path)
+    header, body = _read_features(features_path)
+    labels = _labels(header)
+    with open(pairings_path, 'r') as stream:
+        pairs = [row[:2] for row in
+                 csv.reader(stream, dialect=csv.excel_tab)]
+    if len(pairs) != len(body):
+        raise ValueError('{} and {} have different numbers of rows'
+                         ''.format(pairings_path, features_path))
+    golds = [_is_gold(labels, l) for l in body]
+    report = {}
+    keeps = {}
+    for pol in policies:
+        keeps[pol.spec] = [pol.keep(ctx, id1, id2, line)
+                           for (id1, id2), line in zip(pairs, body)]
+        report[pol.spec] = _tally(len(body), golds, keeps[pol.spec])
+
+    if policy is not None:
+        keep = keeps[policy]
+        _filter_file(features_path, keep, header, body)
+        _filter_file(pairings_path, keep)
+        stripped_path = features_path + '.stripped'
+        if fp.exists(stripped_path):
+            _filter_file(stripped_path, keep)
+        report[policy]['applied'] = True
+    with open(features_path + '.candidates.json', 'w') as stream:
+        json.dump(report, stream, indent=1, sort_keys=True)
+    return report
+
+
+def print_report(name, report):
+    """
+    Print a report from `prune_candidates`
+    """
+    if not report:
+        return
+    print('[candidates] {}'.format(name))
+    print('{:<24} {:>10} {:>10} {:>12}'.format('policy', 'rows kept',
+                                               'saved', 'recall lost'))
+    for spec, res in sorted(report.items()):
+        print('{:<24} {:>10} {:>9.1%} {:>12}{}'
+              ''.format(spec, res['kept'], res['rows_saved'],
+                        '{:.2%}'.format(res['recall_lost'])
+                        if res['gold'] else 'n/a',
+                        '  (applied)' if res.get('applied') else ''))
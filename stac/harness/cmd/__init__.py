@@ -1,29 +1,54 @@
 """
 irit-rst-dt subcommands
+
+Subcommand modules are only imported when they are actually run (most
+of them pull in heavy dependencies: attelo, educe, sklearn, zmq...).
+Each module provides `NAME`, `config_argparser` and `main`.
 """
 
 # Author: Eric Kow
 # License: CeCILL-B (French BSD3)
 
-from . import (clean,
-               count,
-               evaluate,
-               gather,
-               model,
-               parse,
-               preview,
-               serve,
-               stop)
+from os import path as fp
+import ast
+import importlib
 
 SUBCOMMANDS =\
     [
-        gather,
-        preview,
-        evaluate,
-        count,
-        clean,
-        model,
-        parse,
-        serve,
-        stop,
+        ('gather', 'gather'),
+        ('preview', 'preview'),
+        ('evaluate', 'evaluate'),
+        ('sweep', 'sweep'),
+        ('count', 'count'),
+        ('corpus-cache', 'corpus_cache'),
+        ('clean', 'clean'),
+        ('model', 'model'),
+        ('parse', 'parse'),
+        ('serve', 'serve'),
+        ('metrics', 'metrics'),
+        ('replay', 'replay'),
+        ('stop', 'stop'),
+        ('bench', 'bench'),
+        ('profile', 'profile'),
     ]
+"(name, module) for each subcommand"
+
+
+def load(name):
+    """
+    Import and return the module for the named subcommand
+    """
+    return importlib.import_module('.' + dict(SUBCOMMANDS)[name], __name__)
+
+
+def summary(name):
+    """
+    One line help for the named subcommand: the first paragraph of
+    its module docstring (read from the source, so that listing the
+    subcommands does not mean importing them)
+    """
+    path = fp.join(fp.dirname(fp.abspath(__file__)),
+                   dict(SUBCOMMANDS)[name] + '.py')
+    with open(path, 'rb') as stream:
+        doc = ast.get_docstring(ast.parse(stream.read())) or ''
+    return ' '.join(doc.split('\n\n')[0].split())
@@ -0,0 +1,656 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+time the parsing pipeline (and compare against a baseline)
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+from fnmatch import fnmatch
+from os import path as fp
+import argparse
+import atexit
+import codecs
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from ..local import (LOCAL_TMP, TAGGER_JAR)
+from ..trace import (TRACE_ENV, read_records)
+from ..util import (latest_tmp, load_script)
+
+NAME = 'bench'
+
+ROOT_DIR = fp.dirname(fp.dirname(fp.dirname(fp.dirname(
+    fp.abspath(__file__)))))
+"root of the STAC code"
+
+SAMPLES = [fp.join(ROOT_DIR, 'parser', 'sample.soclog'),
+           fp.join(ROOT_DIR, 'parser', 'big-sample-s2-league5-game0.soclog')]
+
+BENCH_DIR = fp.join(LOCAL_TMP, 'bench')
+
+SERVE_TIMEOUT = 600
+"seconds to wait for the server to answer the serve benchmark"
+
+
+class Skip(Exception):
+    "a benchmark can't be run here (missing data or dependencies)"
+    pass
+
+
+# ---------------------------------------------------------------------
+# micro benchmarks
+# ---------------------------------------------------------------------
+
+
+def _script(relpath):
+    "load one of our scripts (skipping if it can't be imported)"
+    try:
+        return load_script(fp.join(ROOT_DIR, relpath))
+    except ImportError as oops:
+        raise Skip('{}: {}'.format(relpath, oops))
+
+
+def _sample_turns(soclog, gen=3):
+    "turns extracted from a sample soclog"
+    soclogtocsv = _script('intake/soclogtocsv.py')
+    with codecs.open(soclog, 'r', 'utf-8') as stream:
+        return list(soclogtocsv.soclog_to_turns(stream, sel_gen=gen))
+
+
+def bench_soclog_to_turns(soclog):
+    "soclog -> turns (intake/soclogtocsv.py)"
+    soclogtocsv = _script('intake/soclogtocsv.py')
+
+    def work():
+        with codecs.open(soclog, 'r', 'utf-8') as stream:
+            for _ in soclogtocsv.soclog_to_turns(stream):
+                pass
+    return work
+
+
+def bench_segment(soclog):
+    "EDU segmentation of each turn (segmentation/segmentation.py)"
+    try:
+        segmentation = _script('segmentation/segmentation.py')
+    except LookupError as oops:
+        # nltk tokenizer not installed
+        raise Skip(str(oops))
+    texts = [t.rawtext for t in _sample_turns(soclog)]
+
+    def work():
+        for text in texts:
+            segmentation.segment(text)
+    return work
+
+
+def bench_process_turns(soclog):
+    "turns -> glozz (intake/csvtoglozz.py)"
+    csvtoglozz = _script('intake/csvtoglozz.py')
+    turns = _sample_turns(soclog)
+    return lambda: csvtoglozz.process_turns(turns, 3)
+
+
+def bench_turn_constraint(_):
+    "turn constraint selection over the gathered training data"
+    from ..binary_mpack import (load_multipack_fast)
+    from ..harness import (IritHarness)
+    from ..turn_constraint import (turn_constraint_safe)
+    from attelo.harness.config import (RuntimeConfig)
+
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        raise Skip('no gathered data')
+    hconf = IritHarness()
+    hconf.load(RuntimeConfig.empty(), data_dir, data_dir)
+    paths = hconf.mpack_paths(False)
+    if not fp.exists(paths['edu_input']):
+        raise Skip('no gathered data')
+    mpack = load_multipack_fast(paths['edu_input'], paths['pairings'],
+                                paths['features'], paths['vocab'])
+
+    def work():
+        for dpack in mpack.values():
+            turn_constraint_safe(dpack)
+    return work
+
+
+def bench_fold_scoring(_):
+    "attachment scoring of a test fold, batched vs per datapack"
+    from .. import scores
+    from ..local import (maxent)
+    from .sweep import (_load_fold, _stack)
+
+    try:
+        train, test = _load_fold(0)
+    except SystemExit:
+        raise Skip('no gathered data')
+    learner = maxent()
+    learner.fit(*_stack(train)[0])
+    dpacks = list(test.values())
+
+    def predict(dpack):
+        "attachment scores"
+        return learner.predict_proba(dpack.data)[:, 1]
+
+    def work():
+        scores.set_cache_dir(None)
+        start = time.time()
+        for dpack in dpacks:
+            scores.cached_scores('bench', dpack,
+                                 lambda d=dpack: predict(d))
+        per_document = time.time() - start
+        scores.set_cache_dir(None)
+        start = time.time()
+        scores.prime_scores('bench', dpacks, predict)
+        for dpack in dpacks:
+            scores.cached_scores('bench', dpack,
+                                 lambda d=dpack: predict(d))
+        batched = time.time() - start
+        return {'fold_scoring': batched,
+                'per_document': per_document}
+    return work
+
+
+# the micro benchmarks below work on the intermediary files of a
+# parse run, so they need the same things as `bench_parse`
+
+_PARSED = {}
+"configuration for a parse run on each soclog (None if it failed)"
+
+
+def _parsed(soclog):
+    """
+    Configuration pointing to the intermediary files of an
+    `irit-stac parse` run on the soclog (the run is made the first
+    time we ask, and its files kept until we exit)
+    """
+    _check_parser()
+    if soclog not in _PARSED:
+        from ..pipeline import (StandaloneParser, stub_name)
+        scratch = tempfile.mkdtemp(prefix='stac-bench')
+        atexit.register(shutil.rmtree, scratch, True)
+        tmp_dir = fp.join(scratch, stub_name(soclog))
+        proc = _irit_stac(['parse', soclog, fp.join(scratch, 'output'),
+                           '--tmpdir', tmp_dir],
+                          fp.join(scratch, 'trace.jsonl'))
+        _PARSED[soclog] = StandaloneParser(soclog=soclog, tmp_dir=tmp_dir)\
+            if proc.wait() == 0 else None
+    if _PARSED[soclog] is None:
+        raise Skip('irit-stac parse failed')
+    return _PARSED[soclog]
+
+
+def _main_evaluation(lconf):
+    "the evaluation whose output the server would use"
+    return lconf.test_evaluation or lconf.evaluations[0]
+
+
+def _read_stage(lconf, stage):
+    "documents of the parsed soclog at the given stage"
+    import educe.stac
+    from ..pipeline import (minicorpus_path)
+
+    reader = educe.stac.Reader(minicorpus_path(lconf))
+    return reader.slurp({k: v for k, v in reader.files().items()
+                         if k.stage == stage})
+
+
+def bench_extract_features(soclog):
+    "dialogue act features of each EDU (stac/unit_annotations.py)"
+    import educe.stac.learning.features as stac_features
+    from attelo.io import (load_vocab)
+    from ..local import (LEX_DIR)
+    from ..pipeline import (dact_features_path, minicorpus_path)
+
+    lconf = _parsed(soclog)
+    unit_annotations = _script('stac/unit_annotations.py')
+    features_path = dact_features_path(lconf)
+    # as in unit_annotations.command_annotate
+    args = argparse.Namespace(corpus=minicorpus_path(lconf),
+                              resources=lconf.abspath(LEX_DIR),
+                              vocabulary=features_path + '.vocab',
+                              labels=features_path,
+                              output=None,
+                              ignore_cdus=False,
+                              parsing=True,
+                              single=True,
+                              strip_mode='head')
+    inputs = stac_features.read_corpus_inputs(args)
+    vocab = {f: i for i, f in enumerate(load_vocab(args.vocabulary))}
+    edus_plus = list(unit_annotations.get_edus_plus(inputs))
+    return lambda: unit_annotations.extract_features(vocab, edus_plus)
+
+
+def bench_decode(soclog):
+    """
+    decoding the parsed soclog with each of the evaluations (the
+    scores are computed once beforehand, so this is mostly the
+    decoders themselves, as long as the scores fit in memory; see
+    `stac.harness.scores.MEMORY_SIZE`)
+    """
+    from ..binary_mpack import (load_multipack_fast)
+    from ..pipeline import (minicorpus_path)
+
+    lconf = _parsed(soclog)
+    fpath = minicorpus_path(lconf) + '.relations.sparse'
+    mpack = load_multipack_fast(fpath + '.edu_input',
+                                fpath + '.pairings',
+                                fpath,
+                                lconf.mpack_paths(test_data=False)['vocab'])
+    parsers = []
+    for econf in lconf.evaluations:
+        parser = econf.parser.payload
+        parser.fit([], [], cache=lconf.model_paths(econf.learner, None,
+                                                   econf.parser))
+        parsers.append((econf.key, parser))
+
+    def work():
+        "time per evaluation"
+        times = {}
+        for key, parser in parsers:
+            start = time.time()
+            for dpack in mpack.values():
+                parser.transform(dpack)
+            times[key] = time.time() - start
+        return times
+    work()
+    return work
+
+
+def bench_add_predictions(soclog):
+    "adding the predicted relations to the Glozz documents (attelo_out)"
+    import educe.stac.util.glozz as stac_glozz
+    from attelo.io import (load_predictions)
+    from stac import attelo_out as pout
+    from ..pipeline import (attelo_result_path)
+
+    lconf = _parsed(soclog)
+    corpus = _read_stage(lconf, 'unannotated')
+    predictions = load_predictions(
+        attelo_result_path(lconf, _main_evaluation(lconf)))
+
+    def work():
+        "as in parser/parse-to-glozz"
+        corpus2 = pout.copy_discourse_corpus(corpus, 'bench')
+        for doc in corpus2.values():
+            # the copies share their relations with the originals
+            doc.relations = list(doc.relations)
+        pout.add_predictions(stac_glozz.PseudoTimestamper(), corpus2,
+                             predictions)
+    return work
+
+
+def bench_to_settlers_xml(soclog):
+    "parser output -> Settlers XML (parser/to_settlers_xml)"
+    from educe.stac.context import (Context)
+    from ..pipeline import (attelo_result_path)
+
+    lconf = _parsed(soclog)
+    to_stx = _script('parser/to_settlers_xml')
+    corpus = _read_stage(lconf, 'units')
+    contexts = {}
+    for doc in corpus.values():
+        contexts.update(Context.for_edus(doc))
+    # pylint: disable=protected-access
+    background = to_stx.Background(contexts=contexts,
+                                   resources=to_stx._extract_resources([]))
+    with open(attelo_result_path(lconf, _main_evaluation(lconf))) as stream:
+        predictions = list(to_stx.read_tsv(stream))
+    doc = list(corpus.values())[0]
+
+    def work():
+        "as in to_settlers_xml.main"
+        l_turns = to_stx._extract(doc, background, predictions)
+        to_stx._to_stx(l_turns).write(io.BytesIO())
+    # pylint: enable=protected-access
+    return work
+
+
+MICRO = [('soclog_to_turns', bench_soclog_to_turns),
+         ('segment', bench_segment),
+         ('process_turns', bench_process_turns),
+         ('turn_constraint_safe', bench_turn_constraint),
+         ('fold_scoring', bench_fold_scoring),
+         ('extract_features', bench_extract_features),
+         ('decode', bench_decode),
+         ('add_predictions', bench_add_predictions),
+         ('to_settlers_xml', bench_to_settlers_xml)]
+
+
+# ---------------------------------------------------------------------
+# macro benchmarks
+# ---------------------------------------------------------------------
+
+
+def _irit_stac(args, trace_path, **kwargs):
+    "run an irit-stac command with tracing on"
+    env = dict(os.environ)
+    env[TRACE_ENV] = trace_path
+    cmd = [sys.executable, fp.join(ROOT_DIR, 'irit-stac')] + args
+    return subprocess.Popen(cmd, env=env, cwd=ROOT_DIR, **kwargs)
+
+
+def _check_parser():
+    "skip unless we have what we need to run the standalone parser"
+    from ..pipeline import (latest_snap)
+    if not fp.exists(fp.join(ROOT_DIR, latest_snap())):
+        raise Skip('no parser models (irit-stac model)')
+    if not fp.isfile(fp.join(ROOT_DIR, TAGGER_JAR)):
+        raise Skip('no POS tagger ({})'.format(TAGGER_JAR))
+
+
+def _trace_times(trace_path):
+    """
+    Total time per name of traced work (the pipeline stages and
+    decoders)
+    """
+    totals = defaultdict(float)
+    if fp.exists(trace_path):
+        for rec in read_records(trace_path):
+            totals[rec['name']] += rec['wall']
+    return dict(totals)
+
+
+def bench_parse(soclog):
+    """
+    end to end standalone parsing; also reports time per stage and
+    per decoder (unit annotations, feature extraction, decoding,
+    formatting with attelo_out...)
+    """
+    _check_parser()
+
+    def work():
+        scratch = tempfile.mkdtemp(prefix='stac-bench')
+        try:
+            trace_path = fp.join(scratch, 'trace.jsonl')
+            out_dir = fp.join(scratch, 'output')
+            proc = _irit_stac(['parse', soclog, out_dir], trace_path)
+            if proc.wait() != 0:
+                raise Exception('irit-stac parse failed')
+            return _trace_times(trace_path)
+        finally:
+            shutil.rmtree(scratch, True)
+    return work
+
+
+def _free_port():
+    "a port nobody is listening on (probably)"
+    sock = socket.socket()
+    sock.bind(('', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def bench_serve(soclog):
+    """
+    latency of a single server request for the whole soclog; also
+    reports time per server stage (including to_settlers_xml)
+    """
+    _check_parser()
+    try:
+        import zmq
+    except ImportError:
+        raise Skip('no zmq')
+    with open(soclog, 'rb') as stream:
+        payload = stream.read()
+
+    def wait_for_answer(sock, proc):
+        "the server's answer (if it answers before dying or timing out)"
+        start = time.time()
+        while time.time() - start < SERVE_TIMEOUT:
+            if sock.poll(1000):
+                return sock.recv()
+            if proc.poll() is not None:
+                raise Exception('irit-stac serve died (exit code {})'
+                                ''.format(proc.returncode))
+        raise Exception('irit-stac serve did not answer in {}s'
+                        ''.format(SERVE_TIMEOUT))
+
+    def work():
+        scratch = tempfile.mkdtemp(prefix='stac-bench')
+        trace_path = fp.join(scratch, 'trace.jsonl')
+        port = _free_port()
+        proc = _irit_stac(['serve', '--port', str(port),
+                           '--tmpdir', fp.join(scratch, 'serve')],
+                          trace_path)
+        context = zmq.Context()
+        sock = context.socket(zmq.REQ)  # pylint: disable=no-member
+        sock.setsockopt(zmq.LINGER, 0)  # pylint: disable=no-member
+        sock.connect('tcp://localhost:{}'.format(port))
+        try:
+            sock.send(payload)
+            wait_for_answer(sock, proc)
+            # the server only writes its trace for the request after
+            # answering it
+            deadline = time.time() + 30
+            times = _trace_times(trace_path)
+            while 'serve:request' not in times and\
+                    proc.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+                times = _trace_times(trace_path)
+        finally:
+            sock.close()
+            context.term()
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+            shutil.rmtree(scratch, True)
+        # the request itself, not the server start up time
+        times['serve'] = times.pop('serve:request', None)
+        return times
+    return work
+
+
+MACRO = [('parse', bench_parse),
+         ('serve', bench_serve)]
+
+
+# ---------------------------------------------------------------------
+# running
+# ---------------------------------------------------------------------
+
+
+def _git_revision():
+    "current git revision (if any)"
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=ROOT_DIR).strip().decode('ascii')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine_metadata():
+    "what we're running on"
+    import numpy
+    import scipy
+    return {'hostname': platform.node(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'scipy': scipy.__version__,
+            'git_revision': _git_revision()}
+
+
+def _summary(times):
+    "summary statistics for a list of timings"
+    times = sorted(times)
+    return {'runs': times,
+            'min': times[0],
+            'median': times[len(times) // 2]}
+
+
+def _run_case(name, setup, soclog, repeat):
+    """
+    Run a benchmark, returning a dict of results (for the case
+    and any details it reports)
+
+    The benchmark may return a dictionary of detailed timings; if
+    it has an entry for the benchmark itself, that replaces our
+    own timing
+    """
+    work = setup(soclog)
+    timings = defaultdict(list)
+    for _ in range(repeat):
+        start = time.time()
+        details = work() or {}
+        elapsed = details.pop(name, None) or time.time() - start
+        timings[name].append(elapsed)
+        for key, value in details.items():
+            timings[name + '/' + key].append(value)
+    return {k: _summary(v) for k, v in timings.items()}
+
+
+def run_benchmarks(soclog, repeat, macro_repeat, pattern=None):
+    "run all the benchmarks, return the results (JSON-friendly)"
+    results = {}
+    skipped = {}
+    for cases, rep in [(MICRO, repeat), (MACRO, macro_repeat)]:
+        for name, setup in cases:
+            if pattern is not None and not fnmatch(name, pattern):
+                continue
+            print('[bench] {}...'.format(name), file=sys.stderr)
+            try:
+                results.update(_run_case(name, setup, soclog, rep))
+            except Skip as oops:
+                skipped[name] = str(oops)
+                print('[bench] skipped {}: {}'.format(name, oops),
+                      file=sys.stderr)
+    return {'machine': machine_metadata(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'soclog': fp.basename(soclog),
+            'results': results,
+            'skipped': skipped}
+
+
+# ---------------------------------------------------------------------
+# comparing
+# ---------------------------------------------------------------------
+
+
+def compare(baseline, current, threshold, thresholds=None):
+    """
+    Compare median times against a baseline
+
+    Returns
+    -------
+    rows : [(name, baseline, current, ratio, regressed)]
+        for each benchmark present in both
+    """
+    thresholds = thresholds or {}
+    rows = []
+    for name in sorted(current['results']):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['median']
+        new = current['results'][name]['median']
+        ratio = new / old if old else float('inf')
+        limit = threshold
+        for pattern, value in thresholds.items():
+            if fnmatch(name, pattern):
+                limit = value
+        rows.append((name, old, new, ratio, ratio > 1 + limit))
+    return rows
+
+
+def print_comparison(rows):
+    "print the output of `compare`"
+    print('{:<50} {:>10} {:>10} {:>8}'.format('benchmark', 'baseline',
+                                            'current', 'ratio'))
+    for name, old, new, ratio, regressed in rows:
+        print('{:<50} {:>9.3f}s {:>9.3f}s {:>7.2f}x{}'
+              ''.format(name[:50], old, new, ratio,
+                        '  REGRESSION' if regressed else ''))
+
+
+def print_results(results):
+    "print benchmark results"
+    for name, res in sorted(results['results'].items()):
+        print('{:<50} median {:>9.3f}s  min {:>9.3f}s'
+              ''.format(name[:50], res['median'], res['min']))
+    for name, reason in sorted(results['skipped'].items()):
+        print('{:<50} skipped ({})'.format(name, reason))
+
+
+# ---------------------------------------------------------------------
+# main
+# ---------------------------------------------------------------------
+
+
+def _parse_threshold(spec):
+    "PATTERN=FRACTION"
+    pattern, _, value = spec.rpartition('=')
+    return pattern, float(value)
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("--soclog", metavar="FILE", default=SAMPLES[0],
+                     help="input for the benchmarks (default: {})"
+                     "".format(fp.relpath(SAMPLES[0], ROOT_DIR)))
+    psr.add_argument("--only", metavar="PATTERN",
+                     help="only run benchmarks matching this pattern")
+    psr.add_argument("--repeat", type=int, default=5,
+                     help="runs per micro benchmark")
+    psr.add_argument("--macro-repeat", type=int, default=1,
+                     help="runs per end-to-end benchmark")
+    psr.add_argument("--output", metavar="FILE",
+                     help="save results here (default: "
+                     "{}/bench-<date>.json)".format(BENCH_DIR))
+    psr.add_argument("--baseline", metavar="FILE",
+                     help="compare against these saved results")
+    psr.add_argument("--threshold", type=float, default=0.1,
+                     help="slowdown (fraction of baseline median) "
+                     "counted as a regression (default 0.1)")
+    psr.add_argument("--case-threshold", metavar="PATTERN=FRACTION",
+                     type=_parse_threshold, action='append', default=[],
+                     help="threshold for benchmarks matching PATTERN")
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    results = run_benchmarks(fp.abspath(args.soclog),
+                             args.repeat, args.macro_repeat,
+                             pattern=args.only)
+    output = args.output or\
+        fp.join(BENCH_DIR, 'bench-{}.json'.format(results['date']))
+    if fp.dirname(output) and not fp.exists(fp.dirname(output)):
+        os.makedirs(fp.dirname(output))
+    with open(output, 'w') as stream:
+        json.dump(results, stream, indent=1, sort_keys=True)
+    print_results(results)
+    print('saved to', output, file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        rows = compare(baseline, results, args.threshold,
+                       dict(args.case_threshold))
+        print()
+        print_comparison(rows)
+        if any(r[4] for r in rows):
+            sys.exit(1)
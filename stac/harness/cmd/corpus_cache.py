@@ -0,0 +1,69 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+build binary snapshots of the corpus (and time loading them)
+"""
+
+from __future__ import print_function
+from os import path as fp
+import time
+
+import educe.stac
+
+from ..local import (CORPUS_CACHE,
+                     TRAINING_CORPUS)
+import stac.corpus_cache as corpus_cache
+
+NAME = 'corpus-cache'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("--corpus", metavar="DIR",
+                     default=TRAINING_CORPUS,
+                     help="corpus to snapshot (default: training corpus)")
+    psr.add_argument("--snapshot-dir", metavar="DIR",
+                     help="where to put the snapshots "
+                     "(default: {}/<corpus name>)".format(CORPUS_CACHE))
+
+
+def _timed(fun):
+    "run a function, return its result and the time it took"
+    start = time.time()
+    res = fun()
+    return res, time.time() - start
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    snapshot_dir = args.snapshot_dir or\
+        fp.join(CORPUS_CACHE, fp.basename(fp.normpath(args.corpus)))
+    reader = educe.stac.Reader(args.corpus)
+    anno_files = reader.files()
+
+    corpus, xml_time = _timed(lambda: reader.slurp(anno_files))
+    _, refresh_time = _timed(lambda: corpus_cache.slurp(reader, anno_files,
+                                                        snapshot_dir))
+    snap, snap_time = _timed(lambda: corpus_cache.slurp(reader, anno_files,
+                                                        snapshot_dir))
+    assert len(snap) == len(corpus)
+
+    print("Corpus:", args.corpus, "({} documents)".format(len(corpus)))
+    print("Snapshots:", snapshot_dir)
+    print()
+    print("{:<24}{:>10}".format("load", "seconds"))
+    print("{:<24}{:>10.2f}".format("glozz xml", xml_time))
+    print("{:<24}{:>10.2f}".format("snapshot (refresh)", refresh_time))
+    print("{:<24}{:>10.2f}".format("snapshot (fresh)", snap_time))
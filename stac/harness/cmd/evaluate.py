@@ -10,6 +10,8 @@ from __future__ import print_function
 from attelo.harness import (RuntimeConfig, ClusterStage)
 
 from ..harness import (IritHarness)
+from ..pruning import (run_pruned)
+from ..scheduler import (LocalScheduler)
 
 # pylint: disable=too-few-public-methods
 
@@ -56,6 +58,20 @@ def config_argparser(psr):
     cluster_grp.add_argument("--end", action='store_true',
                              default=False,
                              help="generate report only (cluster mode)")
+    cluster_grp.add_argument("--scheduler", choices=['local'],
+                             help="run the cluster mode stages as "
+                             "processes on this machine (each taking "
+                             "n-jobs slots)")
+    cluster_grp.add_argument("--prune", action='store_true',
+                             help="run configurations on a few folds "
+                             "at a time, dropping dominated ones as we go")
+    psr.add_argument("--prune-rungs", metavar='N', type=int, nargs='+',
+                     default=[2, 5],
+                     help="with --prune: prune after this many folds "
+                     "(default: 2 5)")
+    psr.add_argument("--slots", metavar='N', type=int,
+                     help="slots available to --scheduler local "
+                     "(default: number of CPUs)")
 
 
 def args_to_stage(args):
@@ -86,6 +102,13 @@ def main(args):
         mode = 'jumpstart'
     else:
         mode = None
+    if args.scheduler == 'local':
+        n_jobs = args.n_jobs if args.n_jobs > 0 else 1
+        LocalScheduler(mode, slots=args.slots, n_jobs=n_jobs).run()
+        return
+    if args.prune:
+        run_pruned(mode, args.n_jobs, args.prune_rungs)
+        return
     runcfg = RuntimeConfig(mode=mode,
                            folds=args.folds,
                            stage=args_to_stage(args),
@@ -11,10 +11,17 @@ import os
 
 from attelo.harness.util import call, force_symlink
 
+from ..binary_mpack import (compare_loads,
+                            gather_binary_multipack,
+                            print_comparison)
+from ..candidates import (prune_candidates, print_report)
 from ..local import (TEST_CORPUS,
                      TRAINING_CORPUS,
                      LEX_DIR,
-                     ANNOTATORS)
+                     ANNOTATORS,
+                     CANDIDATE_POLICY,
+                     CANDIDATE_POLICIES)
+from ..trace import (traced)
 from ..util import (current_tmp, latest_tmp)
 
 NAME = 'gather'
@@ -34,11 +41,27 @@ def config_argparser(psr):
                     choices=['head', 'broadcast', 'custom'],
                     default='head',
                     help='CDUs stripping method')
+    psr.add_argument('--candidates', metavar='POLICY',
+                     default=CANDIDATE_POLICY,
+                     help='keep only the EDU pairs this candidate '
+                     'policy accepts, eg. tc, window:10, adjacent-turns '
+                     '(default from local.py: {})'.format(CANDIDATE_POLICY))
+    psr.add_argument('--candidates-report',
+                     default=False, action='store_true',
+                     help='report how many rows each of the candidate '
+                     'policies in local.py would save, and how much '
+                     'gold recall they would lose')
+    psr.add_argument('--compare-loads',
+                     default=False, action='store_true',
+                     help='report how long the text and binary '
+                     'features take to load (loads each of them in a '
+                     'fresh process)')
     psr.set_defaults(func=main)
 
 
 def extract_features(corpus, output_dir,
-                     vocab_path=None, strip_mode=None):
+                     vocab_path=None, strip_mode=None, candidates=None,
+                     candidates_report=False, compare_loads=False):
     """Extract features for a corpus, dump the instances.
 
     Run feature extraction for a particular corpus; and store the
@@ -60,6 +83,13 @@ def extract_features(corpus, output_dir,
         have in training)
     strip_mode: one of {'head', 'broadcast', 'custom'}
         Method to strip CDUs
+    candidates: string
+        Candidate policy to prune the EDU pairs with
+        (see `stac.harness.candidates`)
+    candidates_report: bool
+        Report on what each of the `CANDIDATE_POLICIES` would prune
+    compare_loads: bool
+        Time loading the text and binary versions of the features
     """
     # TODO: perhaps we could just directly invoke the appropriate
     # educe module here instead of going through the command line?
@@ -72,8 +102,41 @@ def extract_features(corpus, output_dir,
         cmd.extend(['--vocabulary', vocab_path])
     if strip_mode is not None:
         cmd.extend(['--strip-mode', strip_mode])
-    call(cmd)
-    call(cmd + ["--single"])
+    corpus_name = fp.basename(corpus)
+    with traced('gather:extract-pairs', corpus=corpus_name):
+        call(cmd)
+    with traced('gather:extract-single', corpus=corpus_name):
+        call(cmd + ["--single"])
+    if candidates is not None or candidates_report:
+        with traced('gather:candidates', corpus=corpus_name):
+            compare = CANDIDATE_POLICIES if candidates_report else None
+            print_report(corpus_name,
+                         prune_candidates(*_mpack_paths(corpus, output_dir),
+                                          policy=candidates,
+                                          compare=compare))
+    with traced('gather:binary-multipack', corpus=corpus_name):
+        _binary_multipack(corpus, output_dir, compare=compare_loads)
+
+
+def _mpack_paths(corpus, output_dir):
+    "edu input, pairings, features and vocab paths for a corpus"
+    core_path = fp.join(output_dir,
+                        fp.basename(corpus) + '.relations.sparse')
+    return (core_path + '.edu_input',
+            core_path + '.pairings',
+            core_path,
+            core_path + '.vocab')
+
+
+def _binary_multipack(corpus, output_dir, compare=False):
+    """Save a binary copy of the features we just extracted
+    (see `stac.harness.binary_mpack`) and, if `compare`, report on
+    how long it takes to load either version
+    """
+    paths = _mpack_paths(corpus, output_dir)
+    gather_binary_multipack(*paths)
+    if compare:
+        print_comparison(paths[2], compare_loads(*paths))
 
 
 def main(args):
@@ -87,7 +150,10 @@ def main(args):
         tdir = latest_tmp()
     else:
         tdir = current_tmp()
-        extract_features(TRAINING_CORPUS, tdir, strip_mode=args.strip_mode)
+        extract_features(TRAINING_CORPUS, tdir, strip_mode=args.strip_mode,
+                         candidates=args.candidates,
+                         candidates_report=args.candidates_report,
+                         compare_loads=args.compare_loads)
 
     if TEST_CORPUS is not None:
         vocab_path = fp.join(tdir,
@@ -95,7 +161,10 @@ def main(args):
                               '.relations.sparse.vocab'))
         extract_features(TEST_CORPUS, tdir,
                          vocab_path=vocab_path,
-                         strip_mode=args.strip_mode)
+                         strip_mode=args.strip_mode,
+                         candidates=args.candidates,
+                         candidates_report=args.candidates_report,
+                         compare_loads=args.compare_loads)
 
     with open(os.path.join(tdir, "versions-gather.txt"), "w") as stream:
         call(["pip", "freeze"], stdout=stream)
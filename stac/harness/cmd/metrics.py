@@ -0,0 +1,110 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+show live metrics from a running server
+"""
+
+from __future__ import print_function
+import json
+import sys
+import time
+
+from ..metrics import (poll_metrics, quantile)
+
+NAME = 'metrics'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("--port",
+                     type=int,
+                     required=True,
+                     help="metrics port of the server (its "
+                     "--metrics-port)")
+    psr.add_argument("--host",
+                     default="localhost",
+                     help="where the server is (default: %(default)s)")
+    psr.add_argument("--interval",
+                     type=float,
+                     default=2.,
+                     metavar="SECONDS",
+                     help="time between polls (default: %(default)s)")
+    psr.add_argument("--count",
+                     type=int,
+                     metavar="N",
+                     help="stop after N polls (default: go on until "
+                     "interrupted)")
+    psr.add_argument("--json",
+                     action='store_true',
+                     help="print the raw metrics (one JSON line per "
+                     "poll)")
+
+
+def _fmt_seconds(seconds):
+    "latency for display"
+    return '-' if seconds is None else '{:.3f}'.format(seconds)
+
+
+def _fmt_mb(num_bytes):
+    "size for display"
+    return '{:.1f}MB'.format(num_bytes / (1024. * 1024.))
+
+
+def _summarise(snap):
+    """
+    Print a summary of a metrics snapshot
+    """
+    counters = snap['counters']
+    print('[{}] pid {} up {:.0f}s | {} requests ({:.2f}/s), '
+          '{} in flight, {} degraded, {} failed | rss {}'
+          ''.format(time.strftime('%H:%M:%S',
+                                  time.localtime(snap['time'])),
+                    snap['pid'], snap['uptime'], counters['requests'],
+                    snap['rate'], snap['in_flight'], counters['degraded'],
+                    counters['failed'], _fmt_mb(snap['rss_bytes'])))
+    for key, value in sorted(snap['state'].items()):
+        print('  {}: {}'.format(key, json.dumps(value, sort_keys=True)))
+    print('  {:<28} {:>6} {:>8} {:>8} {:>8} {:>8}'
+          ''.format('latency (s)', 'n', 'mean', 'p50', 'p95', 'max'))
+    for name, hist in snap['latency'].items():
+        count = sum(hist['counts'])
+        mean = hist['total'] / count if count else None
+        print('  {:<28} {:>6} {:>8} {:>8} {:>8} {:>8}'
+              ''.format(name, count, _fmt_seconds(mean),
+                        _fmt_seconds(quantile(hist, 0.5)),
+                        _fmt_seconds(quantile(hist, 0.95)),
+                        _fmt_seconds(hist['max'] if count else None)))
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    address = 'tcp://{}:{}'.format(args.host, args.port)
+    polls = 0
+    try:
+        while args.count is None or polls < args.count:
+            if polls:
+                time.sleep(args.interval)
+            polls += 1
+            snap = poll_metrics(address, timeout=max(args.interval, 1.))
+            if snap is None:
+                print('[metrics] no answer from {}'.format(address),
+                      file=sys.stderr)
+            elif args.json:
+                print(json.dumps(snap, sort_keys=True))
+            else:
+                _summarise(snap)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
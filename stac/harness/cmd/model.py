@@ -12,11 +12,12 @@ import os
 from attelo.harness.config import (DataConfig, RuntimeConfig)
 from attelo.harness.parse import (learn)
 from attelo.harness.util import (call, force_symlink)
-from attelo.io import (load_multipack, Torpor)
+from attelo.io import (Torpor)
 
+from ..binary_mpack import (load_multipack_fast)
 from ..harness import (IritHarness)
-from ..local import (DIALOGUE_ACT_LEARNER,
-                     SNAPSHOTS)
+from ..local import (SNAPSHOTS,
+                     dialogue_act_learner)
 from ..pipeline import (dact_features_path,
                         dact_model_path,
                         latest_snap,
@@ -50,9 +51,10 @@ def _create_snapshot_dir(data_dir):
 
 def _mk_dialogue_act_model(hconf):
     "Learn and save the dialogue acts model"
-    learner = DIALOGUE_ACT_LEARNER.payload
+    klearner = dialogue_act_learner()
+    learner = klearner.payload
     fpath = dact_features_path(hconf)
-    mpath = dact_model_path(hconf, DIALOGUE_ACT_LEARNER)
+    mpath = dact_model_path(hconf, klearner)
     with Torpor('Learning dialogue acts model'):
         stac_unit.learn_and_save(learner, fpath, mpath)
 
@@ -62,17 +64,19 @@ def _do_corpus(hconf):
     paths = hconf.mpack_paths(test_data=False)
     if not fp.exists(paths['edu_input']):
         exit_ungathered()
-    mpack = load_multipack(paths['edu_input'],
-                           paths['pairings'],
-                           paths['features'],
-                           paths['vocab'],
-                           verbose=True)
+    mpack = load_multipack_fast(paths['edu_input'],
+                                paths['pairings'],
+                                paths['features'],
+                                paths['vocab'],
+                                verbose=True)
     dconf = DataConfig(pack=mpack,
                        folds=None)
     # (re)learn combined model (we shouldn't assume
     # it's in some scratch directory)
+    hconf.prime_model_store()
     for econf in hconf.evaluations:
         learn(hconf, econf, dconf, None)
+    hconf.publish_models()
     _mk_dialogue_act_model(hconf)
 
 # ---------------------------------------------------------------------
@@ -13,10 +13,10 @@ import tempfile
 
 from attelo.harness.util import (makedirs, call, force_symlink)
 
+from ..candidates import (prune_candidates, print_report)
 from ..local import (CORENLP_SERVER_DIR, CORENLP_ADDRESS,
                      TAGGER_JAR, LEX_DIR,
-                     DIALOGUE_ACT_LEARNER,
-                     EVALUATIONS)
+                     dialogue_act_learner)
 from ..pipeline import\
     (StandaloneParser,
      Stage, run_pipeline,
@@ -119,7 +119,7 @@ def _unit_annotations(lconf, log):
     guess dialogue acts for all the EDUs
     """
     corpus_dir = minicorpus_path(lconf)
-    d_model_path = dact_model_path(lconf, DIALOGUE_ACT_LEARNER)
+    d_model_path = dact_model_path(lconf, dialogue_act_learner())
     d_features_path = dact_features_path(lconf)
     d_vocab_path = d_features_path + '.vocab'
 
@@ -160,6 +160,14 @@ def _feature_extraction(lconf, log):
            lconf.abspath(LEX_DIR),
            lconf.tmp_dir]
     call(cmd, stderr=log)
+    # same candidate pairs as the models were trained on
+    fpath = minicorpus_path(lconf) + '.relations.sparse'
+    print_report(stub_name(lconf),
+                 prune_candidates(fpath + '.edu_input',
+                                  fpath + '.pairings',
+                                  fpath,
+                                  vocab_path,
+                                  policy=lconf.candidate_policy))
 
 
 def _format_decoder_output(lconf, log):
@@ -258,6 +266,9 @@ def config_argparser(psr):
     psr.add_argument("--tmpdir", metavar="DIR",
                      help="put intermediary files here "
                      "(for debugging, default is via mktemp)")
+    psr.add_argument("--candidates", metavar="POLICY",
+                     help="candidate pair policy (should be the one the "
+                     "data was gathered with; default from local.py)")
 
 
 def _mk_parser_temp(args):
@@ -311,5 +322,7 @@ def main(args):
     check_3rd_party()
     lconf = StandaloneParser(soclog=args.soclog,
                              tmp_dir=_mk_parser_temp(args))
+    if args.candidates is not None:
+        lconf.candidate_policy = args.candidates
     _pipeline(lconf)
     _copy_results(lconf, args.output)
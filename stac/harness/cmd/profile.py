@@ -0,0 +1,116 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+summarise timing traces (optionally running a command first)
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+from os import path as fp
+import argparse
+import os
+import pstats
+import subprocess
+import sys
+import time
+
+from ..trace import (PROFILE_ENV, TRACE_ENV, read_records)
+
+NAME = 'profile'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("--trace-file", metavar="FILE",
+                     default=None,
+                     help="trace file to read (or write, if running a "
+                     "command; default: ${} or trace.jsonl)"
+                     "".format(TRACE_ENV))
+    psr.add_argument("--stage", metavar="PATTERN",
+                     help="run cProfile on traced work whose name "
+                     "matches this pattern (eg. 'stage:0700*', "
+                     "'decode:tc-mst')")
+    psr.add_argument("--top", metavar="N", type=int, default=25,
+                     help="number of functions to show from profiles")
+    psr.add_argument("command", nargs=argparse.REMAINDER,
+                     help="irit-stac command to run with tracing on "
+                     "(eg. parse foo.soclog /tmp/out)")
+
+
+def _summarise(records):
+    """
+    Print a table of resource use per name of traced work
+    """
+    groups = defaultdict(list)
+    for rec in records:
+        groups[rec['name']].append(rec)
+    print(('{:<40} {:>5} {:>9} {:>8} {:>9} {:>9} {:>8} {:>8} {:>8}'
+           '').format('name', 'n', 'wall', 'mean', 'cpu', 'child cpu',
+                      'peak MB', 'read MB', 'write MB'))
+    for name, recs in sorted(groups.items(),
+                             key=lambda kv: -sum(r['wall'] for r in kv[1])):
+        wall = sum(r['wall'] for r in recs)
+        errors = len([r for r in recs if r['status'] != 'ok'])
+        print(('{:<40} {:>5} {:>8.2f}s {:>7.3f}s {:>8.2f}s {:>8.2f}s '
+               '{:>8.1f} {:>8.1f} {:>8.1f}{}'
+               '').format(name[:40], len(recs), wall, wall / len(recs),
+                          sum(r['cpu'] for r in recs),
+                          sum(r['child_cpu'] for r in recs),
+                          max(r['peak_rss_kb'] for r in recs) / 1024.,
+                          sum(r.get('read_bytes', 0) for r in recs) / 1e6,
+                          sum(r.get('write_bytes', 0) for r in recs) / 1e6,
+                          ' ({} failed)'.format(errors) if errors else ''))
+
+
+def _show_profiles(records, top):
+    """
+    Print the top functions from the cProfile stats recorded
+    """
+    paths = [r['profile'] for r in records
+             if 'profile' in r and fp.exists(r['profile'])]
+    if not paths:
+        return
+    print()
+    print('profiles:', ' '.join(paths))
+    stats = pstats.Stats(*paths)
+    stats.sort_stats('cumulative').print_stats(top)
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    trace_path = fp.abspath(args.trace_file or
+                            os.environ.get(TRACE_ENV, 'trace.jsonl'))
+    since = None
+    command = [x for x in args.command if x != '--']
+    if command:
+        env = dict(os.environ)
+        env[TRACE_ENV] = trace_path
+        if args.stage is not None:
+            env[PROFILE_ENV] = args.stage
+        since = time.time()
+        retcode = subprocess.call([sys.executable, sys.argv[0]] + command,
+                                  env=env)
+        if retcode != 0:
+            print('command failed (exit code {})'.format(retcode),
+                  file=sys.stderr)
+    elif args.stage is not None:
+        sys.exit('--stage only makes sense if you give a command to run')
+    if not fp.exists(trace_path):
+        sys.exit('No traces in {}'.format(trace_path))
+    records = read_records(trace_path)
+    if since is not None:
+        records = [r for r in records if r['start'] >= since]
+    _summarise(records)
+    _show_profiles(records, args.top)
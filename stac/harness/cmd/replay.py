@@ -0,0 +1,332 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+replay soclogs against a parse server, at game pace
+"""
+
+from __future__ import print_function
+from collections import Counter
+from os import path as fp
+import json
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+import zmq
+
+from ..util import (load_script)
+
+NAME = 'replay'
+
+ROOT_DIR = fp.dirname(fp.dirname(fp.dirname(fp.dirname(
+    fp.abspath(__file__)))))
+"root of the STAC code"
+
+_DAY = 24 * 60 * 60
+
+PERCENTILES = [50, 90, 95, 99]
+"latency percentiles to report"
+
+# ---------------------------------------------------------------------
+# schedule
+# ---------------------------------------------------------------------
+
+
+def _seconds(timestamp):
+    "seconds since midnight for a HH:MM:SS:mmm timestamp (None if bad)"
+    try:
+        hours, mins, secs, millis = [int(x) for x in timestamp.split(':')]
+    except (AttributeError, ValueError):
+        return None
+    return hours * 3600 + mins * 60 + secs + millis / 1000.
+
+
+def read_schedule(path, speedup=1.):
+    """
+    Lines of a soclog, with the time (seconds from the start of
+    the replay) at which each one should be sent
+
+    Timestamps are read as `intake/soclogtocsv.py` reads them; lines
+    without one (eg. spectator messages) go with the line before them
+
+    Returns
+    -------
+    schedule : [(float, bytes)]
+    """
+    soclogtocsv = load_script(fp.join(ROOT_DIR, 'intake', 'soclogtocsv.py'))
+    schedule = []
+    first = None
+    previous = None
+    offset = 0.
+    with open(path, 'rb') as stream:
+        for line in stream:
+            if not line.strip():
+                continue
+            stamp = _seconds(soclogtocsv.line_timestamp(
+                line.decode('utf-8', 'replace')))
+            if stamp is not None:
+                if first is None:
+                    first = previous = stamp
+                if stamp < previous - _DAY / 2:
+                    # past midnight (the timestamps have no date)
+                    stamp += _DAY * round((previous - stamp) / _DAY)
+                # never go back in time
+                previous = max(previous, stamp)
+                offset = (previous - first) / speedup
+            schedule.append((offset, line))
+    return schedule
+
+
+# ---------------------------------------------------------------------
+# sessions
+# ---------------------------------------------------------------------
+
+
+def _check_response(response):
+    """
+    Error (string) if the response is not a Settlers XML fragment,
+    and whether it was degraded
+    """
+    if b'<game_fragment' not in response:
+        return 'bad-response', False
+    return None, re.search(b'degraded="true"', response) is not None
+
+
+class Session(threading.Thread):
+    """
+    Replay one soclog against the server, sending the lines that
+    are due whenever the previous request has been answered (so if
+    the server falls behind, requests get bigger, as they would
+    in a real game)
+
+    Parameters
+    ----------
+    incremental : bool
+        Send only the new lines in each request (for servers in
+        incremental mode); otherwise send everything so far
+
+    limit : float or None
+        Stop after this many seconds
+    """
+
+    def __init__(self, number, context, address, soclog, schedule,
+                 incremental=False, timeout=60., limit=None, delay=0.):
+        super(Session, self).__init__(name='session-{}'.format(number))
+        self.daemon = True
+        self.number = number
+        self.soclog = soclog
+        self.records = []
+        self._context = context
+        self._address = address
+        self._schedule = schedule
+        self._incremental = incremental
+        self._timeout = timeout
+        self._limit = limit
+        self._delay = delay
+
+    def _socket(self):
+        "a fresh connection to the server"
+        # pylint: disable=no-member
+        socket = self._context.socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        # pylint: enable=no-member
+        socket.connect(self._address)
+        return socket
+
+    def _request(self, socket, payload):
+        """
+        Send a request and wait for the answer
+
+        Returns
+        -------
+        socket : zmq socket to use for the next request (a REQ socket
+            with no answer can't be used again)
+        record : dict
+        """
+        start = time.time()
+        socket.send(payload)
+        if socket.poll(int(self._timeout * 1000)):
+            response = socket.recv()
+            error, degraded = _check_response(response)
+        else:
+            socket.close()
+            socket = self._socket()
+            response = b''
+            error, degraded = 'timeout', False
+        return socket, {'latency': time.time() - start,
+                        'request_bytes': len(payload),
+                        'response_bytes': len(response),
+                        'degraded': degraded,
+                        'error': error}
+
+    def run(self):
+        time.sleep(self._delay)
+        socket = self._socket()
+        start = time.time()
+        sent = 0
+        try:
+            while sent < len(self._schedule):
+                now = time.time() - start
+                if self._limit is not None and now > self._limit:
+                    break
+                due = sent
+                while due < len(self._schedule) and\
+                        self._schedule[due][0] <= now:
+                    due += 1
+                if due == sent:
+                    time.sleep(self._schedule[sent][0] - now)
+                    continue
+                first = sent if self._incremental else 0
+                payload = b''.join(l for _, l in self._schedule[first:due])
+                socket, record = self._request(socket, payload)
+                # how far behind the game we were when sending
+                record.update(lines=due - sent,
+                              lag=now - self._schedule[sent][0],
+                              session=self.number)
+                self.records.append(record)
+                sent = due
+        finally:
+            socket.close()
+
+
+# ---------------------------------------------------------------------
+# report
+# ---------------------------------------------------------------------
+
+
+def make_report(sessions, seconds):
+    """
+    Summary of what the sessions recorded
+
+    Returns
+    -------
+    report : dict
+    """
+    records = [r for s in sessions for r in s.records]
+    answered = [r['latency'] for r in records if r['error'] is None]
+    report = {'sessions': len(sessions),
+              'seconds': seconds,
+              'requests': len(records),
+              'answered': len(answered),
+              'throughput': len(answered) / seconds if seconds else 0.,
+              'errors': dict(Counter(r['error'] for r in records
+                                     if r['error'] is not None)),
+              'degraded': len([r for r in records if r['degraded']]),
+              'max_lag': max([r['lag'] for r in records] or [0.]),
+              'request_bytes': sum(r['request_bytes'] for r in records)}
+    if answered:
+        report['latency'] = dict(
+            [('mean', float(np.mean(answered))),
+             ('max', float(np.max(answered)))] +
+            [('p{}'.format(p), float(np.percentile(answered, p)))
+             for p in PERCENTILES])
+    report['per_session'] = [{'session': s.number,
+                              'soclog': s.soclog,
+                              'requests': len(s.records),
+                              'errors': len([r for r in s.records
+                                             if r['error'] is not None])}
+                             for s in sessions]
+    return report
+
+
+def print_report(report):
+    """
+    Print the summary from `make_report`
+    """
+    print('[replay] {sessions} sessions, {requests} requests '
+          '({answered} answered) in {seconds:.1f}s = {throughput:.2f}/s'
+          ''.format(**report))
+    print('[replay] degraded: {}, errors: {}, max lag: {:.2f}s'
+          ''.format(report['degraded'],
+                    ', '.join('{}={}'.format(k, v) for k, v in
+                              sorted(report['errors'].items())) or 'none',
+                    report['max_lag']))
+    if 'latency' in report:
+        lat = report['latency']
+        print('[replay] latency (s): ' +
+              ' '.join('{}={:.3f}'.format(k, lat[k]) for k in
+                       ['mean'] + ['p{}'.format(p) for p in PERCENTILES] +
+                       ['max']))
+
+# ---------------------------------------------------------------------
+# main
+# ---------------------------------------------------------------------
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("soclogs", metavar="FILE", nargs='+',
+                     help="soclogs to replay (each session takes the "
+                     "next one, going round as needed)")
+    psr.add_argument("--address",
+                     default="tcp://localhost:7777",
+                     help="server address (default: %(default)s)")
+    psr.add_argument("--sessions", metavar="N", type=int,
+                     help="number of concurrent games "
+                     "(default: one per soclog)")
+    psr.add_argument("--speedup", metavar="X", type=float, default=1.,
+                     help="replay X times faster than the games were "
+                     "played (default: %(default)s)")
+    psr.add_argument("--stagger", metavar="SECONDS", type=float,
+                     default=0.,
+                     help="time between starting sessions")
+    psr.add_argument("--incremental", action='store_true',
+                     help="only send new lines in each request (for "
+                     "servers run with --incremental)")
+    psr.add_argument("--timeout", metavar="SECONDS", type=float,
+                     default=60.,
+                     help="count requests not answered in this time "
+                     "as errors (default: %(default)s)")
+    psr.add_argument("--limit", metavar="SECONDS", type=float,
+                     help="stop each session after this long")
+    psr.add_argument("--report", metavar="FILE",
+                     help="write the report (and every request) here "
+                     "as JSON")
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    if args.speedup <= 0:
+        sys.exit("--speedup must be positive")
+    schedules = {x: read_schedule(x, args.speedup) for x in args.soclogs}
+    num_sessions = args.sessions or len(args.soclogs)
+    context = zmq.Context()
+    sessions = []
+    for i in range(num_sessions):
+        soclog = args.soclogs[i % len(args.soclogs)]
+        sessions.append(Session(i, context, args.address,
+                                soclog, schedules[soclog],
+                                incremental=args.incremental,
+                                timeout=args.timeout,
+                                limit=args.limit,
+                                delay=i * args.stagger))
+    start = time.time()
+    try:
+        for session in sessions:
+            session.start()
+        for session in sessions:
+            while session.is_alive():
+                session.join(0.5)
+    except KeyboardInterrupt:
+        print('[replay] interrupted, reporting on what we have',
+              file=sys.stderr)
+    report = make_report(sessions, time.time() - start)
+    print_report(report)
+    if args.report:
+        report['records'] = [r for s in sessions for r in s.records]
+        with open(args.report, 'w') as stream:
+            json.dump(report, stream, indent=1, sort_keys=True)
@@ -7,11 +7,15 @@ server version of parse (soclog in, ??? out)
 
 from __future__ import print_function
 from os import path as fp
+from xml.sax.saxutils import quoteattr
+import multiprocessing
+import os
+import signal
 import sys
-import tempfile
+import time
 import zmq
 
-from attelo.harness.util import makedirs
+from attelo.harness.interface import (HarnessException)
 
 from . import parse as p
 from ..pipeline import (StandaloneParser,
@@ -20,40 +24,227 @@ from ..pipeline import (StandaloneParser,
                         decode,
                         minicorpus_path,
                         attelo_result_path)
+from ..metrics import (ServerMetrics, serve_metrics)
+from .. import scores
+from ..scratch import (ScratchArena)
+from ..trace import (traced)
 
 
 NAME = 'serve'
 _DEBUG = 0
 
+_KILL_GRACE = 5.
+"seconds a decoding process gets to stop before we SIGKILL it"
+
 # ---------------------------------------------------------------------
 # pipeline
 # ---------------------------------------------------------------------
 
 
-def xml_output_path(lconf):
+def xml_output_path(lconf, econf=None):
     "final output of the server"
-    return attelo_result_path(lconf, lconf.test_evaluation) + ".settlers-xml"
+    econf = econf or lconf.test_evaluation
+    return attelo_result_path(lconf, econf) + ".settlers-xml"
+
 
+def xml_state_path(lconf):
+    "what we sent in the previous response (for delta responses)"
+    return lconf.tmp("settlers-xml.state")
 
-def _to_xml(lconf, log):
+
+def _to_xml(lconf, log, econf=None, delta=False):
     """
-    Convert to Settlers XML format
+    Convert to Settlers XML format (only the events that have
+    changed since the previous request if `delta`)
     """
+    econf = econf or lconf.test_evaluation
+    delta_args = ["--delta", xml_state_path(lconf)] if delta else []
     lconf.pyt("parser/to_settlers_xml",
               minicorpus_path(lconf),
-              attelo_result_path(lconf, lconf.test_evaluation),
-              "--output", xml_output_path(lconf),
+              attelo_result_path(lconf, econf),
+              "--output", xml_output_path(lconf, econf),
+              *delta_args,
               stdout=log)
 
 
-SERVER_STAGES = p.CORE_STAGES +\
-    [
-        Stage("0700-decoding",
-              lambda lcf, _: decode(lcf, [lcf.test_evaluation]),
-              "Decoding"),
-        Stage("0800-xml", _to_xml,
-              "Converting (-> settlers xml)"),
-    ]
+# ---------------------------------------------------------------------
+# decoding on a budget
+# ---------------------------------------------------------------------
+
+
+def _decode_in_group(lconf, econf):
+    """
+    Decode in a process group of our own, so that we can kill any
+    helpers (eg. the ILP solver) along with the decoder
+    """
+    # we are stopped with SIGTERM (see `_kill`); don't exit cleanly
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.setpgrp()
+    decode(lconf, [econf])
+
+
+def _start_decoder(lconf, econf):
+    "decode with the given evaluation in a separate process"
+    proc = multiprocessing.Process(target=_decode_in_group,
+                                   args=(lconf, econf))
+    proc.start()
+    return proc
+
+
+def _signal(proc, signum):
+    "send a signal to a decoding process and anything it started"
+    try:
+        os.killpg(proc.pid, signum)
+    except OSError:
+        # it has not made its own process group yet (so it has not
+        # started anything either)
+        try:
+            os.kill(proc.pid, signum)
+        except OSError:
+            pass
+
+
+def _kill(proc):
+    "stop a decoding process and anything it started"
+    if proc.is_alive():
+        _signal(proc, signal.SIGTERM)
+        proc.join(_KILL_GRACE)
+        if proc.is_alive():
+            _signal(proc, signal.SIGKILL)
+    proc.join()
+
+
+def _decode_on_budget(lconf, deadline, outcome):
+    """
+    Decode with the test evaluation, alongside the (cheaper)
+    fallback evaluation. If the test evaluation has not finished by
+    the deadline (or has failed), use the fallback result instead.
+
+    The evaluation actually used, and why, are recorded in the
+    `outcome` dictionary
+    """
+    main_conf = lconf.test_evaluation
+    fallback_conf = lconf.fallback_evaluation
+    outcome['evaluation'] = main_conf
+    if deadline is None or fallback_conf is None or\
+            fallback_conf.key == main_conf.key:
+        decode(lconf, [main_conf])
+        return
+
+    fallback = _start_decoder(lconf, fallback_conf)
+    if time.time() < deadline:
+        main = _start_decoder(lconf, main_conf)
+        main.join(max(0, deadline - time.time()))
+        timed_out = main.is_alive()
+        _kill(main)
+        if main.exitcode == 0:
+            _kill(fallback)
+            return
+        reason = 'timeout' if timed_out else 'failed'
+    else:
+        # earlier stages have used up the budget already
+        reason = 'timeout'
+    fallback.join()
+    if fallback.exitcode != 0:
+        raise HarnessException('Fallback decoder {} failed'
+                               ''.format(fallback_conf.key))
+    outcome.update(evaluation=fallback_conf,
+                   degraded=True,
+                   reason=reason)
+
+
+def _server_stages(deadline, outcome, delta):
+    """
+    Pipeline stages for a single request (decoding is subject to the
+    deadline, if any)
+    """
+    return p.CORE_STAGES +\
+        [
+            Stage("0700-decoding",
+                  lambda lcf, _: _decode_on_budget(lcf, deadline, outcome),
+                  "Decoding"),
+            Stage("0800-xml",
+                  lambda lcf, log: _to_xml(lcf, log, outcome['evaluation'],
+                                           delta),
+                  "Converting (-> settlers xml)"),
+        ]
+
+
+def _annotate_xml(xml, attrs):
+    """
+    Add attributes to the root `game_fragment` tag of the server
+    output
+    """
+    attr_str = ''.join(' {}={}'.format(k, quoteattr(v)) for k, v in attrs)
+    return xml.replace(b'<game_fragment',
+                       b'<game_fragment' + attr_str.encode('utf-8'), 1)
+
+
+def _scratch_attr(usage, cleanup):
+    "summary of the scratch space for the `scratch` attribute"
+    return ('written={written} bytes={bytes} files={files}'
+            ''.format(**usage) +
+            ' cleaned_files={files} cleaned_bytes={bytes}'
+            ' pending_bytes={pending_bytes}'.format(**cleanup))
+
+
+def _respond(lconf, budget, delta=False, stats=None, arena=None):
+    """
+    Run the pipeline on the current input and return the Settlers XML,
+    with timing metadata as attributes on the root:
+
+    * decoder: key of the evaluation that produced the parse
+    * degraded: "true" if that was the fallback evaluation
+      (with reason "timeout" or "failed")
+    * budget, elapsed: seconds allowed and taken for the request
+    * stage_times: seconds per pipeline stage
+    * xml_bytes: size of the XML (before these attributes)
+    * scratch (with an `arena`): bytes written to the scratch space
+      for this request, bytes and files in it, and what the last
+      cleanup deleted (see `stac.harness.scratch`)
+
+    If `delta`, the XML only has the events that are new or have
+    changed since the previous response (see `stac.settlers_xml`).
+    The decoder used (and the reason for degrading, if any), the time
+    taken by each stage, the size of the XML, the time taken by the
+    XML stage, and the scratch space numbers are also put in `stats`,
+    if given
+    """
+    start = time.time()
+    deadline = None if budget is None else start + budget
+    outcome = {'degraded': False}
+    timings = run_pipeline(lconf, _server_stages(deadline, outcome,
+                                                 delta))
+    econf = outcome['evaluation']
+    with open(xml_output_path(lconf, econf), 'rb') as fin:
+        xml = fin.read()
+    usage = None if arena is None else arena.usage(since=start)
+    if stats is not None:
+        stats.update(decoder=econf.key,
+                     degraded=outcome.get('reason'),
+                     stage_times=dict(timings),
+                     xml_bytes=len(xml),
+                     xml_stage_seconds=timings.get('0800-xml'))
+        if usage is not None:
+            stats.update(scratch=usage)
+    attrs = [('decoder', econf.key),
+             ('degraded', 'true' if outcome['degraded'] else 'false')]
+    if outcome['degraded']:
+        attrs.append(('reason', outcome['reason']))
+    if budget is not None:
+        attrs.append(('budget', '{:.3f}'.format(budget)))
+    attrs.append(('elapsed', '{:.3f}'.format(time.time() - start)))
+    attrs.append(('xml_bytes', str(len(xml))))
+    attrs.append(('stage_times',
+                  ' '.join('{}={:.3f}'.format(k, v)
+                           for k, v in timings.items())))
+    if usage is not None:
+        attrs.append(('scratch', _scratch_attr(usage, arena.last_cleanup)))
+    if outcome['degraded']:
+        print('[serve] {} missed the budget ({}), used {}'
+              ''.format(lconf.test_evaluation.key, outcome['reason'],
+                        econf.key), file=sys.stderr)
+    return _annotate_xml(xml, attrs)
 
 # ---------------------------------------------------------------------
 # main
@@ -74,31 +265,38 @@ def config_argparser(psr):
                      "input; restart parser for new input")
     psr.add_argument("--tmpdir", metavar="DIR",
                      help="put intermediary files here "
-                     "(for debugging, default is via mktemp)")
+                     "(for debugging, default is a new directory "
+                     "in /dev/shm if possible, else via mktemp)")
     psr.add_argument("--port",
                      type=int,
                      required=True,
                      help="port to listen on")
+    psr.add_argument("--budget",
+                     type=float,
+                     metavar="SECONDS",
+                     help="time allowed per request; if the test "
+                     "evaluation takes longer, answer with the "
+                     "(cheaper) fallback evaluation instead")
+    psr.add_argument("--delta",
+                     action='store_true',
+                     help="(with --incremental) only send the events "
+                     "that are new or have changed since the previous "
+                     "response")
+    psr.add_argument("--metrics-port",
+                     type=int,
+                     metavar="PORT",
+                     help="answer requests for live metrics on this "
+                     "(local) port; see `irit-stac metrics`")
 
 
-def _mk_server_temp(args):
-    """
-    Create a temporary directory to save intermediary parser files
-    in (may be specified from args but defaults to some mktemp recipe)
-    """
-    if args.tmpdir is None:
-        tmp_dir = fp.join(tempfile.mkdtemp(prefix="stac"))
-    else:
-        tmp_dir = args.tmpdir
-    makedirs(tmp_dir)
-    return tmp_dir
-
-
-def _reset_parser(args):
+def _reset_parser(args, arena):
     """
     Reset the parser and return the corresponding loop configuariton
+
+    The intermediary parser files go in the (emptied) working
+    directory of the scratch arena
     """
-    tmp_dir = _mk_server_temp(args)
+    tmp_dir = arena.fresh()
     soclog = fp.join(tmp_dir, "soclog")
     open(soclog, 'wb').close()
     hconf = StandaloneParser(soclog=soclog,
@@ -106,9 +304,44 @@ def _reset_parser(args):
     if hconf.test_evaluation is None:
         sys.exit("Can't run server: you didn't specify a test "
                  "evaluation in the local configuration")
+    if args.budget is not None and hconf.fallback_evaluation is None:
+        sys.exit("Can't run server with a budget: you didn't specify "
+                 "a fallback evaluation in the local configuration")
     return hconf
 
 
+def _model_state(lconf):
+    """
+    For the test and fallback evaluations, whether the model files
+    they load are all there, and how big they are
+    """
+    res = {}
+    for econf in [lconf.test_evaluation, lconf.fallback_evaluation]:
+        if econf is None or econf.key in res:
+            continue
+        paths = lconf.model_paths(econf.learner, None, econf.parser)
+        present = [x for x in paths.values() if fp.exists(x)]
+        res[econf.key] = {'ready': len(present) == len(paths),
+                          'files': len(paths),
+                          'missing': len(paths) - len(present),
+                          'bytes': sum(fp.getsize(x) for x in present)}
+    return res
+
+
+def _exit_on_sigterm(server_pid):
+    """
+    SIGTERM handler: exit normally (so that the scratch arena is
+    cleaned up), unless we are a decoding process that has not yet
+    put the default handler back
+    """
+    def handler(*_):
+        "exit"
+        if os.getpid() == server_pid:
+            sys.exit(0)
+        os._exit(1)  # pylint: disable=protected-access
+    return handler
+
+
 def main(args):
     """
     Subcommand main.
@@ -123,13 +356,44 @@ def main(args):
     socket = context.socket(zmq.REP)
 # pylint: enable=no-member
     socket.bind("tcp://*:{}".format(args.port))
-    lconf = _reset_parser(args)
+    metrics = ServerMetrics()
+    if args.metrics_port is not None:
+        serve_metrics(metrics, args.metrics_port, context)
+    arena = ScratchArena(args.tmpdir)
+    signal.signal(signal.SIGTERM, _exit_on_sigterm(os.getpid()))
+    lconf = _reset_parser(args, arena)
+    metrics.update_state(models=_model_state(lconf),
+                         scratch_root=arena.root,
+                         scratch_in_memory=arena.in_memory)
     while True:
         incoming = socket.recv()
-        with open(lconf.soclog, 'ab') as fout:
-            print(incoming.strip(), file=fout)
-        run_pipeline(lconf, SERVER_STAGES)
-        with open(xml_output_path(lconf), 'rb') as fin:
-            socket.send(fin.read())
-        if not args.incremental:
-            lconf = _reset_parser(args)
+        start = time.time()
+        stats = {}
+        metrics.request_started(len(incoming))
+        with traced('serve:request', request_bytes=len(incoming),
+                    response=stats):
+            with open(lconf.soclog, 'ab') as fout:
+                print(incoming.strip(), file=fout)
+            if args.incremental:
+                # the input has grown, so earlier scores won't be
+                # asked for again
+                scores.clear_cache()
+            try:
+                reply = _respond(lconf, args.budget,
+                                 delta=args.delta and args.incremental,
+                                 stats=stats,
+                                 arena=arena)
+            except Exception:
+                metrics.request_failed()
+                raise
+            socket.send(reply)
+            metrics.request_done(time.time() - start,
+                                 timings=stats['stage_times'],
+                                 degraded=stats['degraded'])
+            # after sending, so the client does not wait on this
+            if not args.incremental:
+                lconf = _reset_parser(args, arena)
+            stats.update(cleanup=arena.collect())
+            metrics.update_state(last_decoder=stats['decoder'],
+                                 scratch=stats['scratch'],
+                                 cleanup=stats['cleanup'])
@@ -0,0 +1,181 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+try a range of regularisation values for the maxent learners
+"""
+
+from __future__ import print_function
+from os import path as fp
+import time
+
+import numpy as np
+import scipy.sparse
+
+from attelo.fold import (make_n_fold)
+from attelo.harness.config import (RuntimeConfig)
+from attelo.io import (load_fold_dict)
+from attelo.table import (UNRELATED)
+from attelo.util import (mk_rng)
+
+from ..binary_mpack import (load_multipack_fast)
+from ..harness import (IritHarness)
+from ..local import (FIXED_FOLD_FILE, maxent)
+from ..turn_constraint import (turn_constraint_safe)
+from ..util import (exit_ungathered, latest_tmp)
+
+NAME = 'sweep'
+
+_DEFAULT_C = [0.01, 0.03, 0.1, 0.3, 1., 3., 10.]
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("--fold", type=int, default=0,
+                     help="fold to test on (train on the others)")
+    psr.add_argument("--C", metavar='C', dest='c_values', type=float,
+                     nargs='+', default=_DEFAULT_C,
+                     help="regularisation values to try "
+                     "(default: {})".format(' '.join(str(x) for x in
+                                                     _DEFAULT_C)))
+    psr.add_argument("--cold", action='store_true',
+                     help="fit each value from scratch "
+                     "(for comparison with warm starts)")
+
+
+# ---------------------------------------------------------------------
+# data
+# ---------------------------------------------------------------------
+
+
+def _load_fold(fold):
+    """
+    Training and test multipacks for a fold of the gathered data
+    """
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        exit_ungathered()
+    hconf = IritHarness()
+    hconf.load(RuntimeConfig.empty(), data_dir, data_dir)
+    paths = hconf.mpack_paths(test_data=False)
+    if not fp.exists(paths['edu_input']):
+        exit_ungathered()
+    mpack = load_multipack_fast(paths['edu_input'],
+                                paths['pairings'],
+                                paths['features'],
+                                paths['vocab'],
+                                verbose=True)
+    if FIXED_FOLD_FILE is None:
+        fold_dict = make_n_fold(mpack, 10, mk_rng())
+    else:
+        fold_dict = load_fold_dict(FIXED_FOLD_FILE)
+    train = {k: v for k, v in mpack.items() if fold_dict[k] != fold}
+    test = {k: v for k, v in mpack.items() if fold_dict[k] == fold}
+    return train, test
+
+
+def _stack(mpack):
+    """
+    Stack the turn-constraint safe rows of a multipack into matrices
+    for the attachment and labelling tasks
+
+    The turn constraint selection is computed once per datapack (the
+    `tc_learner` wrapper would do it again for every model it fits)
+
+    Returns
+    -------
+    attach : (csr_matrix, array)
+    label : (csr_matrix, array)
+    """
+    datas = []
+    targets = []
+    unrelated = None
+    for dpack in mpack.values():
+        idxes = turn_constraint_safe(dpack)
+        datas.append(dpack.data[idxes])
+        targets.append(np.asarray(dpack.target)[idxes])
+        unrelated = dpack.label_number(UNRELATED)
+    data = scipy.sparse.vstack(datas).tocsr()
+    target = np.concatenate(targets)
+    related = np.where(target != unrelated)[0]
+    return ((data, (target != unrelated).astype(int)),
+            (data[related], target[related]))
+
+
+# ---------------------------------------------------------------------
+# sweep
+# ---------------------------------------------------------------------
+
+
+def _f1(gold, pred):
+    "f1 on the positive class"
+    tpos = float(np.sum((gold == 1) & (pred == 1)))
+    if tpos == 0:
+        return 0.
+    precision = tpos / np.sum(pred == 1)
+    recall = tpos / np.sum(gold == 1)
+    return 2 * precision * recall / (precision + recall)
+
+
+def _accuracy(gold, pred):
+    "proportion of correct predictions"
+    return float(np.sum(gold == pred)) / len(gold) if len(gold) else 0.
+
+
+def _sweep(train, test, c_values, score, warm):
+    """
+    Fit a maxent model for each value of C in turn (increasing, so
+    that each model starts from the weights of the previous, more
+    regularised one), and score it on the test data.
+
+    The model is the one the harness learners use (`local.maxent`),
+    so the scores are those the harness would get with that C.
+
+    Return a list of (C, fit time, score)
+    """
+    learner = maxent()
+    learner.set_params(warm_start=warm)
+    res = []
+    for c_value in sorted(c_values):
+        learner.set_params(C=c_value)
+        start = time.time()
+        learner.fit(*train)
+        fit_time = time.time() - start
+        res.append((c_value, fit_time,
+                    score(test[1], learner.predict(test[0]))))
+    return res
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    train, test = _load_fold(args.fold)
+    train_attach, train_label = _stack(train)
+    test_attach, test_label = _stack(test)
+    warm = not args.cold
+    attach = _sweep(train_attach, test_attach, args.c_values, _f1, warm)
+    label = _sweep(train_label, test_label, args.c_values, _accuracy, warm)
+
+    print('fold {}, {} training rows ({} related), {} fits'
+          ''.format(args.fold, train_attach[0].shape[0],
+                    train_label[0].shape[0],
+                    'warm-started' if warm else 'cold'))
+    print('{:>8}  {:>10} {:>9}  {:>10} {:>9}'.format('C',
+                                                     'attach fit',
+                                                     'attach f1',
+                                                     'label fit',
+                                                     'label acc'))
+    for (c_value, a_time, a_score), (_, l_time, l_score) in\
+            zip(attach, label):
+        print('{:>8g}  {:>9.2f}s {:>9.3f}  {:>9.2f}s {:>9.3f}'
+              ''.format(c_value, a_time, a_score, l_time, l_score))
@@ -15,9 +15,12 @@ from attelo.learning.oracle import (AttachOracle, LabelOracle)
 from attelo.parser.attach import AttachClassifierWrapper
 from attelo.parser.full import (JointPipeline,
                                 PostlabelPipeline)
+from attelo.parser import (Parser)
 from attelo.parser.label import (LabelClassifierWrapper, SimpleLabeller)
 from attelo.parser.pipeline import (Pipeline)
 
+from ..trace import (traced)
+
 
 def combined_key(*variants):
     """return a key from a list of objects that have a
@@ -81,6 +84,51 @@ def decoder_local(threshold):
     "our instantiation of the local baseline decoder"
     return Keyed('local', LocalBaseline(threshold, True))
 
+# ---------------------------------------------------------------------
+# tracing
+# ---------------------------------------------------------------------
+
+
+class TracedParser(Parser):
+    """Wrapper around a parser (typically a decoder) which records
+    the time and resources used for each document it is run on
+    (see `stac.harness.trace`)
+    """
+    def __init__(self, key, parser):
+        self._key = key
+        self._parser = parser
+
+    def __getattr__(self, name):
+        # anything else (eg. decoder specific settings) is the inner
+        # parser's business
+        if name.startswith('__') or name in ('_key', '_parser'):
+            raise AttributeError(name)
+        return getattr(self._parser, name)
+
+    def fit(self, dpacks, targets, nonfixed_pairs=None, cache=None):
+        self._parser.fit(dpacks, targets,
+                         nonfixed_pairs=nonfixed_pairs,
+                         cache=cache)
+        return self
+
+    def transform(self, dpack, nonfixed_pairs=None):
+        doc = dpack.edus[0].grouping if dpack.edus else None
+        with traced('decode:' + self._key, doc=doc):
+            return self._parser.transform(dpack,
+                                          nonfixed_pairs=nonfixed_pairs)
+
+    def decode(self, dpack, nonfixed_pairs=None):
+        "decoder interface (for pipelines calling the decoder directly)"
+        doc = dpack.edus[0].grouping if dpack.edus else None
+        with traced('decode:' + self._key, doc=doc):
+            return self._parser.decode(dpack,
+                                       nonfixed_pairs=nonfixed_pairs)
+
+
+def _traced_decoder(kdecoder):
+    "decoder payload wrapped for tracing"
+    return TracedParser(kdecoder.key, kdecoder.payload)
+
 # ---------------------------------------------------------------------
 # pipelines
 # ---------------------------------------------------------------------
@@ -115,7 +163,7 @@ def mk_post(klearner, kdecoder):
     key = combined_key(klearner, parser_key)
     parser = PostlabelPipeline(learner_attach=klearner.attach.payload,
                                learner_label=klearner.label.payload,
-                               decoder=kdecoder.payload)
+                               decoder=_traced_decoder(kdecoder))
     return EvaluationConfig(key=key,
                             settings=settings,
                             learner=klearner,
@@ -132,7 +180,7 @@ def mk_bypass(klearner, kdecoder):
     steps = [
         ('attach_weights', AttachClassifierWrapper(klearner.attach.payload)),
         ('label_weights', LabelClassifierWrapper(klearner.label.payload)),
-        ('decode', kdecoder.payload),
+        ('decode', _traced_decoder(kdecoder)),
     ]
     parser = Pipeline(steps=steps)
     return EvaluationConfig(key=key,
@@ -1,8 +1,16 @@
 """Configuration helpers for using the intra-inter sentential stuff"""
 
+from joblib import (Parallel, delayed)
+
 from attelo.harness.config import (EvaluationConfig,
                                    Keyed)
+from attelo.parser.intra import (HeadToHeadParser,
+                                 SoftParser,
+                                 for_intra,
+                                 partition_subgroupings)
+
 from .common import (Settings, combined_key)
+from ..trace import (traced)
 
 
 def combine_intra(econfs, kconf, primary='intra'):
@@ -42,3 +50,83 @@ def combine_intra(econfs, kconf, primary='intra'):
                             settings=settings,
                             learner=learners,
                             parser=kparser)
+
+
+# ---------------------------------------------------------------------
+# parallel intra-sentential decoding
+# ---------------------------------------------------------------------
+
+
+def _transform(parser, spack):
+    "parse a subgrouping (module level so that it can be pickled)"
+    return parser.transform(spack)
+
+
+class _ParallelIntra(object):
+    """Mixin for intra/inter parsers that parses the subgroupings
+    (turns) of a document in a pool rather than one after the other.
+
+    Subgroupings with at most `inline_size` EDUs are parsed inline,
+    as they would take less time than sending them to the pool; the
+    rest are handed out to `n_jobs` workers (with the given joblib
+    backend). With `n_jobs` of 1, or only small subgroupings, this
+    parses just like the parent class.
+
+    This mirrors `IntraInterParser.transform`, only the loop over the
+    subgroupings differs.
+    """
+
+    def _init_parallel(self, n_jobs, backend, inline_size):
+        "(for the constructors)"
+        self._n_jobs = n_jobs
+        self._backend = backend
+        self._inline_size = inline_size
+
+    def _transform_intra(self, spacks):
+        "parse each subgrouping, returning them in the same order"
+        intra = self._parsers.intra
+        pooled = [i for i, x in enumerate(spacks)
+                  if len(x.edus) > self._inline_size]
+        if self._n_jobs == 1 or len(pooled) < 2:
+            pooled = []
+        results = {}
+        if pooled:
+            jobs = (delayed(_transform)(intra, spacks[i]) for i in pooled)
+            parsed = Parallel(n_jobs=min(self._n_jobs, len(pooled)),
+                              backend=self._backend)(jobs)
+            results.update(zip(pooled, parsed))
+        return [results[i] if i in results else intra.transform(x)
+                for i, x in enumerate(spacks)]
+
+    def transform(self, dpack, nonfixed_pairs=None):
+        "parse the subgroupings (in parallel), then the whole document"
+        dpack = self.multiply(dpack)
+        dpack_spacks, _ = for_intra(dpack, dpack.target)
+        spacks = partition_subgroupings(dpack_spacks)
+        doc = dpack.edus[0].grouping if dpack.edus else None
+        with traced('decode-intra', doc=doc, units=len(spacks),
+                    n_jobs=self._n_jobs):
+            spacks = self._transform_intra(spacks)
+        return self._recombine(dpack, spacks)
+
+
+class ParallelHeadToHeadParser(_ParallelIntra, HeadToHeadParser):
+    """HeadToHeadParser parsing its subgroupings in parallel
+    (see `_ParallelIntra`)
+    """
+
+    def __init__(self, parsers, n_jobs=1, backend='threading',
+                 inline_size=4, **kwargs):
+        HeadToHeadParser.__init__(self, parsers, **kwargs)
+        self._init_parallel(n_jobs, backend, inline_size)
+
+
+class ParallelSoftParser(_ParallelIntra, SoftParser):
+    """SoftParser parsing its subgroupings in parallel
+    (see `_ParallelIntra`)
+    """
+
+    def __init__(self, parsers, n_jobs=1, backend='threading',
+                 inline_size=4, **kwargs):
+        SoftParser.__init__(self, parsers, **kwargs)
+        self._init_parallel(n_jobs, backend, inline_size)
@@ -1,10 +1,24 @@
 '''
 graphing output from the harness
+
+Graphs are only redrawn for documents whose edges (predicted, and
+gold for the diff graphs) have changed since the last time we drew
+them: each graph directory has a manifest of hashes of the edges of
+each document it contains. A document only goes into the manifest
+once its graph has actually been written (graphviz may fail or time
+out on some), so that failed graphs are tried again next time.
 '''
 
 from __future__ import print_function
+from collections import defaultdict
 from enum import Enum
+from multiprocessing import cpu_count
 from os import path as fp
+import hashlib
+import json
+import os
+import sys
+import time
 
 from attelo.fold import (select_testing)
 from attelo.graph import (diff_all, graph_all,
@@ -13,15 +27,18 @@ from attelo.io import (Torpor, load_predictions)
 from attelo.util import (concat_l)
 from joblib import (Parallel, delayed)
 
-from .local import (GRAPH_DOCS,
-                    DETAILED_EVALUATIONS)
-from .path import (decode_output_path,
-                   fold_dir_basename,
-                   report_dir_path)
-from .util import (test_evaluation)
+from .local import (GRAPH_DOCS)
 
 # pylint: disable=too-few-public-methods
 
+MAX_JOBS = 8
+"never run more than this many graphviz jobs at a time"
+
+_MANIFEST = 'graph-manifest.json'
+
+_GRAPH_EXT = '.svg'
+"extension of the graph files attelo writes (one per document)"
+
 
 class GraphDiffMode(Enum):
     "what sort of graph output to make"
@@ -40,9 +57,129 @@ def to_predictions(mpack):
                                      dpack.target)]
 
 
-def _mk_econf_graphs(lconf, edus, gold, econf, fold):
+# ---------------------------------------------------------------------
+# skipping unchanged documents
+# ---------------------------------------------------------------------
+
+
+def _edge_hashes(edus, *edge_lists):
+    """
+    Document name to hash of the (non-unrelated) edges in that
+    document, for each of the edge lists taken together
+    """
+    doc_of = {e.id: e.grouping for e in edus}
+    per_doc = defaultdict(list)
+    for i, edges in enumerate(edge_lists):
+        for edu1, edu2, label in edges:
+            if label != 'UNRELATED':
+                per_doc[doc_of.get(edu2)].append((i, edu1, edu2, label))
+    res = {}
+    for doc in set(doc_of.values()):
+        digest = hashlib.sha1()
+        for edge in sorted(per_doc[doc]):
+            digest.update(repr(edge).encode('utf-8'))
+        res[doc] = digest.hexdigest()
+    return res
+
+
+def _load_manifest(output_dir):
+    "document -> edge hash for the graphs already drawn"
+    mpath = fp.join(output_dir, _MANIFEST)
+    if not fp.exists(mpath):
+        return {}
+    with open(mpath) as stream:
+        return json.load(stream)
+
+
+def _changed_docs(output_dir, hashes):
+    """
+    Documents we want graphs for whose edges have changed since
+    they were last drawn in this directory
+    """
+    old = _load_manifest(output_dir)
+    wanted = hashes.keys() if GRAPH_DOCS is None else\
+        [d for d in GRAPH_DOCS if d in hashes]
+    return sorted(d for d in wanted if old.get(d) != hashes[d])
+
+
+def _render(key, draw, args, settings, output_dir, hashes):
+    """
+    (possibly in a worker process) draw graphs for the selected
+    documents and record the ones that were drawn in the manifest
+
+    Return the configuration key, time taken, and documents whose
+    graphs were not drawn
+    """
+    start = time.time()
+    # out of date anyway; if one is still missing after drawing, we
+    # know that document failed
+    for doc in settings.select:
+        path = fp.join(output_dir, doc + _GRAPH_EXT)
+        if fp.exists(path):
+            os.remove(path)
+    draw(*(args + [settings, output_dir]))
+    drawn = [d for d in settings.select
+             if fp.exists(fp.join(output_dir, d + _GRAPH_EXT))]
+    manifest = _load_manifest(output_dir)
+    manifest.update((d, hashes[d]) for d in drawn)
+    if not fp.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(fp.join(output_dir, _MANIFEST), 'w') as stream:
+        json.dump(manifest, stream, indent=1, sort_keys=True)
+    failed = sorted(frozenset(settings.select) - frozenset(drawn))
+    return key, time.time() - start, failed
+
+
+def _graph_job(key, draw, args, output_dir, hashes, hide=None,
+               quiet=False):
+    """
+    Job to draw graphs for the documents whose edges have changed
+    (None if there are none)
+    """
+    changed = _changed_docs(output_dir, hashes)
+    if not changed:
+        return None
+    settings = GraphSettings(hide=hide,
+                             select=changed,
+                             unrelated=False,
+                             timeout=15,
+                             quiet=quiet)
+    return delayed(_render)(key, draw, args, settings, output_dir, hashes)
+
+
+def _run_jobs(jobs):
+    """
+    Run graph jobs on a bounded pool and report how long each
+    configuration took to draw
+    """
+    jobs = [j for j in jobs if j is not None]
+    if not jobs:
+        print('graphs: nothing has changed, not redrawing',
+              file=sys.stderr)
+        return
+    n_jobs = max(1, min(MAX_JOBS, cpu_count(), len(jobs)))
+    times = defaultdict(float)
+    failures = defaultdict(list)
+    for key, seconds, failed in Parallel(n_jobs=n_jobs)(jobs):
+        times[key] += seconds
+        failures[key].extend(failed)
+    for key in sorted(times):
+        print('graphs: {} took {:.1f}s'.format(key, times[key]),
+              file=sys.stderr)
+        if failures[key]:
+            print('graphs: {} failed on {} (will retry next time)'
+                  ''.format(key, ', '.join(sorted(set(failures[key])))),
+                  file=sys.stderr)
+
+
+# ---------------------------------------------------------------------
+# graphs
+# ---------------------------------------------------------------------
+
+
+def _mk_econf_graphs(hconf, edus, gold, econf, fold):
     "Return jobs generating graphs for a single configuration"
-    predictions = load_predictions(decode_output_path(lconf, econf, fold))
+    predictions = load_predictions(hconf.decode_output_path(econf, fold))
     for diffmode in GraphDiffMode:
         # output path
         if diffmode == GraphDiffMode.solo:
@@ -55,74 +192,60 @@ def _mk_econf_graphs(lconf, edus, gold, econf, fold):
             raise Exception('Unknown diff mode {}'.format(diffmode))
 
         want_test = fold is None
-        suffix = 'test' if want_test else fold_dir_basename(fold)
-        output_dir = fp.join(report_dir_path(lconf, want_test, None),
+        suffix = 'test' if want_test\
+            else fp.basename(hconf.fold_dir_path(fold))
+        output_dir = fp.join(hconf.report_dir_path(want_test, None),
                              output_bn_prefix + suffix,
                              econf.key)
 
-        # settings
         to_hide = 'inter' if diffmode == GraphDiffMode.diff_intra else None
-        settings =\
-            GraphSettings(hide=to_hide,
-                          select=GRAPH_DOCS,
-                          unrelated=False,
-                          timeout=15,
-                          quiet=False)
-
         if diffmode == GraphDiffMode.solo:
-            yield delayed(graph_all)(edus,
-                                     predictions,
-                                     settings,
-                                     output_dir)
+            yield _graph_job(econf.key, graph_all,
+                             [edus, predictions],
+                             output_dir,
+                             _edge_hashes(edus, predictions),
+                             hide=to_hide)
         else:
-            yield delayed(diff_all)(edus,
-                                    gold,
-                                    predictions,
-                                    settings,
-                                    output_dir)
+            yield _graph_job(econf.key, diff_all,
+                             [edus, gold, predictions],
+                             output_dir,
+                             _edge_hashes(edus, gold, predictions),
+                             hide=to_hide)
 
 
-def _mk_gold_graphs(lconf, dconf):
-    "Generate graphs for a single configuration"
-    # output path
-    output_dir = fp.join(report_dir_path(lconf, None),
+def _mk_gold_graphs(hconf, dconf):
+    "Return the job generating graphs for the gold data"
+    output_dir = fp.join(hconf.report_dir_path(False, None),
                          'graphs-gold')
-
-    settings =\
-        GraphSettings(hide=None,
-                      select=GRAPH_DOCS,
-                      unrelated=False,
-                      timeout=15,
-                      quiet=True)
-
     predictions = to_predictions(dconf.pack)
     edus = concat_l(dpack.edus for dpack in dconf.pack.values())
-    graph_all(edus, predictions, settings, output_dir)
+    return _graph_job('gold', graph_all,
+                      [edus, predictions],
+                      output_dir,
+                      _edge_hashes(edus, predictions),
+                      quiet=True)
 
 
-def mk_graphs(lconf, dconf):
+def mk_graphs(hconf, dconf):
     "Generate graphs for the gold data and for one of the folds"
-    with Torpor('creating gold graphs'):
-        _mk_gold_graphs(lconf, dconf)
     fold = sorted(set(dconf.folds.values()))[0]
-
-    with Torpor('creating graphs for fold {}'.format(fold),
+    with Torpor('creating graphs (gold and fold {})'.format(fold),
                 sameline=False):
         test_pack = select_testing(dconf.pack, dconf.folds, fold)
         edus = concat_l(dpack.edus for dpack in test_pack.values())
         gold = to_predictions(test_pack)
-        jobs = []
-        for econf in DETAILED_EVALUATIONS:
-            jobs.extend(_mk_econf_graphs(lconf, edus, gold, econf, fold))
-        Parallel(n_jobs=-1)(jobs)
+        jobs = [_mk_gold_graphs(hconf, dconf)]
+        for econf in hconf.detailed_evaluations:
+            jobs.extend(_mk_econf_graphs(hconf, edus, gold, econf, fold))
+        _run_jobs(jobs)
 
 
-def mk_test_graphs(lconf, dconf):
+def mk_test_graphs(hconf, dconf):
     "Generate graphs for test data"
-    econf = test_evaluation()
+    econf = hconf.test_evaluation
     if econf is None:
         return
     with Torpor('creating test graphs'):
         edus = concat_l(dpack.edus for dpack in dconf.pack.values())
         gold = to_predictions(dconf.pack)
-        _mk_econf_graphs(lconf, edus, gold, econf, None)
+        _run_jobs(_mk_econf_graphs(hconf, edus, gold, econf, None))
@@ -1,30 +1,42 @@
 '''
 Paths to files used or generated by the test harness
 '''
+from __future__ import print_function
 from collections import Counter
 from os import path as fp
 import sys
 
 from attelo.fold import (make_n_fold)
 from attelo.harness import Harness
+from attelo.harness.config import (DataConfig)
 from attelo.harness.evaluate import (evaluate_corpus,
                                      prepare_dirs)
+import attelo.harness.evaluate
 from attelo.io import (load_fold_dict,
                        save_fold_dict)
 from attelo.parser.intra import (IntraInterPair)
 from attelo.util import (mk_rng)
 
-from .local import (CONFIG_FILE,
-                    DETAILED_EVALUATIONS,
-                    EVALUATIONS,
+from .batch_scoring import (batched_scoring)
+from .binary_mpack import (load_multipack_fast)
+from .local import (BATCH_SCORING,
+                    CONFIG_FILE,
+                    DRAW_GRAPHS,
                     FIXED_FOLD_FILE,
                     GRAPH_DOCS,
                     METRICS,
+                    MODEL_STORE,
                     REPORT_DIGITS,
+                    SHARE_SCORES_ON_DISK,
                     TEST_CORPUS,
                     TEST_EVALUATION_KEY,
-                    TRAINING_CORPUS)
-from .util import (latest_tmp, exit_ungathered)
+                    TRAINING_CORPUS,
+                    detailed_evaluations,
+                    evaluations)
+from .trace import (traced)
+from .util import (latest_tmp, exit_ungathered, swapped)
+from . import model_store
+from . import scores
 
 
 # pylint: disable=too-many-arguments, too-many-instance-attributes
@@ -39,6 +51,8 @@ class IritHarness(Harness):
             else fp.basename(TEST_CORPUS)
         super(IritHarness, self).__init__(dataset, testset)
         self.sanity_check_config()
+        self._store_memo = {}
+        self._restricted = None
 
     def run(self, runcfg):
         """Run the evaluation
@@ -51,7 +65,55 @@ class IritHarness(Harness):
         evidence_of_gathered = self.mpack_paths(False)['edu_input']
         if not fp.exists(evidence_of_gathered):
             exit_ungathered()
-        evaluate_corpus(self)
+        self.prime_model_store()
+        stage = None if runcfg.stage is None else runcfg.stage.name
+        if stage in (None, 'start'):
+            # anything left over from an earlier run is for other models
+            scores.clear_cache()
+        # attelo does not let us say how to load the multipack, so we
+        # swap in our binary-aware loader while it runs
+        with swapped(attelo.harness.evaluate, 'load_multipack',
+                     load_multipack_fast), batched_scoring(BATCH_SCORING):
+            with traced('evaluate:' + (stage or 'all'),
+                        folds=runcfg.folds):
+                evaluate_corpus(self)
+        if stage in (None, 'end'):
+            self._mk_graphs()
+        scores.print_report()
+        if stage in (None, 'end'):
+            scores.clear_cache()
+        self.publish_models()
+
+    def _mk_graphs(self):
+        """Draw graphs for the detailed evaluations (along with the
+        reports, see `stac.harness.graph`)
+        """
+        if not DRAW_GRAPHS or not self.detailed_evaluations:
+            return
+        # graphviz and friends are only needed here
+        from .graph import (mk_graphs, mk_test_graphs)
+        with traced('evaluate:graphs'):
+            paths = self.mpack_paths(test_data=False)
+            mpack = load_multipack_fast(paths['edu_input'],
+                                        paths['pairings'],
+                                        paths['features'],
+                                        paths['vocab'])
+            mk_graphs(self, DataConfig(pack=mpack,
+                                       folds=load_fold_dict(self.fold_file)))
+            if self.test_evaluation is not None:
+                paths = self.mpack_paths(test_data=True)
+                mpack = load_multipack_fast(paths['edu_input'],
+                                            paths['pairings'],
+                                            paths['features'],
+                                            paths['vocab'])
+                mk_test_graphs(self, DataConfig(pack=mpack, folds=None))
+
+    def load(self, runcfg, eval_dir, scratch_dir):
+        super(IritHarness, self).load(runcfg, eval_dir, scratch_dir)
+        # share attach/label scores between decoders (and, if asked,
+        # worker processes) within this evaluation
+        scores.set_cache_dir(fp.join(scratch_dir, 'scores')
+                             if SHARE_SCORES_ON_DISK else None)
 
     # ------------------------------------------------------
     # local settings
@@ -63,11 +125,23 @@ class IritHarness(Harness):
 
     @property
     def evaluations(self):
-        return EVALUATIONS
+        return self._restrict(evaluations())
 
     @property
     def detailed_evaluations(self):
-        return DETAILED_EVALUATIONS
+        return self._restrict(detailed_evaluations())
+
+    def restrict_evaluations(self, keys):
+        """Only run the evaluations with these keys (None for all
+        of them)
+        """
+        self._restricted = None if keys is None else frozenset(keys)
+
+    def _restrict(self, econfs):
+        "apply `restrict_evaluations`"
+        if self._restricted is None:
+            return econfs
+        return [e for e in econfs if e.key in self._restricted]
 
     # WIP harness-specific selection of metrics
     @property
@@ -185,12 +259,21 @@ class IritHarness(Harness):
         """
         parent_dir = (self.fold_dir_path(fold) if fold is not None
                       else self.combined_dir_path())
-
-        def _eval_model_path(subconf, mtype):
-            "Model for a given loop/eval config and fold"
+        paths = {}
+        for name, (subconf, mtype) in self._model_types(rconf,
+                                                        parser).items():
             bname = self._model_basename(subconf, mtype, 'model')
-            return fp.join(parent_dir, bname)
-
+            paths[name] = fp.join(parent_dir, bname)
+            if MODEL_STORE is not None and not fp.exists(paths[name]):
+                key = self._model_store_key(subconf, mtype, fold)
+                model_store.fetch(MODEL_STORE, key, paths[name])
+        return paths
+
+    @staticmethod
+    def _model_types(rconf, parser):
+        """Learner configuration and model type for each model
+        (see `model_paths`)
+        """
         if isinstance(rconf, IntraInterPair):
             # WIP
             sel_inter = parser.payload._sel_inter
@@ -202,19 +285,106 @@ class IritHarness(Harness):
             }
             # end WIP
             return {
-                'inter:attach': _eval_model_path(
-                    rconf.inter, inter_prefixes[sel_inter] + "attach"),
-                'inter:label': _eval_model_path(
-                    rconf.inter, inter_prefixes[sel_inter] + "relate"),
-                'intra:attach': _eval_model_path(
-                    rconf.intra, "sent-attach"),
-                'intra:label': _eval_model_path(
-                    rconf.intra, "sent-relate")
+                'inter:attach': (rconf.inter,
+                                 inter_prefixes[sel_inter] + "attach"),
+                'inter:label': (rconf.inter,
+                                inter_prefixes[sel_inter] + "relate"),
+                'intra:attach': (rconf.intra, "sent-attach"),
+                'intra:label': (rconf.intra, "sent-relate")
             }
         else:
-            return {'attach': _eval_model_path(rconf, "attach"),
-                    'label': _eval_model_path(rconf, "relate")}
+            return {'attach': (rconf, "attach"),
+                    'label': (rconf, "relate")}
 
+    # ------------------------------------------------------
+    # model store
+    # ------------------------------------------------------
+
+    def _learner_signature(self, rconf, mtype):
+        """Hyperparameters of the learner for a model (remembered
+        so that fitting the learner does not change it)
+        """
+        learner = rconf.attach if 'attach' in mtype else rconf.label
+        memo = self._store_memo.setdefault('signatures', {})
+        if memo.get(id(learner), (None,))[0] is not learner:
+            memo[id(learner)] = (learner,
+                                 model_store.learner_signature(
+                                     learner.payload))
+        return memo[id(learner)][1]
+
+    def prime_model_store(self):
+        """Compute learner signatures for the model store (this
+        should be done before anything gets fitted)
+        """
+        if MODEL_STORE is None:
+            return
+        for econf in self.evaluations:
+            rconfs = [econf.learner.intra, econf.learner.inter]\
+                if isinstance(econf.learner, IntraInterPair)\
+                else [econf.learner]
+            for rconf in rconfs:
+                for mtype in ['attach', 'relate']:
+                    self._learner_signature(rconf, mtype)
+
+    def _training_docs(self, fold):
+        "documents a model for the given fold is trained on"
+        if fold is None:
+            return 'all'
+        memo = self._store_memo
+        if 'fold_dict' not in memo:
+            memo['fold_dict'] = load_fold_dict(self.fold_file)
+        return sorted(d for d, f in memo['fold_dict'].items() if f != fold)
+
+    def _model_store_key(self, rconf, mtype, fold):
+        "key for a model in the model store"
+        memo = self._store_memo
+        if 'data' not in memo:
+            mpaths = self.mpack_paths(False)
+            memo['data'] = [model_store.file_digest(mpaths[k]) for k in
+                            ['edu_input', 'pairings', 'features', 'vocab']]
+            memo['versions'] = model_store.library_versions()
+        return model_store.store_key([memo['data'],
+                                      self._training_docs(fold),
+                                      mtype,
+                                      self._learner_signature(rconf, mtype),
+                                      memo['versions']])
+
+    def publish_models(self):
+        """Add newly fitted models to the model store, and report
+        how many models for each fold came from it
+        """
+        if MODEL_STORE is None:
+            return
+        folds = [None]
+        if fp.exists(self.fold_file):
+            folds.extend(sorted(set(load_fold_dict(self.fold_file).values())))
+        parent_dirs = {None: self.combined_dir_path()}
+        parent_dirs.update((f, self.fold_dir_path(f)) for f in folds[1:])
+        for fold in folds:
+            seen = set()
+            reused = 0
+            stored = 0
+            for econf in self.evaluations:
+                mtypes = self._model_types(econf.learner, econf.parser)
+                for subconf, mtype in mtypes.values():
+                    bname = self._model_basename(subconf, mtype, 'model')
+                    path = fp.join(parent_dirs[fold], bname)
+                    if path in seen or not fp.exists(path):
+                        continue
+                    seen.add(path)
+                    key = self._model_store_key(subconf, mtype, fold)
+                    if model_store.is_from_store(MODEL_STORE, key, path):
+                        reused += 1
+                    else:
+                        model_store.publish(MODEL_STORE, key, path)
+                        stored += 1
+            if seen:
+                print(('model store: {}: {} models reused, '
+                       '{} newly stored'
+                       '').format('combined' if fold is None
+                                  else 'fold {}'.format(fold),
+                                  reused, stored),
+                      file=sys.stderr)
 
     # ------------------------------------------------------
     # utility
@@ -12,28 +12,17 @@ import itertools as itr
 
 import educe.stac.corpus
 
-from attelo.harness.config import (LearnerConfig,
-                                   Keyed)
+# NB: the learner and decoder libraries (attelo, sklearn, and our own
+# configuration modules built on them) are imported in the functions
+# below that use them, rather than here: most subcommands only want a
+# setting or two from this file, and should not pay for importing
+# them; see `evaluations()`
+#
 # from attelo.decoding.astar import (AstarArgs,
 #                                    AstarDecoder,
 #                                    Heuristic,
 #                                    RfcConstraint)
-from attelo.decoding.baseline import (LocalBaseline)
-from attelo.decoding.mst import (MstDecoder, MstRootStrategy)
-from attelo.learning.local import (SklearnAttachClassifier,
-                                   SklearnLabelClassifier)
-from attelo.parser.intra import (IntraInterPair,
-                                 HeadToHeadParser,
-                                 # SentOnlyParser,
-                                 SoftParser)
-from attelo.util import (concat_l)
-
-from sklearn.linear_model import (LogisticRegression)
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.ensemble import RandomForestClassifier
-
-
-from .config.intra import (combine_intra)
+# from attelo.parser.intra import (SentOnlyParser)
 # from .config.perceptron import (attach_learner_dp_pa,
 #                                 attach_learner_dp_perc,
 #                                 attach_learner_pa,
@@ -42,18 +31,7 @@ from .config.intra import (combine_intra)
 #                                 label_learner_dp_perc,
 #                                 attach_learner_pa,
 #                                 attach_learner_perc)
-from .config.common import (ORACLE,
-                            combined_key,
-                            decoder_last,
-                            decoder_local,
-                            mk_bypass,
-                            # mk_joint,
-                            mk_post,
-                            )
-
-from .ilp import (ILPDecoder, SCIP_BIN_DIR)
-from .turn_constraint import (tc_decoder,
-                              tc_learner)
+
 # PATHS
 
 CONFIG_FILE = fp.splitext(__file__)[0] + '.py'
@@ -66,6 +44,14 @@ live with throwing away as needed"""
 SNAPSHOTS = 'data/SNAPSHOTS'
 """Results over time we are making a point of saving"""
 
+CORPUS_CACHE = fp.join(LOCAL_TMP, 'corpus-cache')
+"""Binary snapshots of parsed corpus documents (see `stac.corpus_cache`);
+safe to delete, they are rebuilt from the glozz files as needed"""
+
+MODEL_STORE = fp.join(LOCAL_TMP, 'model-store')
+"""Fitted models, shared across evaluations (see
+`stac.harness.model_store`); set to None to always refit"""
+
 
 TRAINING_CORPUS = 'data/FROZEN/training-2015-05-30'
 # TRAINING_CORPUS = 'data/tiny'
@@ -100,12 +86,21 @@ TEST_EVALUATION_KEY = 'tc-maxent-last-iheads-AD.L-pst-tc-mst'
 """Evaluation to use for testing.
 
 Leave this to None until you think it's OK to look at the test data.
-The key should be the evaluation key from one of your EVALUATIONS,
+The key should be the evaluation key from one of your `evaluations()`,
 eg. 'maxent-C0.9-AD.L_jnt-mst'
 
 (HINT: you can join them together from the report headers)
 """
 
+FALLBACK_EVALUATION_KEY = 'tc-maxent-AD.L-pst-last'
+"""Cheap evaluation for the server to fall back on.
+
+If the server is given a time budget (`irit-stac serve --budget`),
+it runs this alongside the test evaluation, and returns its result
+if the test evaluation does not finish in time. Set to None to
+disable.
+"""
+
 LEX_DIR = "lexicon"
 """
 Lexicons used to help feature extraction
@@ -127,135 +122,281 @@ and even across different runs of gather.
 NB. It's up to you to ensure that the folds file makes sense
 """
 
+CANDIDATE_POLICY = None
+"""Which EDU pairs to keep after feature extraction (None for all of
+them), eg. 'tc', 'window:10', 'adjacent-turns' or 'tc+window:10'; see
+`stac.harness.candidates`. This is applied by gather, and by the
+standalone parser and server, so you'll want to re-gather and
+re-model after changing it.
+"""
+
+CANDIDATE_POLICIES = ['tc', 'window:5', 'window:10', 'window:20',
+                      'adjacent-turns', 'tc+window:10']
+"""Candidate policies that `gather --candidates-report` reports on
+(rows saved vs gold recall lost), whether or not they are applied
+"""
+
+SHARE_SCORES_ON_DISK = False
+"""Save attach/label scores in the scratch directory so that the
+worker processes of an evaluation can share them (see
+`stac.harness.scores`); otherwise scores are only shared within a
+process. Worth it if the decoders of a fold run in separate processes
+and scoring is slow, but check the `Time spent scoring` report at the
+end of evaluate
+"""
+
+BATCH_SCORING = False
+"""Score all the documents of a test fold (or of a parse) with a
+single prediction per model before decoding them, rather than one
+prediction per document; see `stac.harness.batch_scoring`. Check the
+`fold_scoring` case of `irit-stac bench` (and `Time spent scoring`
+at the end of evaluate) before turning this on
+"""
+
 
-DECODER_LOCAL = decoder_local(0.5)
+LOCAL_THRESHOLD = 0.5
 "local decoder should accept above this score"
 
 
 def decoder_mst():
     "our instantiation of the mst decoder"
+    from attelo.decoding.mst import (MstDecoder, MstRootStrategy)
+    from attelo.harness.config import (Keyed)
     return Keyed('mst', MstDecoder(MstRootStrategy.fake_root, True))
 
 
+def decoder_tc_mst():
+    """turn constrained mst decoder (meant to give the same output as
+    `tc_decoder(decoder_mst())`, without the selected datapack; it has
+    its own key until the evaluations agree)"""
+    from attelo.harness.config import (Keyed)
+    from .turn_constraint import (TC_MstDecoder)
+    return Keyed('tc-mst-fast', TC_MstDecoder())
+
+
 def decoder_ilp():
+    from attelo.harness.config import (Keyed)
+    from .ilp import (ILPDecoder)
     return Keyed('ilp', ILPDecoder())
 
 
-def attach_learner_maxent():
-    "return a keyed instance of maxent learner"
-    return Keyed('maxent', SklearnAttachClassifier(LogisticRegression()))
+def decoder_anytime():
+    """our instantiation of the anytime decoder (same constraints as
+    the ILP, with a node budget rather than a time budget, so that
+    results are reproducible)"""
+    from attelo.harness.config import (Keyed)
+    from .anytime import (AnytimeDecoder)
+    return Keyed('anytime', AnytimeDecoder(time_budget=None,
+                                           node_budget=100000))
+
+
+def _maxent_key(C):
+    "key for a maxent learner (noting any non-default C)"
+    return 'maxent' if C == 1.0 else 'maxent-C{}'.format(C)
 
 
-def label_learner_maxent():
-    "return a keyed instance of maxent learner"
-    return Keyed('maxent', SklearnLabelClassifier(LogisticRegression()))
+def maxent(C=1.0):
+    """the sklearn model behind the maxent learners
+
+    `irit-stac sweep` fits this same model (warm starting it along
+    the values of C), so the solver is spelled out here rather than
+    left to the sklearn default, which has changed between versions
+    """
+    from sklearn.linear_model import (LogisticRegression)
+    return LogisticRegression(C=C, solver='lbfgs')
+
+
+def attach_learner_maxent(C=1.0):
+    """return a keyed instance of maxent learner
+
+    (see `irit-stac sweep` for choosing C)
+    """
+    from attelo.harness.config import (Keyed)
+    from attelo.learning.local import (SklearnAttachClassifier)
+    return Keyed(_maxent_key(C), SklearnAttachClassifier(maxent(C)))
+
+
+def label_learner_maxent(C=1.0):
+    """return a keyed instance of maxent learner
+
+    (see `irit-stac sweep` for choosing C)
+    """
+    from attelo.harness.config import (Keyed)
+    from attelo.learning.local import (SklearnLabelClassifier)
+    return Keyed(_maxent_key(C), SklearnLabelClassifier(maxent(C)))
 
 
 def attach_learner_dectree():
     "return a keyed instance of decision tree learner"
+    from attelo.harness.config import (Keyed)
+    from attelo.learning.local import (SklearnAttachClassifier)
+    from sklearn.tree import DecisionTreeClassifier
     return Keyed('dectree', SklearnAttachClassifier(DecisionTreeClassifier()))
 
 
 def label_learner_dectree():
     "return a keyed instance of decision tree learner"
+    from attelo.harness.config import (Keyed)
+    from attelo.learning.local import (SklearnLabelClassifier)
+    from sklearn.tree import DecisionTreeClassifier
     return Keyed('dectree',
                  SklearnLabelClassifier(DecisionTreeClassifier()))
 
 
 def attach_learner_rndforest():
     "return a keyed instance of random forest learner"
+    from attelo.harness.config import (Keyed)
+    from attelo.learning.local import (SklearnAttachClassifier)
+    from sklearn.ensemble import RandomForestClassifier
     return Keyed('rndforest',
                  SklearnAttachClassifier(RandomForestClassifier()))
 
 
 def label_learner_rndforest():
     "return a keyed instance of decision tree learner"
+    from attelo.harness.config import (Keyed)
+    from attelo.learning.local import (SklearnLabelClassifier)
+    from sklearn.ensemble import RandomForestClassifier
     return Keyed('rndforest', SklearnLabelClassifier(RandomForestClassifier()))
 
-_LOCAL_LEARNERS = [
-    #    ORACLE,
-    #    LearnerConfig(attach=attach_learner_maxent(),
-    #                  label=label_learner_maxent()),
-    LearnerConfig(attach=tc_learner(attach_learner_maxent()),
-                  label=tc_learner(label_learner_maxent())),
-    #    LearnerConfig(attach=attach_learner_maxent(),
-    #                  label=label_learner_oracle()),
-    #    LearnerConfig(attach=attach_learner_rndforest(),
-    #                  label=label_learner_rndforest()),
-    #    LearnerConfig(attach=attach_learner_perc(),
-    #                  label=label_learner_maxent()),
-    #    LearnerConfig(attach=attach_learner_pa(),
-    #                  label=label_learner_maxent()),
-    #    LearnerConfig(attach=attach_learner_dp_perc(),
-    #                  label=label_learner_maxent()),
-    #    LearnerConfig(attach=attach_learner_dp_pa(),
-    #                  label=label_learner_maxent()),
-]
-"""Straightforward attelo learner algorithms to try
 
-It's up to you to choose values for the key field that can distinguish
-between different configurations of your learners.
+def _local_learners():
+    """Straightforward attelo learner algorithms to try
+
+    It's up to you to choose values for the key field that can
+    distinguish between different configurations of your learners.
+    """
+    from attelo.harness.config import (LearnerConfig)
+    from .turn_constraint import (tc_learner)
+    return [
+        #    ORACLE,
+        #    LearnerConfig(attach=attach_learner_maxent(),
+        #                  label=label_learner_maxent()),
+        LearnerConfig(attach=tc_learner(attach_learner_maxent()),
+                      label=tc_learner(label_learner_maxent())),
+        #    LearnerConfig(attach=attach_learner_maxent(),
+        #                  label=label_learner_oracle()),
+        #    LearnerConfig(attach=attach_learner_rndforest(),
+        #                  label=label_learner_rndforest()),
+        #    LearnerConfig(attach=attach_learner_perc(),
+        #                  label=label_learner_maxent()),
+        #    LearnerConfig(attach=attach_learner_pa(),
+        #                  label=label_learner_maxent()),
+        #    LearnerConfig(attach=attach_learner_dp_perc(),
+        #                  label=label_learner_maxent()),
+        #    LearnerConfig(attach=attach_learner_dp_pa(),
+        #                  label=label_learner_maxent()),
+    ]
 
-"""
 
 def _structured(klearner):
     """learner configuration pair for a structured learner
     (parameterised on a decoder)"""
-    return lambda d: LearnerConfig(attach=tc_learner(klearner(d)),
+    from attelo.harness.config import (LearnerConfig)
+    from .turn_constraint import (tc_learner)
+    return lambda d: LearnerConfig(attach=tc_learner(klearner(d),
+                                                     stack=False),
                                    label=label_learner_maxent())
 
 
-_STRUCTURED_LEARNERS = [
-    #    _structured(attach_learner_dp_struct_perc),
-    #    _structured(attach_learner_dp_struct_pa),
-]
-"""Attelo learners that take decoders as arguments.
-We assume that they cannot be used relation modelling
-"""
+def _structured_learners():
+    """Attelo learners that take decoders as arguments.
+    We assume that they cannot be used relation modelling
+    """
+    return [
+        #    _structured(attach_learner_dp_struct_perc),
+        #    _structured(attach_learner_dp_struct_pa),
+    ]
 
 
 def _core_parsers(klearner):
     """Our basic parser configurations
     """
+    from .config.common import (decoder_last,
+                                decoder_local,
+                                mk_bypass,
+                                # mk_joint,
+                                mk_post)
+    from .ilp import (SCIP_BIN_DIR)
+    from .turn_constraint import (tc_decoder)
+
     # joint
     joint = [
         # mk_joint(klearner, decoder_last()),
-        # mk_joint(klearner, DECODER_LOCAL),
+        # mk_joint(klearner, decoder_local(LOCAL_THRESHOLD)),
         # mk_joint(klearner, decoder_mst()),
-        # mk_joint(klearner, tc_decoder(DECODER_LOCAL)),
-        # mk_joint(klearner, tc_decoder(decoder_mst())),
+        # mk_joint(klearner, tc_decoder(decoder_local(LOCAL_THRESHOLD))),
+        # mk_joint(klearner, decoder_tc_mst()),
     ]
 
     # postlabeling
     post = [
         mk_post(klearner, decoder_last()),
-        mk_post(klearner, DECODER_LOCAL),
+        mk_post(klearner, decoder_local(LOCAL_THRESHOLD)),
         # mk_post(klearner, decoder_mst()),
-        # mk_post(klearner, tc_decoder(DECODER_LOCAL)),
+        # mk_post(klearner, tc_decoder(decoder_local(LOCAL_THRESHOLD))),
         mk_post(klearner, tc_decoder(decoder_mst())),
+        mk_post(klearner, decoder_tc_mst()),
+        # mk_post(klearner, decoder_anytime()),
+    ]
+
+    # constrained decoders
+    bypass = [
+        # mk_bypass(klearner, decoder_anytime()),
     ]
 
     # ILP decoders
+    # (you need to install SCIP and provide the path to its
+    # binaries in SCIP_BIN_DIR in ilp.py)
     if fp.isdir(SCIP_BIN_DIR):
-        bypass = [
+        bypass.extend([
             mk_bypass(klearner, decoder_ilp()),
             mk_bypass(klearner, tc_decoder(decoder_ilp())),
-        ]
-    else:
-        # you need to install SCIP and provide the path to its
-        # binaries in SCIP_BIN_DIR in ilp.py
-        bypass = []
+        ])
 
     if klearner.attach.payload.can_predict_proba:
         return joint + post + bypass
     else:
         return post
 
-_INTRA_INTER_CONFIGS = [
-    Keyed('iheads', HeadToHeadParser),
-    # Keyed('ionly', SentOnlyParser),
-    Keyed('isoft', SoftParser),
-]
+INTRA_JOBS = 1
+"""Number of workers for decoding the turns of a document in the
+intra/inter parsers (1 to decode them one after the other, with no
+pool at all). The per-turn decoders are pure Python, so with the
+threading backend, check the `decode-intra` traces before raising
+this
+"""
+
+INTRA_BACKEND = 'threading'
+"""joblib backend for the intra/inter workers ('threading', or
+'multiprocessing' to sidestep the GIL at the cost of copying the
+parser over for every document)
+"""
+
+INTRA_INLINE_SIZE = 4
+"""Turns with at most this many EDUs are decoded inline rather than
+being sent to a worker
+"""
+
+
+def _parallel_intra(parser_class):
+    "intra/inter parser constructor with our parallel settings"
+    return lambda parsers: parser_class(parsers,
+                                        n_jobs=INTRA_JOBS,
+                                        backend=INTRA_BACKEND,
+                                        inline_size=INTRA_INLINE_SIZE)
+
+
+def _intra_inter_configs():
+    "the intra/inter parsers to try"
+    from attelo.harness.config import (Keyed)
+    from .config.intra import (ParallelHeadToHeadParser,
+                               ParallelSoftParser)
+    return [
+        Keyed('iheads', _parallel_intra(ParallelHeadToHeadParser)),
+        # Keyed('ionly', SentOnlyParser),
+        Keyed('isoft', _parallel_intra(ParallelSoftParser)),
+    ]
 
 
 # -------------------------------------------------------------------------------
@@ -268,6 +409,8 @@ HARNESS_NAME = 'irit-stac'
 def _mk_basic_intras(klearner, kconf):
     """Intra/inter parser based on a single core parser
     """
+    from attelo.parser.intra import (IntraInterPair)
+    from .config.intra import (combine_intra)
     return [combine_intra(IntraInterPair(x, x), kconf)
             for x in _core_parsers(klearner)]
 
@@ -276,6 +419,9 @@ def _mk_sorc_intras(klearner, kconf):
     """Intra/inter parsers based on a single core parser
     and a sentence oracle
     """
+    from attelo.parser.intra import (IntraInterPair)
+    from .config.common import (ORACLE)
+    from .config.intra import (combine_intra)
     parsers = [IntraInterPair(intra=x, inter=y) for x, y in
                zip(_core_parsers(ORACLE), _core_parsers(klearner))]
     return [combine_intra(p, kconf, primary='inter') for p in parsers]
@@ -285,6 +431,9 @@ def _mk_dorc_intras(klearner, kconf):
     """Intra/inter parsers based on a single core parser
     and a document oracle
     """
+    from attelo.parser.intra import (IntraInterPair)
+    from .config.common import (ORACLE)
+    from .config.intra import (combine_intra)
     parsers = [IntraInterPair(intra=x, inter=y) for x, y in
                zip(_core_parsers(klearner), _core_parsers(ORACLE))]
     return [combine_intra(p, kconf, primary='intra') for p in parsers]
@@ -294,6 +443,10 @@ def _mk_last_intras(klearner, kconf):
     """Intra/inter parsers based on a single core parser
     and the last baseline
     """
+    from attelo.harness.config import (Keyed)
+    from attelo.parser.intra import (IntraInterPair)
+    from .config.common import (combined_key, decoder_last, mk_post)
+    from .config.intra import (combine_intra)
     kconf = Keyed(key=combined_key('last', kconf),
                   payload=kconf.payload)
     econf_last = mk_post(klearner, decoder_last())
@@ -323,6 +476,10 @@ def _is_junk(econf):
     if has.intra and decoder_name == 'tc-ilp':
         return True
 
+    # so does the anytime decoder (it has the same turn constraints)
+    if has.intra and decoder_name == 'anytime':
+        return True
+
     # oracle would be redundant with sentence/doc oracles
     if has.oracle and has_intra_oracle:
         return True
@@ -336,15 +493,19 @@ def _is_junk(econf):
 
 def _evaluations():
     "the evaluations we want to run"
+    from attelo.decoding.mst import (MstDecoder, MstRootStrategy)
+    from attelo.harness.config import (Keyed)
+    from attelo.util import (concat_l)
+    from .turn_constraint import (tc_decoder)
     # non-prob mst decoder (dp learners don't do probs)
     nonprob_mst = Keyed('', MstDecoder(MstRootStrategy.fake_root, False))
     nonprob_mst = tc_decoder(nonprob_mst)
     nonprob_mst = nonprob_mst.payload
     #
     learners = []
-    learners.extend(_LOCAL_LEARNERS)
-    learners.extend(l(nonprob_mst) for l in _STRUCTURED_LEARNERS)
-    ipairs = list(itr.product(learners, _INTRA_INTER_CONFIGS))
+    learners.extend(_local_learners())
+    learners.extend(l(nonprob_mst) for l in _structured_learners())
+    ipairs = list(itr.product(learners, _intra_inter_configs()))
     res = concat_l([
         concat_l(_core_parsers(l) for l in learners),
         concat_l(_mk_basic_intras(l, x) for l, x in ipairs),
@@ -355,9 +516,27 @@ def _evaluations():
     return [x for x in res if not _is_junk(x)]
 
 
-EVALUATIONS = _evaluations()
+_MEMO = {}
 
 
+def evaluations():
+    """The evaluations we want to run.
+
+    These are only built on first use: it means importing and
+    instantiating every learner and decoder, which most subcommands
+    have no need for
+    """
+    if 'evaluations' not in _MEMO:
+        _MEMO['evaluations'] = _evaluations()
+    return _MEMO['evaluations']
+
+
+DRAW_GRAPHS = False
+"""Draw graphs of the gold data and of the detailed evaluations at
+the end of `irit-stac evaluate` (this needs graphviz, and can take a
+while; see `stac.harness.graph`)
+"""
+
 GRAPH_DOCS = [
     's2-league4-game1_07_stac_1396964826',
     's2-league4-game1_02_stac_1396964918',
@@ -369,6 +548,7 @@ Set to None to graph everything
 
 def _want_details(econf):
     "true if we should do detailed reporting on this configuration"
+    from attelo.parser.intra import (IntraInterPair)
 
     if isinstance(econf.learner, IntraInterPair):
         learners = [econf.learner.intra, econf.learner.inter]
@@ -380,17 +560,19 @@ def _want_details(econf):
     has_intra_oracle = has.intra and (kids.intra.oracle or kids.inter.oracle)
     return (has_maxent and
             any(k in econf.parser.key
-                for k in frozenset(('mst', 'astar', 'ilp'))) and
+                for k in frozenset(('mst', 'astar', 'ilp', 'anytime'))) and
             not has_intra_oracle)
 
-DETAILED_EVALUATIONS = [e for e in EVALUATIONS if _want_details(e)]
-"""
-Any evalutions that we'd like full reports and graphs for.
-You could just set this to EVALUATIONS, but this sort of
-thing (mostly the graphs) takes time and space to build
 
-HINT: set to empty list for no graphs whatsoever
-"""
+def detailed_evaluations():
+    """
+    Any evalutions that we'd like full reports and graphs for.
+    You could just return `evaluations()`, but this sort of
+    thing (mostly the graphs) takes time and space to build
+
+    HINT: return an empty list for no graphs whatsoever
+    """
+    return [e for e in evaluations() if _want_details(e)]
 
 # WIP explicit selection of metrics
 METRICS = [
@@ -411,10 +593,15 @@ REPORT_DIGITS = 3
 The configuration we would like to use for the standalone parser.
 """
 
-DIALOGUE_ACT_LEARNER = Keyed('maxent', LogisticRegression())
-"""
-Classifier to use for dialogue acts
-"""
+
+def dialogue_act_learner():
+    """
+    Classifier to use for dialogue acts
+    """
+    from attelo.harness.config import (Keyed)
+    from sklearn.linear_model import (LogisticRegression)
+    return Keyed('maxent', LogisticRegression())
+
 
 TAGGER_JAR = 'lib/ark-tweet-nlp-0.3.2.jar'
 "POS tagger jar file"
@@ -440,10 +627,10 @@ def print_evaluations():
     """
     Print out the name of each evaluation in our config
     """
-    for econf in EVALUATIONS:
+    for econf in evaluations():
         print(econf)
         print()
-    print("\n".join(econf.key for econf in EVALUATIONS))
+    print("\n".join(econf.key for econf in evaluations()))
 
 if __name__ == '__main__':
     print_evaluations()
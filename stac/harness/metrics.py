@@ -0,0 +1,222 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Live metrics for the parse server
+
+The server keeps a `ServerMetrics` up to date as it handles requests:
+counts of requests (and of degraded or failed ones), recent request
+rate, latency histograms for the whole request and for each pipeline
+stage, and whatever state it wants to show (eg. which models are
+there, how much scratch space it is using).
+
+With `serve_metrics`, a background thread answers any message on a
+local ZeroMQ REP socket with a JSON snapshot of the metrics (see
+`irit-stac metrics` for polling it).
+"""
+
+from __future__ import print_function
+from collections import OrderedDict, deque
+import os
+import resource
+import threading
+import time
+
+import zmq
+
+LATENCY_BUCKETS = (0.01, 0.03, 0.1, 0.3, 1., 3., 10., 30., 100., 300.)
+"upper bounds (seconds) of the latency histogram buckets"
+
+RATE_WINDOW = 60.
+"seconds over which we measure the request rate"
+
+
+def rss_bytes():
+    "current resident memory of this process (peak if we can't tell)"
+    try:
+        with open('/proc/self/statm') as stream:
+            pages = int(stream.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError, IndexError):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_maxrss * 1024
+
+
+class Histogram(object):
+    """
+    Counts of latencies falling in each of the `LATENCY_BUCKETS`
+    (plus one for anything longer)
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        "count a latency"
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_json(self):
+        "dictionary we can send as JSON"
+        return {'counts': list(self.counts),
+                'total': self.total,
+                'max': self.max}
+
+
+def quantile(hist, fraction):
+    """
+    Estimated latency (upper bound of the bucket) below which a
+    fraction of the entries of a histogram (as from `to_json`) fall
+
+    Returns
+    -------
+    seconds : float or None
+        None if the histogram is empty
+    """
+    count = sum(hist['counts'])
+    if not count:
+        return None
+    seen = 0
+    for i, num in enumerate(hist['counts']):
+        seen += num
+        if seen >= fraction * count:
+            bound = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS)\
+                else hist['max']
+            return min(bound, hist['max'])
+    return hist['max']
+
+
+class ServerMetrics(object):
+    """
+    What the server has been up to (safe to use from several
+    threads)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = OrderedDict((k, 0) for k in
+                                    ['requests', 'ok', 'degraded',
+                                     'failed', 'request_bytes'])
+        self.in_flight = 0
+        self.latency = OrderedDict([('request', Histogram())])
+        self.state = {}
+        self._recent = deque()
+
+    def request_started(self, request_bytes):
+        "note that a request has come in"
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['request_bytes'] += request_bytes
+            self.in_flight += 1
+
+    def request_done(self, seconds, timings=None, degraded=None):
+        """
+        Note that a request has been answered, in the given time,
+        with the time taken by each pipeline stage, and the reason
+        the answer was degraded, if it was
+        """
+        now = time.time()
+        with self._lock:
+            self.in_flight -= 1
+            self.counters['degraded' if degraded else 'ok'] += 1
+            if degraded:
+                key = 'degraded_' + degraded
+                self.counters[key] = self.counters.get(key, 0) + 1
+            self.latency['request'].add(seconds)
+            for stage, stage_seconds in (timings or {}).items():
+                if stage not in self.latency:
+                    self.latency[stage] = Histogram()
+                self.latency[stage].add(stage_seconds)
+            self._recent.append(now)
+
+    def request_failed(self):
+        "note that a request could not be answered"
+        with self._lock:
+            self.in_flight -= 1
+            self.counters['failed'] += 1
+
+    def update_state(self, **kwargs):
+        "set some of the state that goes out with the metrics"
+        with self._lock:
+            self.state.update(kwargs)
+
+    def snapshot(self):
+        "the metrics as a dictionary we can send as JSON"
+        now = time.time()
+        with self._lock:
+            while self._recent and self._recent[0] < now - RATE_WINDOW:
+                self._recent.popleft()
+            window = max(1., min(RATE_WINDOW, now - self.started))
+            return {'time': now,
+                    'pid': os.getpid(),
+                    'uptime': now - self.started,
+                    'counters': dict(self.counters),
+                    'in_flight': self.in_flight,
+                    'rate': len(self._recent) / window,
+                    'latency_buckets': list(LATENCY_BUCKETS),
+                    'latency': OrderedDict((k, v.to_json()) for k, v
+                                           in self.latency.items()),
+                    'rss_bytes': rss_bytes(),
+                    'state': dict(self.state)}
+
+
+def _answer(metrics, context, address):
+    "answer every message on the socket with a metrics snapshot"
+    # pylint: disable=no-member
+    socket = context.socket(zmq.REP)
+    # pylint: enable=no-member
+    socket.bind(address)
+    while True:
+        socket.recv()
+        socket.send_json(metrics.snapshot())
+
+
+def serve_metrics(metrics, port, context=None):
+    """
+    Answer metrics requests on a local port in the background
+
+    Returns
+    -------
+    thread : threading.Thread
+    """
+    context = context or zmq.Context.instance()
+    address = 'tcp://127.0.0.1:{}'.format(port)
+    thread = threading.Thread(target=_answer,
+                              args=(metrics, context, address),
+                              name='metrics')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def poll_metrics(address, timeout=2.):
+    """
+    Ask a server for its metrics
+
+    Returns
+    -------
+    snapshot : dict or None
+        None if there was no answer in time
+    """
+    context = zmq.Context.instance()
+    # pylint: disable=no-member
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    # pylint: enable=no-member
+    socket.connect(address)
+    try:
+        socket.send(b'metrics')
+        if not socket.poll(int(timeout * 1000)):
+            return None
+        return socket.recv_json()
+    finally:
+        socket.close()
@@ -0,0 +1,174 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Content-addressed store of fitted models
+
+Evaluations name their models after the dataset, learner key and
+task, and keep them in their own evaluation directory. So every
+evaluation refits every model for every fold, even if the features
+have not changed since last time.
+
+The store holds fitted models under a key derived from everything
+that goes into fitting them:
+
+* the feature files (the same features on the same training documents
+  give the same training rows)
+* the documents in the training part of the fold
+* the kind of model (attach, relate, sent-attach, ...)
+* the learner and its hyperparameters
+* the versions of the libraries doing the learning
+
+The harness links store entries into the evaluation directory
+before fitting (attelo then just loads them instead of fitting),
+and adds any newly fitted models to the store at the end of the run.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import hashlib
+import inspect
+import os
+import shutil
+
+import numpy as np
+
+_DIGESTS = {}
+"(path, size, mtime) -> sha1 of file contents"
+
+_LIBRARIES = ['attelo', 'educe', 'scikit-learn', 'numpy', 'scipy']
+
+
+def file_digest(path):
+    """
+    sha1 of a file's contents (remembered for as long as the file
+    keeps the same size and modification time)
+    """
+    stat = os.stat(path)
+    memo_key = (fp.abspath(path), stat.st_size, stat.st_mtime)
+    if memo_key not in _DIGESTS:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as stream:
+            for chunk in iter(lambda: stream.read(1 << 20), b''):
+                digest.update(chunk)
+        _DIGESTS[memo_key] = digest.hexdigest()
+    return _DIGESTS[memo_key]
+
+
+def library_versions():
+    """
+    Versions of the libraries that could affect what gets learned
+    """
+    try:
+        import pkg_resources
+    except ImportError:
+        return []
+    res = []
+    for lib in _LIBRARIES:
+        try:
+            res.append((lib, pkg_resources.get_distribution(lib).version))
+        except pkg_resources.DistributionNotFound:
+            res.append((lib, None))
+    return res
+
+
+def _is_fitted_attr(name):
+    """
+    True for attributes that are set by fitting rather than by
+    configuration (sklearn convention: trailing underscore)
+    """
+    return name.endswith('_') or name == '_score_key'
+
+
+def learner_signature(obj, depth=0):
+    """
+    String describing a (possibly wrapped) learner and its
+    hyperparameters, but not anything learned by fitting it
+    """
+    if depth > 8:
+        return '...'
+    if obj is None or isinstance(obj, (bool, int, float, str, type(u''),
+                                       np.generic)):
+        return repr(obj)
+    if inspect.isroutine(obj) or inspect.isclass(obj):
+        return '{}.{}'.format(getattr(obj, '__module__', None),
+                              getattr(obj, '__name__', None))
+    if isinstance(obj, (list, tuple)):
+        return '[{}]'.format(', '.join(learner_signature(x, depth + 1)
+                                       for x in obj))
+    if isinstance(obj, dict):
+        items = sorted((str(k), learner_signature(v, depth + 1))
+                       for k, v in obj.items())
+        return '{{{}}}'.format(', '.join('{}: {}'.format(k, v)
+                                         for k, v in items))
+    name = '{}.{}'.format(type(obj).__module__, type(obj).__name__)
+    if hasattr(obj, 'get_params'):
+        params = obj.get_params(deep=False)
+    elif hasattr(obj, '__dict__'):
+        params = {k: v for k, v in vars(obj).items()
+                  if not _is_fitted_attr(k)}
+    else:
+        return name
+    return '{}({})'.format(name, learner_signature(params, depth + 1))
+
+
+def store_key(parts):
+    """
+    Key for a store entry given a list of things that go into
+    fitting the model (which should all have a stable `repr`)
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _entry_path(store_dir, key):
+    "where the model for a key lives"
+    return fp.join(store_dir, key[:2], key + '.model')
+
+
+def _link_or_copy(src, tgt):
+    "hard link a file if we can, copy it if we can't"
+    tmp_path = '{}.{}.tmp'.format(tgt, os.getpid())
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.rename(tmp_path, tgt)
+
+
+def fetch(store_dir, key, path):
+    """
+    Put the stored model for a key (if any) at the given path.
+    Return True if there was one
+    """
+    entry = _entry_path(store_dir, key)
+    if not fp.exists(entry):
+        return False
+    parent = fp.dirname(path)
+    if parent and not fp.exists(parent):
+        os.makedirs(parent)
+    _link_or_copy(entry, path)
+    return True
+
+
+def is_from_store(store_dir, key, path):
+    "True if the model at this path was fetched from the store"
+    entry = _entry_path(store_dir, key)
+    return (fp.exists(entry) and fp.exists(path) and
+            fp.samefile(entry, path))
+
+
+def publish(store_dir, key, path):
+    """
+    Add a freshly fitted model to the store (if it's not
+    there already)
+    """
+    entry = _entry_path(store_dir, key)
+    if fp.exists(entry) or not fp.exists(path):
+        return
+    if not fp.exists(fp.dirname(entry)):
+        os.makedirs(fp.dirname(entry))
+    _link_or_copy(path, entry)
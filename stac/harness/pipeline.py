@@ -5,26 +5,34 @@
 Support for parser pipeline
 """
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from os import path as fp
 import os
 import re
 import sys
+import time
 
 from joblib import Parallel
 
 from attelo.harness import (RuntimeConfig)
 from attelo.harness.interface import (HarnessException)
 from attelo.harness.util import call, makedirs
-from attelo.io import (Torpor, load_multipack)
+from attelo.io import (Torpor)
 import attelo.harness.parse as ath_parse
 
+from .batch_scoring import (prime_parser)
+from .binary_mpack import (load_multipack_fast)
 from .harness import (IritHarness)
-from .local import (EVALUATIONS,
-                    SNAPSHOTS,
+from .local import (SNAPSHOTS,
+                    BATCH_SCORING,
+                    CANDIDATE_POLICY,
+                    FALLBACK_EVALUATION_KEY,
+                    SHARE_SCORES_ON_DISK,
                     TEST_EVALUATION_KEY,
                     TAGGER_JAR)
+from .trace import (traced)
 from .util import (concat_i)
+from . import scores
 
 # pylint: disable=too-few-public-methods
 
@@ -41,23 +49,37 @@ class StandaloneParser(IritHarness):
         harness_dir = fp.dirname(fp.dirname(fp.abspath(__file__)))
         self.root_dir = fp.dirname(harness_dir)
         self.snap_dir = fp.abspath(latest_snap())
+        self.candidate_policy = CANDIDATE_POLICY
         super(StandaloneParser, self).__init__()
         super(StandaloneParser, self).load(RuntimeConfig.empty(),
                                            self.snap_dir,
                                            self.snap_dir)
+        # scores only make sense for the input we are parsing
+        scores.set_cache_dir(self.tmp('scores') if SHARE_SCORES_ON_DISK
+                             else None)
 
-    @property
-    def test_evaluation(self):
-        # overriden to skip TEST_CORPUS check
-        if TEST_EVALUATION_KEY is None:
+    def _evaluation(self, key):
+        "the evaluation with the given key (if any)"
+        if key is None:
             return None
-        test_confs = [x for x in self.evaluations
-                      if x.key == TEST_EVALUATION_KEY]
-        if test_confs:
-            return test_confs[0]
+        confs = [x for x in self.evaluations if x.key == key]
+        if confs:
+            return confs[0]
         else:
             return None
 
+    @property
+    def test_evaluation(self):
+        # overriden to skip TEST_CORPUS check
+        return self._evaluation(TEST_EVALUATION_KEY)
+
+    @property
+    def fallback_evaluation(self):
+        """
+        Cheaper evaluation to use when the test evaluation takes
+        too long
+        """
+        return self._evaluation(FALLBACK_EVALUATION_KEY)
 
     def tmp(self, relpath):
         """
@@ -105,15 +127,24 @@ def run_pipeline(lconf, stages):
     They don't feed into each other (yet); communication between stages is
     based on assumed side effects (ie. writing into files at conventional
     locations).
+
+    Return the time taken by each stage (OrderedDict from stage
+    logname to seconds)
     """
     logdir = lconf.tmp("logs")
     makedirs(logdir)
+    timings = OrderedDict()
     for stage in stages:
         msg = stage.description
         logpath = fp.join(logdir, stage.logname + ".txt")
+        start = time.time()
         with stac_msg(msg or "", quiet=msg is None):
             with open(logpath, 'w') as log:
-                stage.function(lconf, log)
+                with traced('stage:' + stage.logname,
+                            soclog=stub_name(lconf)):
+                    stage.function(lconf, log)
+        timings[stage.logname] = time.time() - start
+    return timings
 
 # ---------------------------------------------------------------------
 # pipeline paths
@@ -247,6 +278,8 @@ def _get_decoding_jobs(mpack, lconf, econf):
     cache = lconf.model_paths(econf.learner, None, econf.parser)
     parser = econf.parser.payload
     parser.fit([], [], cache=cache)  # we assume everything is cached
+    if BATCH_SCORING:
+        prime_parser(parser, mpack.values())
     return ath_parse.jobs(mpack, parser, output_path)
 
 
@@ -264,10 +297,10 @@ def decode(lconf, evaluations):
 
     fpath = minicorpus_path(lconf) + '.relations.sparse'
     vocab_path = lconf.mpack_paths(test_data=False)['vocab']
-    mpack = load_multipack(fpath + '.edu_input',
-                           fpath + '.pairings',
-                           fpath,
-                           vocab_path)
+    mpack = load_multipack_fast(fpath + '.edu_input',
+                                fpath + '.pairings',
+                                fpath,
+                                vocab_path)
     decoder_jobs = concat_i(_get_decoding_jobs(mpack, lconf, econf)
                             for econf in evaluations)
     Parallel(n_jobs=lconf.runcfg.n_jobs, verbose=True)(decoder_jobs)
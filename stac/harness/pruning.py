@@ -0,0 +1,230 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Successive halving over evaluation configurations
+
+Rather than running every configuration on every fold, we run them
+all on a first few folds (a "rung"), score them, and drop the ones
+that are dominated by some other configuration on all of the
+`METRICS`. Only the survivors go on to the next rung, and so on until
+the last rung, which covers the remaining folds. At most half of the
+configurations are dropped at each rung.
+
+The report is only generated for the configurations that made it
+through every rung; the pruning report in the evaluation directory
+says which configurations were dropped, when, and with what scores.
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+from os import path as fp
+import json
+import sys
+
+from attelo.harness import (RuntimeConfig, ClusterStage)
+from attelo.io import (load_fold_dict, load_predictions)
+from attelo.table import (UNRELATED)
+
+from .binary_mpack import (load_multipack_fast)
+from .harness import (IritHarness)
+from .local import (METRICS, TEST_EVALUATION_KEY)
+
+_REPORT = 'pruning-report'
+
+
+# ---------------------------------------------------------------------
+# scoring
+# ---------------------------------------------------------------------
+
+
+def _f1(gold, pred):
+    "f1 score of a predicted set against a gold set"
+    if not gold and not pred:
+        return 1.
+    tpos = len(gold & pred)
+    if tpos == 0:
+        return 0.
+    precision = float(tpos) / len(pred)
+    recall = float(tpos) / len(gold)
+    return 2 * precision * recall / (precision + recall)
+
+
+def _edu_heads(links):
+    "EDU -> frozenset of labelled links into it"
+    heads = defaultdict(set)
+    for edu1, edu2, label in links:
+        heads[edu2].add((edu1, label))
+    return {k: frozenset(v) for k, v in heads.items()}
+
+
+def score_links(gold, pred):
+    """
+    Score predicted links (edu1, edu2, label) against the gold ones
+
+    We only do the metrics that are cheap to compute here: `edges`
+    (unlabelled attachment f1), `edges_by_label` (labelled f1) and
+    `edus` (proportion of EDUs whose incoming links are exactly
+    right). This is not meant to replace the attelo report, just to
+    rank configurations against each other.
+    """
+    gold = set(gold)
+    pred = set(l for l in pred if l[2] != UNRELATED)
+    gold_heads = _edu_heads(gold)
+    pred_heads = _edu_heads(pred)
+    edus = set(gold_heads) | set(pred_heads)
+    good_edus = [e for e in edus if gold_heads.get(e) == pred_heads.get(e)]
+    return {'edges': _f1(set(l[:2] for l in gold), set(l[:2] for l in pred)),
+            'edges_by_label': _f1(gold, pred),
+            'edus': float(len(good_edus)) / len(edus) if edus else 1.}
+
+
+def _gold_links(mpack, docs):
+    "gold links for the given documents"
+    return [(x1.id, x2.id, dpack.get_label(t))
+            for doc, dpack in mpack.items() if doc in docs
+            for ((x1, x2), t) in zip(dpack.pairings, dpack.target)
+            if dpack.get_label(t) != UNRELATED]
+
+
+def _score_configs(hconf, econfs, folds, gold):
+    "key -> metric -> score over the given folds"
+    res = {}
+    for econf in econfs:
+        pred = []
+        for fold in folds:
+            pred.extend(load_predictions(hconf.decode_output_path(econf,
+                                                                  fold)))
+        scores = score_links(gold, pred)
+        res[econf.key] = {m: scores[m] for m in METRICS if m in scores}
+    return res
+
+
+# ---------------------------------------------------------------------
+# pruning
+# ---------------------------------------------------------------------
+
+
+def _dominates(scores1, scores2):
+    "True if the first set of scores dominates the second"
+    return (all(scores1[m] >= scores2[m] for m in scores1) and
+            any(scores1[m] > scores2[m] for m in scores1))
+
+
+def select_survivors(scores, protect=None):
+    """
+    Return the configurations to keep, and the ones to drop (those
+    dominated by another configuration, the worst first, but no more
+    than half of them). The `protect` configuration is never dropped
+    """
+    dominated_by = {k: [k2 for k2 in scores
+                        if k2 != k and _dominates(scores[k2], scores[k])]
+                    for k in scores}
+    candidates = [k for k in scores if dominated_by[k] and k != protect]
+
+    def badness(key):
+        "the more configs beat this one, and the lower it scores, the worse"
+        return (-len(dominated_by[key]), sum(scores[key].values()))
+
+    candidates.sort(key=badness)
+    dropped = candidates[:len(scores) // 2]
+    kept = [k for k in scores if k not in dropped]
+    return kept, dropped
+
+
+def _rungs(folds, sizes):
+    "split the folds into rungs of the given cumulative sizes"
+    res = []
+    start = 0
+    for size in sizes:
+        if size <= start or size >= len(folds):
+            continue
+        res.append(folds[start:size])
+        start = size
+    res.append(folds[start:])
+    return res
+
+
+def _run_stage(stage, folds, mode, n_jobs, keys=None):
+    "run a single evaluation stage on the given configurations"
+    hconf = IritHarness()
+    if keys is not None:
+        hconf.restrict_evaluations(keys)
+    runcfg = RuntimeConfig(mode=mode,
+                           folds=folds,
+                           stage=stage,
+                           n_jobs=n_jobs)
+    hconf.run(runcfg)
+    return hconf
+
+
+def _write_report(eval_dir, history, survivors):
+    "save the record of what was pruned when"
+    with open(fp.join(eval_dir, _REPORT + '.json'), 'w') as stream:
+        json.dump({'rungs': history, 'survivors': survivors},
+                  stream, indent=1, sort_keys=True)
+    with open(fp.join(eval_dir, _REPORT + '.txt'), 'w') as stream:
+        for i, rung in enumerate(history):
+            print('rung {} (folds {}): {} configs, {} pruned'
+                  ''.format(i, ' '.join(str(f) for f in rung['folds']),
+                            len(rung['scores']), len(rung['pruned'])),
+                  file=stream)
+            for key in rung['pruned']:
+                scores = ' '.join('{}={:.3f}'.format(m, v) for m, v in
+                                  sorted(rung['scores'][key].items()))
+                print('    pruned {}: {}'.format(key, scores),
+                      file=stream)
+        print('survivors: {}'.format(len(survivors)), file=stream)
+        for key in survivors:
+            print('    ' + key, file=stream)
+
+
+def run_pruned(mode, n_jobs, rung_sizes):
+    """
+    Run an evaluation with successive halving over configurations
+
+    Parameters
+    ----------
+    mode : string or None
+        Evaluation mode (as for the evaluate command)
+
+    n_jobs : int
+
+    rung_sizes : [int]
+        Cumulative number of folds after each rung but the last
+        (the last rung takes whatever folds are left)
+    """
+    hconf = _run_stage(ClusterStage.start, None, mode, n_jobs)
+    fold_dict = load_fold_dict(hconf.fold_file)
+    folds = sorted(set(fold_dict.values()))
+    mpaths = hconf.mpack_paths(False)
+    mpack = load_multipack_fast(mpaths['edu_input'],
+                                mpaths['pairings'],
+                                mpaths['features'],
+                                mpaths['vocab'])
+    survivors = [e.key for e in hconf.evaluations]
+    history = []
+    done = []
+    rungs = _rungs(folds, rung_sizes)
+    for i, rung in enumerate(rungs):
+        hconf = _run_stage(ClusterStage.main, rung, None, n_jobs,
+                           keys=survivors)
+        done.extend(rung)
+        if i == len(rungs) - 1:
+            break
+        docs = set(d for d, f in fold_dict.items() if f in done)
+        scores = _score_configs(hconf, hconf.evaluations, done,
+                                _gold_links(mpack, docs))
+        survivors, pruned = select_survivors(scores,
+                                             protect=TEST_EVALUATION_KEY)
+        history.append({'folds': list(done),
+                        'scores': scores,
+                        'pruned': pruned})
+        print(('[prune] after folds {}: kept {}, pruned {}'
+               '').format(' '.join(str(f) for f in done),
+                          len(survivors), len(pruned)),
+              file=sys.stderr)
+    _run_stage(ClusterStage.combined_models, None, None, n_jobs,
+               keys=survivors)
+    _write_report(hconf.eval_dir, history, survivors)
+    _run_stage(ClusterStage.end, None, None, n_jobs, keys=survivors)
@@ -0,0 +1,237 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Local scheduler for the cluster-mode evaluation stages
+
+This runs the same graph of jobs as `cluster/go`, ie. ::
+
+    start -> (combined models, fold 0, fold 1, ...) -> end
+
+but as processes on the local machine rather than SLURM jobs. Each
+job is given a number of slots (its `n_jobs`), and we never run more
+jobs at a time than there are slots to go around.
+
+Finished jobs are recorded in a state file in the evaluation
+directory, so `evaluate --resume --scheduler local` only reruns what
+did not finish last time.
+"""
+
+from __future__ import print_function
+from multiprocessing import (Process, Queue, cpu_count)
+from os import path as fp
+import json
+import os
+import sys
+import time
+
+from attelo.harness import (RuntimeConfig, ClusterStage)
+from attelo.io import (load_fold_dict)
+
+from .harness import (IritHarness)
+
+_STATE_FILE = 'scheduler-state.json'
+_REPORT_EVERY = 30
+"seconds between progress reports (if nothing else happens)"
+
+
+def _run_node(stage, folds, mode, n_jobs, queue=None):
+    """
+    (in a child process) run a single stage of the evaluation;
+    for the start stage, send back the evaluation dir and folds
+    """
+    runcfg = RuntimeConfig(mode=mode,
+                           folds=folds,
+                           stage=stage,
+                           n_jobs=n_jobs)
+    hconf = IritHarness()
+    hconf.run(runcfg)
+    if queue is not None:
+        fold_dict = load_fold_dict(hconf.fold_file)
+        queue.put((hconf.eval_dir, sorted(set(fold_dict.values()))))
+
+
+class Node(object):
+    """
+    A job in the evaluation graph
+    """
+    def __init__(self, name, stage, folds=None):
+        self.name = name
+        self.stage = stage
+        self.folds = folds
+        self.proc = None
+        self.started = None
+
+    def start(self, mode, n_jobs):
+        "launch the job in a child process"
+        self.proc = Process(target=_run_node,
+                            args=(self.stage, self.folds, mode, n_jobs))
+        self.proc.start()
+        self.started = time.time()
+
+    def elapsed(self):
+        "seconds since the job was started"
+        return time.time() - self.started
+
+
+class LocalScheduler(object):
+    """
+    Run an evaluation as a graph of cluster-mode stages
+
+    Parameters
+    ----------
+    mode : string or None
+        Evaluation mode ('resume', 'jumpstart', None) as for the
+        evaluate command; passed on to all but the end stage (like
+        `cluster/go` does)
+
+    slots : int
+        Number of slots available (defaults to the number of CPUs)
+
+    n_jobs : int
+        `n_jobs` for each stage; a stage takes up this many slots
+        (or one if it is sequential)
+    """
+    def __init__(self, mode, slots=None, n_jobs=1):
+        self.mode = mode
+        self.slots = slots or cpu_count()
+        self.n_jobs = n_jobs
+        self.node_slots = min(self.slots, max(1, n_jobs))
+        self.state = {}
+        self.state_path = None
+
+    # ------------------------------------------------------
+    # state
+    # ------------------------------------------------------
+
+    def _load_state(self, eval_dir):
+        "read the record of finished jobs for this evaluation"
+        self.state_path = fp.join(eval_dir, _STATE_FILE)
+        if fp.exists(self.state_path):
+            with open(self.state_path) as stream:
+                self.state = json.load(stream)
+        else:
+            self.state = {}
+
+    def _mark_done(self, node):
+        "record that a job has finished"
+        self.state[node.name] = {'seconds': node.elapsed()}
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as stream:
+            json.dump(self.state, stream, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.state_path)
+
+    def _fold_durations(self):
+        "how long each finished fold took"
+        return [v['seconds'] for k, v in self.state.items()
+                if k.startswith('fold-')]
+
+    # ------------------------------------------------------
+    # progress
+    # ------------------------------------------------------
+
+    def _eta(self, pending, running):
+        """
+        Estimated seconds until the folds are done, or None if no
+        fold has finished yet
+        """
+        durations = self._fold_durations()
+        if not durations:
+            return None
+        mean = sum(durations) / len(durations)
+        work = sum(max(0., mean - n.elapsed()) for n in running
+                   if n.name.startswith('fold-'))
+        work += mean * len([n for n in pending
+                            if n.name.startswith('fold-')])
+        width = max(1, self.slots // self.node_slots)
+        return work / width
+
+    def _report(self, pending, running, total):
+        "print progress so far"
+        done = total - len(pending) - len(running)
+        eta = self._eta(pending, running)
+        eta_str = '?' if eta is None else '{:.0f}s'.format(eta)
+        print(('[scheduler] {}/{} jobs done, running: {} '
+               '(folds ETA {})'
+               '').format(done, total,
+                          ' '.join(n.name for n in running) or '-',
+                          eta_str),
+              file=sys.stderr)
+
+    # ------------------------------------------------------
+    # running
+    # ------------------------------------------------------
+
+    def _run_start(self):
+        """
+        Run the start stage (always, so that we know where the
+        evaluation lives); return the folds
+        """
+        print('[scheduler] start', file=sys.stderr)
+        queue = Queue()
+        proc = Process(target=_run_node,
+                       args=(ClusterStage.start, None, self.mode,
+                             self.n_jobs, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            sys.exit('[scheduler] start stage failed')
+        eval_dir, folds = queue.get()
+        self._load_state(eval_dir)
+        return folds
+
+    def _run_parallel(self, nodes):
+        """
+        Run independent jobs, as many at a time as the slots allow.
+        Return the names of jobs that failed
+        """
+        pending = [n for n in nodes if n.name not in self.state]
+        for node in nodes:
+            if node.name in self.state:
+                print('[scheduler] already done:', node.name,
+                      file=sys.stderr)
+        total = len(pending)
+        running = []
+        failed = []
+        last_report = time.time()
+        while pending or running:
+            while (pending and not failed and
+                   self.node_slots * (len(running) + 1) <= self.slots):
+                node = pending.pop(0)
+                node.start(self.mode, self.n_jobs)
+                running.append(node)
+            time.sleep(1)
+            changed = False
+            for node in list(running):
+                if node.proc.is_alive():
+                    continue
+                node.proc.join()
+                running.remove(node)
+                changed = True
+                if node.proc.exitcode == 0:
+                    self._mark_done(node)
+                else:
+                    failed.append(node.name)
+                    print('[scheduler] FAILED:', node.name,
+                          file=sys.stderr)
+            if failed:
+                # don't start anything new, just wait for the rest
+                pending = []
+            if changed or time.time() - last_report > _REPORT_EVERY:
+                self._report(pending, running, total)
+                last_report = time.time()
+        return failed
+
+    def run(self):
+        "run the whole evaluation"
+        folds = self._run_start()
+        nodes = [Node('combined-models', ClusterStage.combined_models)]
+        nodes.extend(Node('fold-{}'.format(f), ClusterStage.main, [f])
+                     for f in folds)
+        failed = self._run_parallel(nodes)
+        if failed:
+            sys.exit(('[scheduler] not generating report; these jobs '
+                      'failed: {}\n(fix and rerun with --resume)'
+                      '').format(' '.join(failed)))
+        print('[scheduler] end', file=sys.stderr)
+        _run_node(ClusterStage.end, None, None, self.n_jobs)
@@ -0,0 +1,353 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""Sharing attachment/label scores between parsers.
+
+Many of our parser configurations wrap the same attach and label
+models (eg. the postlabelling pipelines for `last`, `local` and
+`tc-mst`, and the ILP bypass pipeline), so without any sharing, we
+would be asking the same model to score the same datapack once for
+every decoder.
+
+Scores are keyed on the model (each fitted model gets a fresh key
+which is saved along with it, so every copy loaded from the same
+model file shares it; in practice the key stands for learner and
+fold) and on the datapack. The most recently used ones are kept in
+memory, and, if a cache directory is set (see `SHARE_SCORES_ON_DISK`
+in local.py), they are also saved on disk so that they can be shared
+between the worker processes of an evaluation.
+"""
+
+from __future__ import print_function
+from collections import defaultdict, OrderedDict
+from os import path as fp
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.sparse
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+MEMORY_SIZE = 256
+"number of (model, datapack) scores to keep in memory"
+
+DISK_LIMIT = 1024 * 1024 * 1024
+"""bytes of scores each process may save in the cache directory
+(beyond that, new scores are only kept in memory)"""
+
+_CONFIG = {'dir': None, 'written': 0, 'full': False}
+_MEMORY = OrderedDict()
+_STATS = []
+_STATS_FILE = 'stats.jsonl'
+
+
+def set_cache_dir(cache_dir):
+    """
+    Save scores in (and look them up from) this directory.
+    Use None for an in-memory only cache
+    """
+    if cache_dir is not None and not fp.exists(cache_dir):
+        os.makedirs(cache_dir)
+    _CONFIG['dir'] = cache_dir
+    _CONFIG['written'] = 0
+    _CONFIG['full'] = False
+    _MEMORY.clear()
+    del _STATS[:]
+
+
+def clear_cache():
+    """
+    Forget all scores, in memory and in the cache directory (eg.
+    when the input they were computed on has changed)
+    """
+    _MEMORY.clear()
+    del _STATS[:]
+    _CONFIG['written'] = 0
+    _CONFIG['full'] = False
+    cache_dir = _CONFIG['dir']
+    if cache_dir is None or not fp.exists(cache_dir):
+        return
+    for fname in os.listdir(cache_dir):
+        if fname.endswith('.pickle') or fname == _STATS_FILE:
+            os.remove(fp.join(cache_dir, fname))
+
+
+def datapack_key(dpack, nonfixed_pairs=None):
+    """
+    Identifier for a datapack as far as scoring is concerned
+
+    We only look at what is cheap to look at (hashing the pairings
+    or the feature matrix costs about as much as scoring them): the
+    first and last pairings, the number of pairings, and the shape
+    and number of non-zero entries of the feature matrix. This tells
+    apart the datapacks of different documents, and the selections
+    made from them (eg. for turns), but not two versions of a
+    document with different feature values; the cache is cleared
+    whenever the input changes (for each run of evaluate, and for
+    each request to the server), so these never meet
+    """
+    data = dpack.data
+    pairings = dpack.pairings
+    ends = [(e1.id, e2.id) for e1, e2 in
+            ([pairings[0], pairings[-1]] if len(pairings) else [])]
+    nnz = data.nnz if scipy.sparse.issparse(data) else None
+    digest = hashlib.sha1(repr([ends, len(pairings), data.shape, nnz])
+                          .encode('utf-8'))
+    if nonfixed_pairs is not None:
+        digest.update(np.asarray(nonfixed_pairs).tobytes())
+    return digest.hexdigest()
+
+
+def _note(entry):
+    """
+    Note a cache lookup or batch (in the stats file if we have a
+    cache directory, so that we hear from every worker process)
+    """
+    cache_dir = _CONFIG['dir']
+    if cache_dir is None:
+        _STATS.append(entry)
+        return
+    entry['pid'] = os.getpid()
+    with open(fp.join(cache_dir, _STATS_FILE), 'a') as stream:
+        stream.write(json.dumps(entry) + '\n')
+
+
+def _record(hit, seconds):
+    "note a cache lookup"
+    _note({'hit': hit, 'seconds': seconds})
+
+
+def _record_batch(count, seconds):
+    "note a batched scoring of several datapacks"
+    _note({'batch': count, 'seconds': seconds})
+
+
+def _copy(scores):
+    "defensive copy (callers may modify scores in place)"
+    if isinstance(scores, np.ndarray):
+        return scores.copy()
+    return scores
+
+
+def _cache_path(key):
+    "where the scores for a key are saved on disk (if anywhere)"
+    cache_dir = _CONFIG['dir']
+    return None if cache_dir is None\
+        else fp.join(cache_dir, key + '.pickle')
+
+
+def _remember(key, entry):
+    "keep an entry in memory (dropping the least recently used)"
+    _MEMORY.pop(key, None)
+    _MEMORY[key] = entry
+    while len(_MEMORY) > MEMORY_SIZE:
+        _MEMORY.popitem(last=False)
+
+
+def _lookup(key):
+    "(scores, seconds) for a key if we have them, else None"
+    if key in _MEMORY:
+        entry = _MEMORY[key]
+        _remember(key, entry)
+        return entry
+    cache_path = _cache_path(key)
+    if cache_path is not None and fp.exists(cache_path):
+        with open(cache_path, 'rb') as stream:
+            entry = pickle.load(stream)
+        _remember(key, entry)
+        return entry
+    return None
+
+
+def _store(key, scores, seconds, memory=True):
+    "remember the scores for a key (on disk if we can, and/or in memory)"
+    cache_path = _cache_path(key)
+    if cache_path is not None and _CONFIG['written'] >= DISK_LIMIT:
+        if not _CONFIG['full']:
+            print('[scores] saved {} bytes of scores, keeping any '
+                  'more in memory only'.format(_CONFIG['written']),
+                  file=sys.stderr)
+            _CONFIG['full'] = True
+        cache_path = None
+    if memory or cache_path is None:
+        _remember(key, (scores, seconds))
+    if cache_path is not None:
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as stream:
+            pickle.dump((scores, seconds), stream, pickle.HIGHEST_PROTOCOL)
+        _CONFIG['written'] += fp.getsize(tmp_path)
+        os.rename(tmp_path, cache_path)
+
+
+def cached_scores(model_key, dpack, compute, nonfixed_pairs=None):
+    """Return the scores for a datapack, computing them if nobody
+    has done so yet with this model
+
+    Parameters
+    ----------
+    model_key : string or None
+        Key identifying the fitted model (None to disable caching)
+
+    dpack : DataPack
+        Datapack to score
+
+    compute : () -> scores
+        How to actually compute the scores
+
+    Returns
+    -------
+    scores
+        Whatever `compute` returns
+    """
+    if model_key is None:
+        return compute()
+    key = '{}-{}'.format(model_key, datapack_key(dpack, nonfixed_pairs))
+    found = _lookup(key)
+    if found is not None:
+        scores, seconds = found
+        _record(True, seconds)
+        return _copy(scores)
+
+    start = time.time()
+    scores = compute()
+    seconds = time.time() - start
+    _store(key, scores, seconds)
+    _record(False, seconds)
+    return _copy(scores)
+
+
+def _stacked(dpacks):
+    "all the datapacks as a single one"
+    return dpacks[0]._replace(
+        edus=[e for d in dpacks for e in d.edus],
+        pairings=[p for d in dpacks for p in d.pairings],
+        data=scipy.sparse.vstack([d.data for d in dpacks]).tocsr(),
+        target=np.concatenate([np.asarray(d.target) for d in dpacks]))
+
+
+def prime_scores(model_key, dpacks, compute):
+    """Score a set of datapacks with a single call to the model, and
+    cache the scores for each of them, so that `cached_scores` finds
+    them later on (one big prediction costs much less than hundreds
+    of small ones)
+
+    Datapacks that already have scores are left alone.
+
+    Parameters
+    ----------
+    model_key : string or None
+        Key identifying the fitted model (None to do nothing)
+
+    dpacks : [DataPack]
+        Datapacks to score
+
+    compute : DataPack -> array
+        How to score a datapack; this will be called on all the
+        datapacks stacked together, and should return one row of
+        scores per pair
+
+    Returns
+    -------
+    primed : int
+        Number of datapacks that were scored
+    """
+    if model_key is None:
+        return 0
+    todo = OrderedDict()
+    for dpack in dpacks:
+        key = '{}-{}'.format(model_key, datapack_key(dpack))
+        if key not in todo and dpack.data.shape[0] and\
+                _lookup(key) is None:
+            todo[key] = dpack
+    if len(todo) < 2:
+        return 0
+    stacked = _stacked(list(todo.values()))
+    start = time.time()
+    scores = compute(stacked)
+    seconds = time.time() - start
+    rows = [d.data.shape[0] for d in todo.values()]
+    if not isinstance(scores, np.ndarray) or\
+            scores.shape[0] != sum(rows):
+        # not something we know how to split; leave it to
+        # `cached_scores`
+        return 0
+    parts = np.split(scores, np.cumsum(rows)[:-1])
+    # if we have a cache directory, whoever needs these scores (most
+    # likely a worker process) can load them from there; no need to
+    # hold on to a whole fold of scores per model here
+    memory = _CONFIG['dir'] is None
+    for (key, _), part, nrows in zip(todo.items(), parts, rows):
+        _store(key, part, seconds * nrows / sum(rows), memory=memory)
+    _record_batch(len(todo), seconds)
+    return len(todo)
+
+
+def report(cache_dir=None):
+    """
+    Summarise the time spent on scoring and how much of it was saved
+    by sharing and by batching (from the stats file in the cache
+    directory, or for this process only if there is none)
+
+    Returns
+    -------
+    summary : dict or None
+        None if there are no stats to report on
+    """
+    cache_dir = cache_dir or _CONFIG['dir']
+    if cache_dir is None:
+        entries = list(_STATS)
+    else:
+        stats_path = fp.join(cache_dir, _STATS_FILE)
+        if not fp.exists(stats_path):
+            return None
+        with open(stats_path) as stream:
+            entries = [json.loads(line) for line in stream]
+    if not entries:
+        return None
+    counts = defaultdict(int)
+    seconds = defaultdict(float)
+    for entry in entries:
+        if 'batch' in entry:
+            counts['batches'] += 1
+            counts['batched'] += entry['batch']
+            seconds['batches'] += entry['seconds']
+            continue
+        kind = 'hits' if entry['hit'] else 'misses'
+        counts[kind] += 1
+        seconds[kind] += entry['seconds']
+    return {'hits': counts['hits'],
+            'misses': counts['misses'],
+            'batches': counts['batches'],
+            'batched': counts['batched'],
+            'scoring_batched': seconds['batches'],
+            'scoring_unbatched': seconds['misses'],
+            'scoring_without_sharing': seconds['hits'] + seconds['misses'],
+            'scoring_with_sharing': seconds['misses'] + seconds['batches']}
+
+
+def print_report(cache_dir=None):
+    "print a human readable version of `report`"
+    summary = report(cache_dir)
+    if summary is None:
+        return
+    print(("Scoring: {misses} computed, {hits} shared\n"
+           "Time spent scoring: {scoring_with_sharing:.2f}s "
+           "(would have been {scoring_without_sharing:.2f}s "
+           "without sharing)").format(**summary))
+    if summary['batches']:
+        per_doc = summary['scoring_unbatched'] / summary['misses']\
+            if summary['misses'] else 0.
+        print(("Batched scoring: {batched} datapacks in {batches} "
+               "batches, {scoring_batched:.2f}s ({per_batched:.4f}s per "
+               "datapack vs {per_doc:.4f}s for those scored one at a "
+               "time)").format(per_batched=summary['scoring_batched'] /
+                               summary['batched'],
+                               per_doc=per_doc,
+                               **summary))
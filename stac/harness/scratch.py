@@ -0,0 +1,187 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Scratch space for the parse server
+
+Every request to the server goes through the whole pipeline, which
+writes CSV, glozz, CoNLL, feature and parse files. A `ScratchArena`
+keeps these in one place, preferably in memory (`/dev/shm`), and
+reuses the same working directory for every fresh input rather than
+making a new temporary directory each time.
+
+Old working directories are not deleted on the spot (which could
+take a while); they are moved aside, and deleted a bounded number of
+files at a time after each response has been sent.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import atexit
+import os
+import shutil
+import tempfile
+import time
+
+SHM_DIR = '/dev/shm'
+"where to put scratch space if we can (in memory file system)"
+
+
+def _default_base():
+    "in memory file system if we can write there, else the usual tmp"
+    if fp.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK):
+        return SHM_DIR
+    return tempfile.gettempdir()
+
+
+def _tree_files(path):
+    "paths of all the files in a directory tree"
+    for dirpath, _, filenames in os.walk(path):
+        for fname in filenames:
+            yield fp.join(dirpath, fname)
+
+
+def _size(path):
+    "size of a file (0 if it has gone)"
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class ScratchArena(object):
+    """
+    Scratch directories for the parse server
+
+    Parameters
+    ----------
+    root : string, optional
+        Directory to work in (kept afterwards). By default, a new
+        directory in /dev/shm (or the system tmp dir, if we can't
+        use that), which is removed when we exit
+
+    cleanup_files : int
+        Number of files to delete from old working directories
+        after each request
+
+    cleanup_seconds : float
+        Time to spend on deleting them (at most)
+
+    max_pending_bytes : int
+        If old working directories take up more than this, delete
+        all of them at once
+    """
+
+    def __init__(self, root=None, cleanup_files=500, cleanup_seconds=0.05,
+                 max_pending_bytes=256 * 1024 * 1024):
+        if root is None:
+            self.root = tempfile.mkdtemp(prefix='stac-serve-',
+                                         dir=_default_base())
+            atexit.register(shutil.rmtree, self.root, True)
+        else:
+            self.root = fp.abspath(root)
+            if not fp.exists(self.root):
+                os.makedirs(self.root)
+        self.in_memory = self.root.startswith(SHM_DIR + os.sep)
+        self._trash = fp.join(self.root, 'trash')
+        self._cleanup_files = cleanup_files
+        self._cleanup_seconds = cleanup_seconds
+        self._max_pending_bytes = max_pending_bytes
+        self._pending_bytes = 0
+        self._generation = 0
+        self.last_cleanup = {'files': 0, 'bytes': 0, 'seconds': 0.,
+                             'pending_bytes': 0}
+
+    def workdir(self):
+        "working directory for this process"
+        return fp.join(self.root, 'worker-{}'.format(os.getpid()))
+
+    def fresh(self):
+        """
+        Empty working directory for a new input (the previous
+        contents are moved aside, see `collect`)
+        """
+        path = self.workdir()
+        if fp.exists(path):
+            if not fp.exists(self._trash):
+                os.makedirs(self._trash)
+            self._generation += 1
+            old = fp.join(self._trash, '{}-{}'.format(fp.basename(path),
+                                                      self._generation))
+            self._pending_bytes += sum(_size(f) for f in _tree_files(path))
+            os.rename(path, old)
+        os.makedirs(path)
+        return path
+
+    def collect(self):
+        """
+        Delete some of the old working directories (within the
+        limits given to the constructor, unless they take up too
+        much space)
+
+        Returns
+        -------
+        stats : dict
+            Files and bytes deleted, time taken, and bytes still
+            waiting to be deleted
+        """
+        start = time.time()
+        everything = self._pending_bytes > self._max_pending_bytes
+        files = 0
+        freed = 0
+
+        def done():
+            "True if we have used up our budget"
+            return not everything and\
+                (files >= self._cleanup_files or
+                 time.time() - start > self._cleanup_seconds)
+
+        # children first, so that emptied directories can go too
+        walk = os.walk(self._trash, topdown=False)\
+            if fp.exists(self._trash) else []
+        for dirpath, dirnames, filenames in walk:
+            for fname in filenames:
+                if done():
+                    break
+                fpath = fp.join(dirpath, fname)
+                freed += _size(fpath)
+                os.remove(fpath)
+                files += 1
+            for dname in dirnames:
+                try:
+                    os.rmdir(fp.join(dirpath, dname))
+                except OSError:
+                    # not empty yet
+                    pass
+            if done():
+                break
+        self._pending_bytes = max(0, self._pending_bytes - freed)
+        self.last_cleanup = {'files': files,
+                             'bytes': freed,
+                             'seconds': time.time() - start,
+                             'pending_bytes': self._pending_bytes}
+        return self.last_cleanup
+
+    def usage(self, since=None):
+        """
+        Files in the working directory
+
+        Returns
+        -------
+        stats : dict
+            Number and total size of the files, and size of those
+            that were modified after `since` (a timestamp), if given
+        """
+        files = 0
+        total = 0
+        written = 0
+        for fpath in _tree_files(self.workdir()):
+            try:
+                info = os.stat(fpath)
+            except OSError:
+                continue
+            files += 1
+            total += info.st_size
+            if since is not None and info.st_mtime >= since:
+                written += info.st_size
+        return {'files': files, 'bytes': total, 'written': written}
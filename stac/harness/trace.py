@@ -0,0 +1,148 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Structured timing and resource traces
+
+Wrap a piece of work in `traced(name, ...)` and, if the
+`STAC_TRACE_FILE` environment variable is set, a JSON line gets
+appended to that file when the work is done, with
+
+* `wall`, `cpu`: elapsed and CPU (user + system) seconds
+* `child_cpu`: CPU seconds used by subprocesses that finished in
+  the meantime (most of our pipeline stages call out to other
+  programs)
+* `peak_rss_kb`: peak resident memory of the process so far
+* `read_bytes`, `write_bytes`: storage I/O (Linux only)
+
+along with any extra metadata passed to `traced`.
+
+If `STAC_PROFILE_STAGE` is set to a (shell-style) pattern, any
+traced work whose name matches it is also run under cProfile, with
+the stats saved next to the trace file.
+
+Traces are written by every process that has the environment
+variable (so workers and local scheduler jobs write to the same
+file); see `irit-stac profile` for summarising them.
+"""
+
+from __future__ import print_function
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from os import path as fp
+import cProfile
+import json
+import os
+import re
+import resource
+import time
+
+TRACE_ENV = 'STAC_TRACE_FILE'
+"environment variable: where to write traces"
+
+PROFILE_ENV = 'STAC_PROFILE_STAGE'
+"environment variable: pattern for names of work to profile"
+
+
+def _io_counters():
+    "bytes read and written to storage by this process (if known)"
+    res = {}
+    try:
+        with open('/proc/self/io') as stream:
+            for line in stream:
+                key, _, value = line.partition(':')
+                if key in ('read_bytes', 'write_bytes'):
+                    res[key] = int(value)
+    except IOError:
+        pass
+    return res
+
+
+def _snapshot():
+    "resource counters at this point in time"
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    kids = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'time': time.time(),
+            'cpu': own.ru_utime + own.ru_stime,
+            'child_cpu': kids.ru_utime + kids.ru_stime,
+            'peak_rss_kb': own.ru_maxrss,
+            'io': _io_counters()}
+
+
+def _profile_path(name):
+    "where to save the cProfile stats for some traced work"
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+    prefix = os.environ.get(TRACE_ENV) or 'profile'
+    return '{}.{}.{}.prof'.format(prefix, safe_name, os.getpid())
+
+
+def write_record(record, path=None):
+    "append a trace record to the trace file"
+    path = path or os.environ.get(TRACE_ENV)
+    if path is None:
+        return
+    line = json.dumps(record, sort_keys=True) + '\n'
+    # one write per record so that concurrent processes don't
+    # interleave their lines
+    with open(path, 'a') as stream:
+        stream.write(line)
+
+
+@contextmanager
+def traced(name, **meta):
+    """
+    Context manager recording resource use for the work done
+    inside it (does nothing unless tracing or profiling is on)
+
+    Parameters
+    ----------
+    name : string
+        What is being done, eg. 'stage:0700-decoding'. Records with
+        the same name are summarised together
+
+    meta : dict
+        Anything else to record (should be JSON serialisable)
+    """
+    trace_path = os.environ.get(TRACE_ENV)
+    pattern = os.environ.get(PROFILE_ENV)
+    profiling = pattern is not None and fnmatch(name, pattern)
+    if trace_path is None and not profiling:
+        yield
+        return
+
+    before = _snapshot()
+    profiler = cProfile.Profile() if profiling else None
+    status = 'ok'
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        after = _snapshot()
+        record = {'name': name,
+                  'pid': os.getpid(),
+                  'start': before['time'],
+                  'status': status,
+                  'wall': after['time'] - before['time'],
+                  'cpu': after['cpu'] - before['cpu'],
+                  'child_cpu': after['child_cpu'] - before['child_cpu'],
+                  'peak_rss_kb': after['peak_rss_kb']}
+        for key, value in after['io'].items():
+            record[key] = value - before['io'].get(key, 0)
+        if meta:
+            record['meta'] = meta
+        if profiler is not None:
+            record['profile'] = fp.abspath(_profile_path(name))
+            profiler.dump_stats(record['profile'])
+        write_record(record, trace_path)
+
+
+def read_records(path):
+    "all the records in a trace file"
+    with open(path) as stream:
+        return [json.loads(line) for line in stream if line.strip()]
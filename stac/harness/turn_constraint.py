@@ -8,11 +8,19 @@ We rely on there being a feature 'same_speaker', one-hot-encoded as
 """
 # pylint: disable=too-few-public-methods
 
+import uuid
+
 import numpy as np
+from scipy.sparse import (csr_matrix)
 
+from attelo.decoding import (Decoder)
+from attelo.edu import (FAKE_ROOT_ID)
 from attelo.harness.config import (Keyed)
 from attelo.parser import (Parser)
 from attelo.parser.pipeline import (Pipeline)
+from attelo.table import (UNKNOWN, UNRELATED)
+
+from .scores import (cached_scores, prime_scores)
 
 SAME_SPEAKER = 'same_speaker=True'
 'boolean feature for if two EDUs share a speaker'
@@ -28,13 +36,71 @@ def turn_constraint_safe(dpack):
 
     Returns
     -------
-    res : list of int
-        Indices of selected edges.
+    res : array of int
+        Indices of selected edges (in increasing order).
     """
     spkr_idx = dpack.vocab.index(SAME_SPEAKER)
-    return [i for i, (edu1, edu2) in enumerate(dpack.pairings)
-            if edu2.span() > edu1.span() or
-            dpack.data[i, spkr_idx]]
+    npairs = len(dpack.pairings)
+    spans = np.fromiter((x for edu1, edu2 in dpack.pairings
+                         for x in edu1.span() + edu2.span()),
+                        dtype=float, count=4 * npairs).reshape(npairs, 4)
+    # edu2.span() > edu1.span(), comparing (start, end) tuples
+    forwards = (spans[:, 2] > spans[:, 0]) |\
+        ((spans[:, 2] == spans[:, 0]) & (spans[:, 3] > spans[:, 1]))
+    same_speaker = dpack.data[:, spkr_idx].toarray().ravel() != 0
+    return np.where(forwards | same_speaker)[0]
+
+
+def _stack_rows(matrices, idxes):
+    """Selected rows of several CSR matrices, as a single CSR matrix.
+
+    This copies the selected rows straight into the result, rather
+    than making a selected copy of each matrix and stacking those.
+    """
+    lengths = [m.indptr[sel + 1] - m.indptr[sel]
+               for m, sel in zip(matrices, idxes)]
+    indptr = np.zeros(sum(len(x) for x in lengths) + 1,
+                      dtype=matrices[0].indptr.dtype)
+    np.cumsum(np.concatenate(lengths), out=indptr[1:])
+    data = np.empty(indptr[-1], dtype=matrices[0].dtype)
+    indices = np.empty(indptr[-1], dtype=matrices[0].indices.dtype)
+    out = 0
+    for mat, sel, lens in zip(matrices, idxes, lengths):
+        nnz = lens.sum()
+        # position of each selected nonzero in the original matrix
+        row_starts = np.cumsum(lens) - lens
+        src = np.arange(nnz) - np.repeat(row_starts - mat.indptr[sel], lens)
+        data[out:out + nnz] = mat.data[src]
+        indices[out:out + nnz] = mat.indices[src]
+        out += nnz
+    return csr_matrix((data, indices, indptr),
+                      shape=(len(indptr) - 1, matrices[0].shape[1]))
+
+
+def _selected_nonfixed(idxes, nonfixed_pairs):
+    """Positions (within the selected edges) of the nonfixed pairs of
+    each datapack, dropping the pairs that were not selected.
+
+    Parameters
+    ----------
+    idxes : list of array of int
+        Selected edges of each datapack (in increasing order)
+
+    nonfixed_pairs : list of array of int
+        Nonfixed pairs of each datapack
+
+    Returns
+    -------
+    res : list of array of int
+    """
+    res = []
+    for sel, nfp in zip(idxes, nonfixed_pairs):
+        nfp = np.asarray(nfp, dtype=int)
+        pos = np.searchsorted(sel, nfp)
+        found = pos < len(sel)
+        found[found] = sel[pos[found]] == nfp[found]
+        res.append(np.unique(pos[found]))
+    return res
 
 
 def apply_turn_constraint(dpack, target):
@@ -64,11 +130,17 @@ def apply_turn_constraint(dpack, target):
 class TC_LearnerWrapper(object):
     """Placeholder to indicate we want to apply the turn constraint as a
     filter on the data before learning.
+
+    If `stack` is True (for learners that treat each pair on its own,
+    not for structured learners), the selected pairs of all the
+    datapacks are stacked into a single datapack before learning.
     """
 
-    def __init__(self, learner):
+    def __init__(self, learner, stack=True):
         self._learner = learner
+        self._stack = stack
         self.can_predict_proba = self._learner.can_predict_proba
+        self._score_key = None
 
     @staticmethod
     def dzip(fun, dpacks, targets):
@@ -99,20 +171,47 @@ class TC_LearnerWrapper(object):
         else:
             return None
 
+    @staticmethod
+    def _stacked(dpacks, targets, idxes, nonfixed_pairs):
+        """Selected edges of all the datapacks, as a single datapack
+        (and the corresponding target and nonfixed pairs)
+        """
+        dpack = dpacks[0]._replace(
+            edus=[e for d in dpacks for e in d.edus],
+            pairings=[d.pairings[i] for d, sel in zip(dpacks, idxes)
+                      for i in sel],
+            data=_stack_rows([d.data for d in dpacks], idxes),
+            target=np.concatenate([np.asarray(d.target)[sel]
+                                   for d, sel in zip(dpacks, idxes)]))
+        target = np.concatenate([np.asarray(t)[sel]
+                                 for t, sel in zip(targets, idxes)])
+        if nonfixed_pairs is not None:
+            offsets = np.cumsum([0] + [len(sel) for sel in idxes[:-1]])
+            nonfixed_pairs = [np.concatenate(
+                [nfp + off for nfp, off in zip(nonfixed_pairs, offsets)])]
+        return [dpack], [target], nonfixed_pairs
+
     def fit(self, dpacks, targets, nonfixed_pairs=None):
         """apply the turn constraint before learning"""
         tc_safe_pairs = [turn_constraint_safe(dpack) for dpack in dpacks]
-        # restrict dpacks and targets to keep only tc safe edges
-        dpacks = [dpack.selected(idxes) for dpack, idxes
-                  in zip(dpacks, tc_safe_pairs)]
-        targets = [target[idxes] for target, idxes
-                   in zip(targets, tc_safe_pairs)]
         # get indices of nonfixed_pairs in tc_safe_pairs
         if nonfixed_pairs is not None:
-            nonfixed_ix = [np.in1d(idxes, nf_pairs) for idxes, nf_pairs
-                           in zip(tc_safe_pairs, nonfixed_pairs)]
-            nonfixed_pairs = [np.where(nf_ix)[0] for nf_ix in nonfixed_ix]
+            nonfixed_pairs = _selected_nonfixed(tc_safe_pairs,
+                                                nonfixed_pairs)
+        # restrict dpacks and targets to keep only tc safe edges
+        if self._stack and dpacks:
+            dpacks, targets, nonfixed_pairs =\
+                self._stacked(dpacks, targets, tc_safe_pairs,
+                              nonfixed_pairs)
+        else:
+            dpacks = [dpack.selected(idxes) for dpack, idxes
+                      in zip(dpacks, tc_safe_pairs)]
+            targets = [target[idxes] for target, idxes
+                       in zip(targets, tc_safe_pairs)]
         self._learner.fit(dpacks, targets, nonfixed_pairs=nonfixed_pairs)
+        # saved with the model, so that all parsers loading it can
+        # share scores
+        self._score_key = uuid.uuid4().hex
         return self
 
     def transform(self, dpack, nonfixed_pairs=None):
@@ -121,9 +220,158 @@ class TC_LearnerWrapper(object):
         return self._learner.transform(dpack, nonfixed_pairs=nonfixed_pairs)
 
     def predict_score(self, dpack, nonfixed_pairs=None):
-        """pass through to inner learner"""
+        """pass through to inner learner (sharing the scores with any
+        other parser that uses this model on the same datapack)"""
         # no turn constraint here; we just wanted them for learning with
-        return self._learner.predict_score(dpack, nonfixed_pairs=nonfixed_pairs)
+        return cached_scores(getattr(self, '_score_key', None),
+                             dpack,
+                             lambda: self._learner.predict_score(
+                                 dpack, nonfixed_pairs=nonfixed_pairs),
+                             nonfixed_pairs=nonfixed_pairs)
+
+    def prime_scores(self, dpacks):
+        """Score a batch of datapacks in one go, for `predict_score`
+        to find later (see `stac.harness.batch_scoring`)
+
+        Only for learners that treat each pair on its own (`stack`)
+
+        Returns
+        -------
+        primed : int
+            Number of datapacks scored
+        """
+        if not self._stack:
+            return 0
+        return prime_scores(getattr(self, '_score_key', None),
+                            dpacks,
+                            self._learner.predict_score)
+
+
+class TC_MstDecoder(Decoder):
+    """MST decoder over the edges that respect the turn constraint.
+
+    This gives the same trees as `tc_decoder(MstDecoder(fake_root,
+    True))` (up to ties between equally scored trees), but works
+    straight from the score arrays of the datapack: no selected copy
+    of the datapack, and the maximum spanning tree is found over the
+    selected edges only.
+
+    The output datapack is the input one (all the edges), with the
+    edges that the turn constraint rules out predicted as unrelated.
+    """
+
+    def decode(self, dpack, nonfixed_pairs=None):
+        idxes = turn_constraint_safe(dpack)
+        node = {e.id: i for i, e in enumerate(dpack.edus)}
+        src = np.fromiter((node[dpack.pairings[i][0].id] for i in idxes),
+                          dtype=int, count=len(idxes))
+        tgt = np.fromiter((node[dpack.pairings[i][1].id] for i in idxes),
+                          dtype=int, count=len(idxes))
+        with np.errstate(divide='ignore'):
+            weights = np.log(np.asarray(dpack.graph.attach)[idxes])
+        # MST needs finite weights; zero probabilities stay at the
+        # bottom of the ranking
+        weights[np.isneginf(weights)] = np.log(np.finfo(float).tiny)
+        chosen = _chu_liu_edmonds(len(dpack.edus),
+                                  node.get(FAKE_ROOT_ID, 0),
+                                  src, tgt, weights)
+        chosen = idxes[chosen]
+        prediction = np.full(len(dpack), dpack.label_number(UNRELATED),
+                             dtype=int)
+        if dpack.graph.label is None:
+            prediction[chosen] = dpack.label_number(UNKNOWN)
+        else:
+            # best label, other than unrelated/unknown (these are
+            # attached edges)
+            labels = np.array(dpack.graph.label, dtype=float)[chosen]
+            for label in (UNRELATED, UNKNOWN):
+                if label in dpack.labels:
+                    labels[:, dpack.label_number(label)] = -np.inf
+            prediction[chosen] = np.argmax(labels, axis=1)
+        graph = dpack.graph.tweak(prediction=prediction)
+        return dpack.set_graph(graph)
+
+
+def _find_cycle(heads):
+    """A cycle in a (partial) head assignment, as a list of nodes
+    (None if there are none)"""
+    done = set()
+    for start in heads:
+        path = []
+        on_path = {}
+        node = start
+        while node in heads and node not in done:
+            if node in on_path:
+                return path[on_path[node]:]
+            on_path[node] = len(path)
+            path.append(node)
+            node = heads[node]
+        done.update(path)
+    return None
+
+
+def _chu_liu_edmonds(nnodes, root, src, tgt, weights):
+    """Maximum spanning arborescence (Chu-Liu/Edmonds) of a graph
+    given as edge arrays.
+
+    Returns
+    -------
+    chosen : array of int
+        Indices of the edges in the tree (nodes with no incoming
+        edges are left out)
+    """
+    edges = [(u, v, w) for u, v, w in zip(src.tolist(), tgt.tolist(),
+                                          weights.tolist())
+             if v != root and u != v]
+    back = [i for i, (u, v) in enumerate(zip(src.tolist(), tgt.tolist()))
+            if v != root and u != v]
+    best = _cle(edges, nnodes)
+    return np.array(sorted(back[i] for i in best.values()), dtype=int)
+
+
+def _cle(edges, next_node):
+    """Chu-Liu/Edmonds on a list of (src, tgt, weight) edges with no
+    edges into the root.
+
+    Returns
+    -------
+    best : dict(int, int)
+        For each node with a head, the index of its incoming edge
+    """
+    best = {}
+    for i, (_, tgt, weight) in enumerate(edges):
+        if tgt not in best or weight > edges[best[tgt]][2]:
+            best[tgt] = i
+    cycle = _find_cycle({v: edges[i][0] for v, i in best.items()})
+    if cycle is None:
+        return best
+
+    # contract the cycle into a new node, and solve that graph
+    in_cycle = frozenset(cycle)
+    contracted = []
+    back = []
+    for i, (src, tgt, weight) in enumerate(edges):
+        if src in in_cycle and tgt in in_cycle:
+            continue
+        elif tgt in in_cycle:
+            contracted.append((src, next_node,
+                               weight - edges[best[tgt]][2]))
+        elif src in in_cycle:
+            contracted.append((next_node, tgt, weight))
+        else:
+            contracted.append((src, tgt, weight))
+        back.append(i)
+    sub_best = _cle(contracted, next_node + 1)
+
+    # expand it again: the cycle, broken where the tree enters it
+    # (or at its weakest edge if nothing enters it)
+    res = {v: best[v] for v in cycle}
+    if next_node not in sub_best:
+        del res[min(cycle, key=lambda v: edges[best[v]][2])]
+    for j in sub_best.values():
+        i = back[j]
+        res[edges[i][1]] = i
+    return res
 
 
 class TC_Pruner(Parser):
@@ -146,7 +394,8 @@ def tc_decoder(kdecoder):
                  payload=Pipeline(steps=steps))
 
 
-def tc_learner(klearner):
-    "turn constrained version of a learner"
+def tc_learner(klearner, stack=True):
+    """turn constrained version of a learner (`stack` should be False
+    for structured learners, see `TC_LearnerWrapper`)"""
     return Keyed(key='tc-' + klearner.key,
-                 payload=TC_LearnerWrapper(klearner.payload))
+                 payload=TC_LearnerWrapper(klearner.payload, stack=stack))
@@ -6,12 +6,13 @@
 Miscellaneous utility functions
 """
 
+from contextlib import contextmanager
+from os import path as fp
 import itertools
 import os
+import re
 import sys
 
-from attelo.harness.util import timestamp
-
 from .local import (HARNESS_NAME,
                     LOCAL_TMP)
 
@@ -20,6 +21,7 @@ def current_tmp():
     """
     Directory for the current run
     """
+    from attelo.harness.util import timestamp
     return os.path.join(LOCAL_TMP, timestamp())
 
 
@@ -30,6 +32,47 @@ def latest_tmp():
     return os.path.join(LOCAL_TMP, "latest")
 
 
+def load_script(path, name=None):
+    """
+    Import a standalone script (eg. `intake/soclogtocsv.py`, which
+    is not part of any package) as a module, so that we can call
+    its functions directly
+    """
+    if name is None:
+        stem = fp.splitext(fp.basename(path))[0]
+        name = '_script_' + re.sub(r'\W', '_', stem)
+    try:
+        from importlib.machinery import SourceFileLoader
+    except ImportError:
+        # python 2
+        import imp
+        return imp.load_source(name, path)
+    return SourceFileLoader(name, path).load_module()
+
+
+@contextmanager
+def swapped(module, name, value):
+    """
+    Replace an attribute of a module (eg. a function in attelo that
+    we have no other way to hook into) for the duration of a `with`
+    block, putting the original back afterwards
+
+    Raises AttributeError if the module has no such attribute (eg.
+    if attelo has changed), rather than quietly adding one that
+    nobody would look at
+    """
+    if not hasattr(module, name):
+        raise AttributeError('{} has no attribute {} for us to replace '
+                             '(has it changed?)'.format(module.__name__,
+                                                        name))
+    original = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield original
+    finally:
+        setattr(module, name, original)
+
+
 def concat_i(itr):
     """
     Walk an iterable of iterables as a single one
@@ -15,10 +15,18 @@ Places where this differs from the DTD (2014-11-26):
       resources node
     * we have an unknown_status category of resources
     * we have a parent game fragment node for multiple events
+    * when only the changes since an earlier fragment are written
+      (see `write_fragment`), the game fragment has a `delta`
+      attribute, and events that have gone are listed as
+      `removed_event` nodes
 
 """
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from xml.sax.saxutils import escape
+import hashlib
+import sys
+
 from enum import Enum
 
 from educe.stac.annotation import RENAMES
@@ -34,6 +42,116 @@ def text_elem(name, text):
     return tmp
 
 
+# ---------------------------------------------------------------------
+# writing
+# ---------------------------------------------------------------------
+
+
+def _escape(text):
+    "escape text or attribute values (as minidom does)"
+    return escape(text, {'"': '&quot;'})
+
+
+def _open_tag(node):
+    "start of an opening tag (without the closing bracket)"
+    items = node.attrib.items()
+    if sys.version_info < (3, 8):
+        # minidom only keeps attributes in document order from 3.8
+        items = sorted(items)
+    attrs = u''.join(u' {}="{}"'.format(k, _escape(v)) for k, v in items)
+    return u'<' + node.tag + attrs
+
+
+def iter_xml(node, indent=u' ', depth=0):
+    """
+    Lines of pretty printed XML for an element (text only elements
+    on a single line, empty elements closed in place), as
+    `educe.stac.util.prettifyxml.prettify` would print them.
+
+    This walks the element with an explicit stack, so it does not
+    mind deeply nested elements
+    """
+    stack = [(node, depth, False)]
+    while stack:
+        elem, level, closing = stack.pop()
+        pad = indent * level
+        if closing:
+            yield u'{}</{}>\n'.format(pad, elem.tag)
+            continue
+        children = list(elem)
+        text = _escape(elem.text) if elem.text else None
+        if not children:
+            if text:
+                yield u'{}{}>{}</{}>\n'.format(pad, _open_tag(elem),
+                                               text, elem.tag)
+            else:
+                yield u'{}{}/>\n'.format(pad, _open_tag(elem))
+            continue
+        yield u'{}{}>\n'.format(pad, _open_tag(elem))
+        if text:
+            yield u'{}{}{}\n'.format(pad, indent, text)
+        stack.append((elem, level, True))
+        stack.extend((c, level + 1, False) for c in reversed(children))
+
+
+def write_fragment(events, stream, previous=None, indent=u' '):
+    """
+    Write a game fragment to a (binary) stream, one event at a time.
+
+    Parameters
+    ----------
+    events : iterable of ChatMessage
+        Events of the fragment (anything with an identifier and a
+        `to_xml` method)
+
+    previous : dict(string, string), optional
+        Digests of the events of an earlier fragment (as returned by
+        this function). If given, only the events that are new or
+        have changed since are written
+
+    Returns
+    -------
+    digests : OrderedDict(string, string)
+        Digest of each event in the fragment (by identifier)
+
+    stats : dict
+        Number of events, of events written, of events removed (in
+        delta mode), and of bytes written
+    """
+    stream = getattr(stream, 'buffer', stream)
+    stats = {'events': 0, 'written': 0, 'removed': 0, 'bytes': 0}
+
+    def put(text):
+        "write some text"
+        data = text.encode('utf-8')
+        stream.write(data)
+        stats['bytes'] += len(data)
+
+    put(u'<?xml version="1.0" ?>\n')
+    put(u'<game_fragment delta="true">\n' if previous is not None
+        else u'<game_fragment>\n')
+    digests = OrderedDict()
+    for event in events:
+        text = u''.join(iter_xml(event.to_xml(), indent, 1))
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        digests[event.identifier] = digest
+        stats['events'] += 1
+        if previous is not None and previous.get(event.identifier) == digest:
+            continue
+        put(text)
+        stats['written'] += 1
+    if previous is not None:
+        for identifier in previous:
+            if identifier in digests:
+                continue
+            node = ET.Element("removed_event")
+            node.append(text_elem("event_id", identifier))
+            put(u''.join(iter_xml(node, indent, 1)))
+            stats['removed'] += 1
+    put(u'</game_fragment>\n')
+    return digests, stats
+
+
 class GameFragment(namedtuple('GameFragment',
                               ['events'])):
     """
@@ -46,6 +164,13 @@ class GameFragment(namedtuple('GameFragment',
             node.append(event.to_xml())
         return node
 
+    def write(self, stream, previous=None):
+        """
+        write as settlers XML, one event at a time
+        (see `write_fragment`)
+        """
+        return write_fragment(self.events, stream, previous=previous)
+
 
 class ChatMessage(namedtuple('ChatMessage',
                              ['identifier',
@@ -189,13 +314,14 @@ class Resource(namedtuple('Resource',
         """
         if not resources:
             raise ValueError('must have non-empty list of resources')
-        elif len(resources) == 1:
-            return resources[0].to_xml()
-        else:
-            node = ET.Element('and_res')
-            node.append(resources[0].to_xml())
-            node.append(cls.and_resources(resources[1:]))
-            return node
+        # built from the innermost (last) conjunct outwards
+        node = resources[-1].to_xml()
+        for resource in reversed(resources[:-1]):
+            outer = ET.Element('and_res')
+            outer.append(resource.to_xml())
+            outer.append(node)
+            node = outer
+        return node
 
 
 class SurfaceAct(Enum):
@@ -0,0 +1,174 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Anytime constrained decoding
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import unittest
+
+import numpy as np
+import pytest
+
+pytest.importorskip('attelo')
+pytest.importorskip('educe')
+
+# pylint: disable=wrong-import-position
+from attelo.edu import (FAKE_ROOT_ID)
+from attelo.table import (UNKNOWN, UNRELATED)
+from stac.harness.anytime import (AnytimeDecoder, _Problem)
+# pylint: enable=wrong-import-position
+
+# pylint: disable=protected-access
+
+
+class Edu(namedtuple('Edu', 'id grouping subgrouping start end')):
+    "stand-in for an attelo EDU"
+
+    def span(self):
+        "(start, end)"
+        return (self.start, self.end)
+
+
+class Graph(namedtuple('Graph', 'prediction attach label')):
+    "stand-in for an attelo graph"
+
+    def tweak(self, **kwargs):
+        "copy with some fields replaced"
+        return self._replace(**kwargs)
+
+
+class DataPack(object):
+    "stand-in for an attelo datapack"
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __len__(self):
+        return len(self.pairings)
+
+    def label_number(self, label):
+        "index of a label"
+        return self.labels.index(label)
+
+    def set_graph(self, graph):
+        "copy with a new graph"
+        return DataPack(**dict(self.__dict__, graph=graph))
+
+
+LABELS = [UNKNOWN, 'Elaboration', 'Continuation', UNRELATED]
+
+
+def mk_dpack(turns, attach=None, label=None, seed=0):
+    """
+    Datapack for a dialogue with the given number of EDUs in each
+    turn, with all pairs of EDUs (and random attachment scores
+    unless given)
+    """
+    edus = [Edu(FAKE_ROOT_ID, 'd', 'root', 0, 0)]
+    for turn, size in enumerate(turns):
+        for _ in range(size):
+            start = len(edus) * 10
+            edus.append(Edu('e{}'.format(len(edus)), 'd',
+                            't{}'.format(turn), start, start + 5))
+    pairings = [(e1, e2) for e1 in edus for e2 in edus[1:] if e1 != e2]
+    if attach is None:
+        attach = np.random.RandomState(seed).uniform(0.01, 1,
+                                                     len(pairings))
+    return DataPack(edus=edus,
+                    pairings=pairings,
+                    labels=LABELS,
+                    graph=Graph(prediction=None,
+                                attach=np.asarray(attach),
+                                label=label))
+
+
+def _index(dpack, id1, id2):
+    "index of a pair"
+    return [(e1.id, e2.id) for e1, e2 in dpack.pairings].index((id1, id2))
+
+
+def _links(dpack):
+    "predicted (edu1, edu2, label) triples"
+    return sorted((e1.id, e2.id, dpack.labels[l]) for (e1, e2), l
+                  in zip(dpack.pairings, dpack.graph.prediction)
+                  if dpack.labels[l] != UNRELATED)
+
+
+class AnytimeTest(unittest.TestCase):
+    "beam search decoding"
+
+    def test_constraints(self):
+        "intra turn links, right frontier, a single link from the root"
+        dpack = mk_dpack([2, 2], attach=np.full(16, 0.1))
+        # e3 would rather attach to e4 (backwards in its own turn: not
+        # with last_intra) or to the root (already used by e1)
+        for id1, id2, score in [('e3', 'e4', 0.1), ('e4', 'e3', 0.9),
+                                ('ROOT', 'e3', 0.95), ('e1', 'e3', 0.5),
+                                ('e2', 'e3', 0.2)]:
+            dpack.graph.attach[_index(dpack, id1, id2)] = score
+        res = AnytimeDecoder(node_budget=None).decode(dpack)
+        self.assertEqual(_links(res),
+                         [('ROOT', 'e1', UNKNOWN),
+                          ('e1', 'e2', UNKNOWN),
+                          ('e1', 'e3', UNKNOWN),
+                          ('e3', 'e4', UNKNOWN)])
+
+    def test_labels(self):
+        "links get an allowed label, never unrelated"
+        dpack = mk_dpack([3, 2])
+        label = np.zeros((len(dpack), len(LABELS)))
+        label[:, LABELS.index(UNRELATED)] = 0.9
+        label[:, LABELS.index('Elaboration')] = 0.2
+        label[::2, LABELS.index('Continuation')] = 0.3
+        dpack.graph = dpack.graph.tweak(label=label)
+        res = AnytimeDecoder(node_budget=None).decode(dpack)
+        links = _links(res)
+        self.assertEqual(len(links), 5)
+        for id1, id2, lbl in links:
+            if _index(dpack, id1, id2) % 2:
+                self.assertEqual(lbl, 'Elaboration')
+            else:
+                self.assertIn(lbl, ['Elaboration', 'Continuation'])
+
+    def test_exhaustive(self):
+        "without a budget, small documents are searched exhaustively"
+        dpack = mk_dpack([2, 1, 2])
+        decoder = AnytimeDecoder(node_budget=None)
+        problem = _Problem(dpack, True)
+        best, stats = decoder.search(problem)
+        self.assertTrue(stats.exhaustive)
+        greedy, _ = decoder._search_pass(problem, 1, lambda _: None)
+        self.assertGreaterEqual(best.score, greedy.score)
+
+    def test_reproducible(self):
+        "a node budget gives the same search every time"
+        dpack = mk_dpack([3, 4, 2, 3], seed=1)
+        decoder = AnytimeDecoder(node_budget=2000)
+        runs = [decoder.search(_Problem(dpack, False)) for _ in range(3)]
+        for best, stats in runs[1:]:
+            self.assertEqual(best.heads, runs[0][0].heads)
+            self.assertEqual(stats._replace(seconds=0),
+                             runs[0][1]._replace(seconds=0))
+        self.assertFalse(runs[0][1].exhaustive)
+
+    def test_greedy_budget(self):
+        "the greedy pass stops at the budget, leaving EDUs unattached"
+        dpack = mk_dpack([3, 3])
+        decoder = AnytimeDecoder(node_budget=1)
+        best, stats = decoder.search(_Problem(dpack, True))
+        # one choice for e1 (the root), one for e2 (forced to e1),
+        # and then we are over budget
+        self.assertEqual(stats.passes, 1)
+        self.assertEqual(stats.nodes, 2)
+        self.assertFalse(stats.exhaustive)
+        self.assertEqual(best.heads, [-1, 0, 1, -1, -1, -1, -1])
+
+    def test_no_state(self):
+        "decoding leaves the (shared) decoder alone"
+        decoder = AnytimeDecoder()
+        before = dict(vars(decoder))
+        decoder.decode(mk_dpack([2, 2]))
+        self.assertEqual(vars(decoder), before)
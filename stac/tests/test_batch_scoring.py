@@ -0,0 +1,67 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Hooking batched scoring into attelo's parse jobs
+"""
+
+from __future__ import print_function
+import unittest
+
+import pytest
+
+pytest.importorskip('attelo')
+pytest.importorskip('educe')
+
+# pylint: disable=wrong-import-position
+import attelo.harness.parse as ath_parse
+
+from stac.harness.batch_scoring import (batched_scoring)
+# pylint: enable=wrong-import-position
+
+
+class FakeModel(object):
+    "a model that can batch its scoring"
+
+    def __init__(self):
+        self.primed = []
+
+    def prime_scores(self, dpacks):
+        "note what we were asked to score"
+        self.primed.append(list(dpacks))
+        return len(dpacks)
+
+
+class FakeParser(object):
+    "a parser with a model in it"
+
+    def __init__(self):
+        self.model = FakeModel()
+
+
+class BatchScoringTest(unittest.TestCase):
+    "batched_scoring"
+
+    def test_swap(self):
+        "attelo's job generator is wrapped only within the block"
+        original = ath_parse.jobs
+        with batched_scoring(True):
+            self.assertIsNot(ath_parse.jobs, original)
+        self.assertIs(ath_parse.jobs, original)
+        with batched_scoring(False):
+            self.assertIs(ath_parse.jobs, original)
+
+    def test_primes(self):
+        "the multipack is scored before the jobs are generated"
+        original = ath_parse.jobs
+        parser = FakeParser()
+        mpack = {'d1': 'dpack1', 'd2': 'dpack2'}
+        try:
+            ath_parse.jobs = lambda mpack, parser, output: 'jobs'
+            with batched_scoring(True):
+                res = ath_parse.jobs(mpack, parser, '/dev/null')
+        finally:
+            ath_parse.jobs = original
+        self.assertEqual(res, 'jobs')
+        self.assertEqual([sorted(x) for x in parser.model.primed],
+                         [['dpack1', 'dpack2']])
@@ -0,0 +1,110 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Candidate pair policies
+"""
+
+from __future__ import print_function
+from os import path as fp
+import shutil
+import tempfile
+import unittest
+
+import pytest
+
+pytest.importorskip('attelo')
+
+# pylint: disable=wrong-import-position
+from stac.harness.candidates import (prune_candidates)
+# pylint: enable=wrong-import-position
+
+# id, turn, start, end
+EDUS = [('e1', 't1', 0, 5),
+        ('e2', 't1', 6, 10),
+        ('e3', 't2', 11, 15),
+        ('e4', 't3', 16, 20),
+        ('e5', 't4', 21, 25)]
+
+VOCAB = ['word=hello', 'same_speaker=True']
+
+LABELS = ['Elaboration', 'Question-answer_pair', 'UNRELATED']
+
+# edu1, edu2, svmlight row (target 0 is UNKNOWN, then 1-based labels)
+PAIRS = [('ROOT', 'e1', '1 0:1'),       # gold
+         ('e1', 'e2', '2 0:1'),         # gold, forwards
+         ('e2', 'e1', '3 0:1 1:1'),     # backwards, same speaker
+         ('e3', 'e1', '3 0:1'),         # backwards
+         ('e1', 'e5', '1 0:1'),         # gold, forwards, far apart
+         ('e5', 'e4', '1 1:1'),         # gold, backwards, same speaker
+         ('e4', 'e1', '2 0:1'),         # gold, backwards
+         ('e2', 'e3', '0 0:1')]         # unknown, forwards
+
+
+class PruneTest(unittest.TestCase):
+    "pruning a small multipack"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test-candidates-')
+        self.paths = [fp.join(self.tmp, 'd.' + x) for x in
+                      ['edu-input', 'pairings', 'relations.sparse',
+                       'relations.sparse.vocab']]
+        edu_path, pairings_path, features_path, vocab_path = self.paths
+        with open(edu_path, 'w') as stream:
+            for edu_id, turn, start, end in EDUS:
+                print('\t'.join([edu_id, 'blah', 'd1', turn,
+                                 str(start), str(end)]), file=stream)
+        with open(pairings_path, 'w') as stream:
+            for id1, id2, _ in PAIRS:
+                print('\t'.join([id1, id2, 'd1']), file=stream)
+        with open(features_path, 'w') as stream:
+            print('# labels: ' + ' '.join(LABELS), file=stream)
+            for _, _, row in PAIRS:
+                print(row, file=stream)
+        with open(vocab_path, 'w') as stream:
+            for feat in VOCAB:
+                print(feat, file=stream)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _pairs(self):
+        "pairs left in the pairings file"
+        with open(self.paths[1]) as stream:
+            return [tuple(l.split('\t')[:2]) for l in stream]
+
+    def test_report(self):
+        "rows kept and gold edges kept by each policy"
+        specs = ['tc', 'window:1', 'window:2', 'adjacent-turns',
+                 'tc+window:1']
+        report = prune_candidates(*self.paths, compare=specs)
+        self.assertEqual(sorted(report), sorted(specs))
+        counts = {s: (r['rows'], r['kept'], r['gold'], r['gold_kept'])
+                  for s, r in report.items()}
+        self.assertEqual(counts,
+                         {'tc': (8, 6, 5, 4),
+                          'window:1': (8, 5, 5, 3),
+                          'window:2': (8, 6, 5, 3),
+                          'adjacent-turns': (8, 6, 5, 3),
+                          'tc+window:1': (8, 5, 5, 3)})
+        self.assertAlmostEqual(report['tc']['recall_lost'], 0.2)
+        # nothing applied
+        self.assertEqual(len(self._pairs()), len(PAIRS))
+
+    def test_apply(self):
+        "applying a policy prunes the pairings and features"
+        report = prune_candidates(*self.paths, policy='tc')
+        self.assertTrue(report['tc']['applied'])
+        self.assertEqual(self._pairs(),
+                         [('ROOT', 'e1'), ('e1', 'e2'), ('e2', 'e1'),
+                          ('e1', 'e5'), ('e5', 'e4'), ('e2', 'e3')])
+        with open(self.paths[2]) as stream:
+            lines = stream.read().splitlines()
+        self.assertEqual(lines[0], '# labels: ' + ' '.join(LABELS))
+        self.assertEqual(lines[1:], ['1 0:1', '2 0:1', '3 0:1 1:1',
+                                     '1 0:1', '1 1:1', '0 0:1'])
+
+    def test_unknown_policy(self):
+        "bad specs are rejected"
+        self.assertRaises(ValueError, prune_candidates, *self.paths,
+                          policy='window:far')
@@ -0,0 +1,61 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Listing the irit-stac subcommands (and reading settings) without
+importing the heavy stuff
+"""
+
+from __future__ import print_function
+from os import path as fp
+import subprocess
+import sys
+import unittest
+
+import pytest
+
+from stac.harness.cmd import (SUBCOMMANDS, summary)
+
+ROOT_DIR = fp.dirname(fp.dirname(fp.dirname(fp.abspath(__file__))))
+
+
+def _imported(module):
+    """
+    Top level packages imported along with a module (in a fresh
+    interpreter)
+    """
+    script = ('import sys, {}; '
+              'print(" ".join(sorted(set(m.split(".")[0] '
+              'for m in sys.modules))))').format(module)
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=ROOT_DIR)
+    return frozenset(output.decode('utf-8').split())
+
+
+class CmdTest(unittest.TestCase):
+    "subcommand table"
+
+    def test_summaries(self):
+        "every subcommand has a one line help"
+        for name, _ in SUBCOMMANDS:
+            text = summary(name)
+            self.assertTrue(text, name)
+            self.assertNotIn('\n', text)
+
+    def test_summary_is_docstring(self):
+        "help comes from the module docstring"
+        self.assertEqual(summary('corpus-cache'),
+                         'build binary snapshots of the corpus '
+                         '(and time loading them)')
+
+    def test_lazy(self):
+        "listing subcommands imports none of them"
+        imported = _imported('stac.harness.cmd')
+        self.assertFalse(imported & frozenset(['attelo', 'educe',
+                                               'sklearn', 'zmq']))
+
+    def test_local_settings(self):
+        "reading a setting does not import attelo or sklearn"
+        pytest.importorskip('educe')
+        imported = _imported('stac.harness.local')
+        self.assertFalse(imported & frozenset(['attelo', 'sklearn']))
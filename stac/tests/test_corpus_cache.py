@@ -0,0 +1,127 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Binary corpus snapshots: when documents are read again, and when
+they come from the snapshot
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+from os import path as fp
+import os
+import shutil
+import tempfile
+import unittest
+
+from stac import corpus_cache
+
+
+FileId = namedtuple('FileId', 'doc subdoc stage annotator')
+
+
+class FakeDoc(namedtuple('FakeDoc', 'key text')):
+    "stand-in for a parsed document"
+    pass
+
+
+class FakeReader(object):
+    "reader which records which documents it was asked to parse"
+
+    def __init__(self):
+        self.parsed = []
+
+    def slurp(self, anno_files, verbose=False):
+        "parse the documents (just read the text)"
+        # pylint: disable=unused-argument
+        corpus = {}
+        for key, path in anno_files.items():
+            with open(path) as stream:
+                corpus[key] = FakeDoc(key, stream.read())
+            self.parsed.append(key)
+        return corpus
+
+
+class CorpusCacheTest(unittest.TestCase):
+    "snapshots vs the reader"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test-corpus-cache-')
+        self.snapshot_dir = fp.join(self.tmp, 'snapshots')
+        self.anno_files = {}
+        for doc in ['pilot01', 'pilot02']:
+            key = FileId(doc, '01', 'unannotated', None)
+            path = fp.join(self.tmp, doc + '.aa')
+            with open(path, 'w') as stream:
+                stream.write(doc)
+            self.anno_files[key] = path
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _slurp(self):
+        "read the corpus, returning it and the keys that were parsed"
+        reader = FakeReader()
+        corpus = corpus_cache.slurp(reader, self.anno_files,
+                                    snapshot_dir=self.snapshot_dir)
+        return corpus, sorted(reader.parsed)
+
+    def _manifest_mtime(self):
+        "modification time of the manifest"
+        return os.stat(fp.join(self.snapshot_dir, 'manifest.json')).st_mtime
+
+    def _age_manifest(self):
+        "pretend the manifest was written a while ago"
+        os.utime(fp.join(self.snapshot_dir, 'manifest.json'), (0, 0))
+
+    def test_fresh(self):
+        "unchanged documents come from the snapshot"
+        corpus1, parsed1 = self._slurp()
+        self.assertEqual(parsed1, sorted(self.anno_files))
+        self._age_manifest()
+        corpus2, parsed2 = self._slurp()
+        self.assertEqual(parsed2, [])
+        self.assertEqual(corpus1, corpus2)
+        # nothing changed, so the manifest is left alone
+        self.assertEqual(self._manifest_mtime(), 0)
+
+    def test_stale(self):
+        "modified documents are read again (and saved)"
+        self._slurp()
+        key = sorted(self.anno_files)[0]
+        with open(self.anno_files[key], 'w') as stream:
+            stream.write('something else')
+        self._age_manifest()
+        corpus, parsed = self._slurp()
+        self.assertEqual(parsed, [key])
+        self.assertEqual(corpus[key].text, 'something else')
+        self.assertNotEqual(self._manifest_mtime(), 0)
+        _, parsed = self._slurp()
+        self.assertEqual(parsed, [])
+
+    def test_touched(self):
+        "a new mtime with the same contents is not a change"
+        self._slurp()
+        key = sorted(self.anno_files)[0]
+        os.utime(self.anno_files[key], (1, 1))
+        self._age_manifest()
+        _, parsed = self._slurp()
+        self.assertEqual(parsed, [])
+        # but we note the new mtime so as not to hash it again
+        self.assertNotEqual(self._manifest_mtime(), 0)
+
+    def test_bad_snapshot(self):
+        "snapshots that can't be unpickled are read again"
+        self._slurp()
+        key = sorted(self.anno_files)[0]
+        # pylint: disable=protected-access
+        snap_path = fp.join(self.snapshot_dir,
+                            corpus_cache._entry_name(key) + '.pickle')
+        with open(snap_path, 'wb') as stream:
+            stream.write(b'not a pickle')
+        corpus, parsed = self._slurp()
+        self.assertEqual(parsed, [key])
+        self.assertEqual(corpus[key].text, key.doc)
+        # and the snapshot is repaired
+        _, parsed = self._slurp()
+        self.assertEqual(parsed, [])
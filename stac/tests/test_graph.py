@@ -0,0 +1,109 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Redrawing only the graphs that changed
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+from os import path as fp
+import json
+import shutil
+import tempfile
+import unittest
+
+import pytest
+
+pytest.importorskip('attelo')
+pytest.importorskip('educe')
+
+# pylint: disable=wrong-import-position
+from attelo.graph import (GraphSettings)
+from stac.harness import graph
+from stac.harness.util import (swapped)
+# pylint: enable=wrong-import-position
+
+# pylint: disable=protected-access
+
+Edu = namedtuple('Edu', 'id grouping')
+
+EDUS = [Edu('d1_1', 'd1'), Edu('d1_2', 'd1'),
+        Edu('d2_1', 'd2'), Edu('d2_2', 'd2')]
+
+EDGES = [('d1_1', 'd1_2', 'Elaboration'),
+         ('d1_2', 'd1_1', 'UNRELATED'),
+         ('d2_1', 'd2_2', 'Result')]
+
+
+def _settings(select):
+    "graph settings for the given documents"
+    return GraphSettings(hide=None, select=select, unrelated=False,
+                         timeout=15, quiet=True)
+
+
+class GraphTest(unittest.TestCase):
+    "edge hashes and the manifest"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test-graph-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _manifest(self):
+        "what the manifest says"
+        with open(fp.join(self.tmp, graph._MANIFEST)) as stream:
+            return json.load(stream)
+
+    def test_edge_hashes(self):
+        "only the document whose edges change gets a new hash"
+        before = graph._edge_hashes(EDUS, EDGES)
+        self.assertEqual(sorted(before), ['d1', 'd2'])
+        # unrelated edges do not count
+        self.assertEqual(graph._edge_hashes(EDUS, EDGES[:1] + EDGES[2:]),
+                         before)
+        after = graph._edge_hashes(EDUS, EDGES[:2] +
+                                   [('d2_1', 'd2_2', 'Contrast')])
+        self.assertEqual(after['d1'], before['d1'])
+        self.assertNotEqual(after['d2'], before['d2'])
+
+    def test_failed_render(self):
+        "documents whose graphs were not written stay out of the manifest"
+        hashes = graph._edge_hashes(EDUS, EDGES)
+        # a stale graph from an earlier run
+        with open(fp.join(self.tmp, 'd2.svg'), 'w') as stream:
+            stream.write('old')
+
+        def draw(_, settings, output_dir):
+            "graphviz gives up on d2"
+            for doc in settings.select:
+                if doc != 'd2':
+                    with open(fp.join(output_dir, doc + '.svg'), 'w') as out:
+                        out.write('new')
+
+        key, _, failed = graph._render('conf', draw, [EDUS],
+                                       _settings(['d1', 'd2']),
+                                       self.tmp, hashes)
+        self.assertEqual(key, 'conf')
+        self.assertEqual(failed, ['d2'])
+        self.assertEqual(self._manifest(), {'d1': hashes['d1']})
+        self.assertFalse(fp.exists(fp.join(self.tmp, 'd2.svg')))
+        with swapped(graph, 'GRAPH_DOCS', None):
+            self.assertEqual(graph._changed_docs(self.tmp, hashes), ['d2'])
+
+    def test_unchanged(self):
+        "nothing to do once every graph is drawn"
+        hashes = graph._edge_hashes(EDUS, EDGES)
+
+        def draw(_, settings, output_dir):
+            "draws everything"
+            for doc in settings.select:
+                with open(fp.join(output_dir, doc + '.svg'), 'w') as out:
+                    out.write('new')
+
+        with swapped(graph, 'GRAPH_DOCS', None):
+            graph._render('conf', draw, [EDUS], _settings(['d1', 'd2']),
+                          self.tmp, hashes)
+            self.assertIsNone(graph._graph_job('conf', draw, [EDUS],
+                                               self.tmp, hashes))
@@ -0,0 +1,97 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Decoding the turns of intra/inter parsers on a worker pool
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import threading
+import unittest
+
+import pytest
+
+pytest.importorskip('attelo')
+pytest.importorskip('educe')
+
+# pylint: disable=wrong-import-position
+from attelo.parser.intra import (IntraInterPair)
+from stac.harness import local
+from stac.harness.config.intra import (ParallelHeadToHeadParser,
+                                       ParallelSoftParser)
+from stac.harness.util import (swapped)
+# pylint: enable=wrong-import-position
+
+# pylint: disable=protected-access
+
+Pack = namedtuple('Pack', 'name edus')
+
+
+class RecordingParser(object):
+    "tags each pack with its name, noting which thread parsed it"
+
+    def __init__(self):
+        self.threads = {}
+
+    def transform(self, spack):
+        "(parser interface)"
+        self.threads[spack.name] = threading.current_thread().name
+        return 'parsed-' + spack.name
+
+
+def _packs(sizes):
+    "subgroupings with the given number of EDUs"
+    return [Pack('t{}'.format(i), ['e'] * size)
+            for i, size in enumerate(sizes)]
+
+
+class ParallelIntraTest(unittest.TestCase):
+    "the loop over subgroupings"
+
+    def _parser(self, parser_class=ParallelHeadToHeadParser, **kwargs):
+        "an intra/inter parser around a recording intra parser"
+        intra = RecordingParser()
+        parser = parser_class(IntraInterPair(intra=intra, inter=None),
+                              **kwargs)
+        return parser, intra
+
+    def _inline(self, intra):
+        "names of the packs parsed in this thread"
+        here = threading.current_thread().name
+        return sorted(k for k, v in intra.threads.items() if v == here)
+
+    def test_pool(self):
+        "big turns go to the pool, small ones are inline, order is kept"
+        spacks = _packs([5, 1, 6, 7, 2])
+        for parser_class in [ParallelHeadToHeadParser, ParallelSoftParser]:
+            parser, intra = self._parser(parser_class, n_jobs=2,
+                                         inline_size=4)
+            self.assertEqual(parser._transform_intra(spacks),
+                             ['parsed-' + x.name for x in spacks])
+            self.assertEqual(self._inline(intra), ['t1', 't4'])
+
+    def test_sequential(self):
+        "with one job, or only one big turn, there is no pool"
+        spacks = _packs([5, 1, 6])
+        parser, intra = self._parser(n_jobs=1, inline_size=4)
+        parser._transform_intra(spacks)
+        self.assertEqual(self._inline(intra), ['t0', 't1', 't2'])
+
+        parser, intra = self._parser(n_jobs=4, inline_size=5)
+        self.assertEqual(parser._transform_intra(spacks),
+                         ['parsed-t0', 'parsed-t1', 'parsed-t2'])
+        self.assertEqual(self._inline(intra), ['t0', 't1', 't2'])
+
+    def test_settings(self):
+        "the harness configs get our settings (sequential by default)"
+        self.assertEqual(local.INTRA_JOBS, 1)
+        configs = local._intra_inter_configs()
+        self.assertEqual([k.key for k in configs], ['iheads', 'isoft'])
+        with swapped(local, 'INTRA_JOBS', 3):
+            parser = configs[1].payload(IntraInterPair(intra=None,
+                                                       inter=None))
+        self.assertIsInstance(parser, ParallelSoftParser)
+        self.assertEqual(parser._n_jobs, 3)
+        self.assertEqual(parser._backend, local.INTRA_BACKEND)
+        self.assertEqual(parser._inline_size, local.INTRA_INLINE_SIZE)
@@ -0,0 +1,102 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Live metrics for the parse server
+"""
+
+from __future__ import print_function
+import json
+import socket
+import unittest
+
+import pytest
+
+pytest.importorskip('zmq')
+
+# pylint: disable=wrong-import-position
+from stac.harness.metrics import (LATENCY_BUCKETS,
+                                  Histogram,
+                                  ServerMetrics,
+                                  poll_metrics,
+                                  quantile,
+                                  serve_metrics)
+# pylint: enable=wrong-import-position
+
+
+def _free_port():
+    "a port nobody is listening on (probably)"
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class HistogramTest(unittest.TestCase):
+    "latency histograms"
+
+    def test_buckets(self):
+        "latencies go in the first bucket they fit, or the last"
+        hist = Histogram()
+        for seconds in [0.005, 0.01, 0.02, 1000.]:
+            hist.add(seconds)
+        counts = hist.to_json()['counts']
+        self.assertEqual(len(counts), len(LATENCY_BUCKETS) + 1)
+        self.assertEqual(counts[:2], [2, 1])
+        self.assertEqual(counts[-1], 1)
+        self.assertEqual(hist.max, 1000.)
+
+    def test_quantile(self):
+        "quantiles are bucket bounds, never more than the max"
+        hist = Histogram()
+        self.assertIsNone(quantile(hist.to_json(), 0.5))
+        for seconds in [0.02] * 9 + [2.]:
+            hist.add(seconds)
+        self.assertEqual(quantile(hist.to_json(), 0.5), 0.03)
+        self.assertEqual(quantile(hist.to_json(), 0.9), 0.03)
+        self.assertEqual(quantile(hist.to_json(), 0.95), 2.)
+        hist.add(500.)
+        self.assertEqual(quantile(hist.to_json(), 1.), 500.)
+
+
+class ServerMetricsTest(unittest.TestCase):
+    "what the server keeps track of"
+
+    def test_counters(self):
+        "requests, answers and failures"
+        metrics = ServerMetrics()
+        for _ in range(3):
+            metrics.request_started(100)
+        metrics.request_done(0.5, timings={'decode': 0.3})
+        metrics.request_done(0.2, degraded='timeout')
+        metrics.update_state(models=['a'])
+        snap = metrics.snapshot()
+        self.assertEqual(snap['in_flight'], 1)
+        metrics.request_failed()
+        snap = metrics.snapshot()
+        self.assertEqual(snap['in_flight'], 0)
+        self.assertEqual(snap['counters'],
+                         {'requests': 3, 'ok': 1, 'degraded': 1,
+                          'failed': 1, 'request_bytes': 300,
+                          'degraded_timeout': 1})
+        self.assertEqual(list(snap['latency']), ['request', 'decode'])
+        self.assertEqual(sum(snap['latency']['request']['counts']), 2)
+        self.assertEqual(snap['state'], {'models': ['a']})
+        self.assertGreater(snap['rate'], 0)
+        # it has to go out as JSON
+        json.dumps(snap)
+
+    def test_poll(self):
+        "snapshots are served on a local port"
+        metrics = ServerMetrics()
+        metrics.request_started(10)
+        port = _free_port()
+        serve_metrics(metrics, port)
+        snap = poll_metrics('tcp://127.0.0.1:{}'.format(port), timeout=5.)
+        self.assertEqual(snap['counters']['requests'], 1)
+
+    def test_no_server(self):
+        "no answer, no snapshot"
+        address = 'tcp://127.0.0.1:{}'.format(_free_port())
+        self.assertIsNone(poll_metrics(address, timeout=0.1))
@@ -0,0 +1,116 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Content-addressed store of fitted models
+"""
+
+from __future__ import print_function
+from os import path as fp
+import shutil
+import tempfile
+import unittest
+
+from sklearn.linear_model import LogisticRegression
+import numpy as np
+
+from stac.harness.model_store import (fetch,
+                                      file_digest,
+                                      is_from_store,
+                                      learner_signature,
+                                      publish,
+                                      store_key)
+
+
+class Wrapper(object):
+    "a learner wrapping another, the way attelo does"
+
+    def __init__(self, learner):
+        self.learner = learner
+        self.classes_ = None
+
+
+class SignatureTest(unittest.TestCase):
+    "what goes into a store key"
+
+    def test_hyperparameters(self):
+        "hyperparameters count, fitting does not"
+        before = learner_signature(LogisticRegression(C=1.0))
+        self.assertNotEqual(before,
+                            learner_signature(LogisticRegression(C=2.0)))
+        fitted = LogisticRegression(C=1.0)
+        fitted.fit(np.array([[0.], [1.], [2.], [3.]]), [0, 0, 1, 1])
+        self.assertEqual(learner_signature(fitted), before)
+
+    def test_wrapped(self):
+        "wrapped learners are described all the way down"
+        sig = learner_signature(Wrapper(LogisticRegression(C=3.0)))
+        self.assertIn('Wrapper', sig)
+        self.assertIn('LogisticRegression', sig)
+        self.assertIn('C: 3.0', sig)
+        self.assertNotIn('classes_', sig)
+        wrapped = Wrapper(LogisticRegression(C=3.0))
+        wrapped.classes_ = [1, 2]
+        self.assertEqual(learner_signature(wrapped), sig)
+
+    def test_store_key(self):
+        "keys are stable and depend on every part"
+        self.assertEqual(store_key(['a', 1]), store_key(['a', 1]))
+        self.assertNotEqual(store_key(['a', 1]), store_key(['a', 2]))
+        self.assertNotEqual(store_key(['a1']), store_key(['a', 1]))
+
+
+class StoreTest(unittest.TestCase):
+    "putting models in and getting them out"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test-model-store-')
+        self.store = fp.join(self.tmp, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name, content):
+        "write a file in the scratch directory"
+        path = fp.join(self.tmp, name)
+        with open(path, 'w') as stream:
+            stream.write(content)
+        return path
+
+    def test_digest(self):
+        "same contents, same digest"
+        path1 = self._write('a', 'hello')
+        path2 = self._write('b', 'hello')
+        path3 = self._write('c', 'bye')
+        self.assertEqual(file_digest(path1), file_digest(path2))
+        self.assertNotEqual(file_digest(path1), file_digest(path3))
+
+    def test_round_trip(self):
+        "published models can be fetched by key, once"
+        key = store_key(['model'])
+        target = fp.join(self.tmp, 'eval', 'fold-0', 'attach.model')
+        self.assertFalse(fetch(self.store, key, target))
+        self.assertFalse(fp.exists(target))
+
+        fitted = self._write('fitted.model', 'weights')
+        publish(self.store, key, fitted)
+        self.assertTrue(fetch(self.store, key, target))
+        with open(target) as stream:
+            self.assertEqual(stream.read(), 'weights')
+        self.assertTrue(is_from_store(self.store, key, target))
+        self.assertFalse(is_from_store(self.store, store_key(['other']),
+                                       target))
+
+        # publishing again leaves the entry alone
+        publish(self.store, key, self._write('refit.model', 'other'))
+        other = fp.join(self.tmp, 'other.model')
+        fetch(self.store, key, other)
+        with open(other) as stream:
+            self.assertEqual(stream.read(), 'weights')
+
+    def test_publish_missing(self):
+        "models that were never written are not published"
+        key = store_key(['model'])
+        publish(self.store, key, fp.join(self.tmp, 'nowhere.model'))
+        self.assertFalse(fetch(self.store, key,
+                               fp.join(self.tmp, 'x.model')))
@@ -0,0 +1,107 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Successive halving over evaluation configurations
+"""
+
+from __future__ import print_function
+import unittest
+
+import pytest
+
+pytest.importorskip('attelo')
+pytest.importorskip('educe')
+
+# pylint: disable=wrong-import-position
+from attelo.table import (UNRELATED)
+from stac.harness import pruning
+from stac.harness.pruning import (score_links, select_survivors)
+# pylint: enable=wrong-import-position
+
+# pylint: disable=protected-access
+
+GOLD = [('e1', 'e2', 'Elaboration'),
+        ('e2', 'e3', 'Result'),
+        ('e1', 'e4', 'Contrast')]
+
+
+class ScoreTest(unittest.TestCase):
+    "cheap scores for ranking configurations"
+
+    def test_perfect(self):
+        "gold against itself (unrelated predictions do not count)"
+        pred = GOLD + [('e3', 'e4', UNRELATED)]
+        self.assertEqual(score_links(GOLD, pred),
+                         {'edges': 1., 'edges_by_label': 1., 'edus': 1.})
+
+    def test_wrong_label(self):
+        "right edge, wrong label"
+        pred = GOLD[:2] + [('e1', 'e4', 'Result')]
+        scores = score_links(GOLD, pred)
+        self.assertEqual(scores['edges'], 1.)
+        self.assertAlmostEqual(scores['edges_by_label'], 2. / 3)
+        self.assertAlmostEqual(scores['edus'], 2. / 3)
+
+    def test_missing(self):
+        "missing and spurious edges"
+        pred = GOLD[:1] + [('e3', 'e4', 'Result')]
+        scores = score_links(GOLD, pred)
+        # p = 1/2, r = 1/3
+        self.assertAlmostEqual(scores['edges'], 0.4)
+        self.assertAlmostEqual(scores['edus'], 1. / 3)
+
+    def test_empty(self):
+        "nothing to find, nothing found"
+        self.assertEqual(score_links([], []),
+                         {'edges': 1., 'edges_by_label': 1., 'edus': 1.})
+        self.assertEqual(score_links(GOLD, [])['edges'], 0.)
+
+
+class SurvivorTest(unittest.TestCase):
+    "who gets pruned"
+
+    def test_dominated(self):
+        "dominated configurations go, the worst first, at most half"
+        scores = {'best': {'a': 0.9, 'b': 0.9},
+                  'mid': {'a': 0.5, 'b': 0.5},
+                  'worst': {'a': 0.1, 'b': 0.1},
+                  'tradeoff': {'a': 0.95, 'b': 0.2}}
+        kept, dropped = select_survivors(scores)
+        self.assertEqual(dropped, ['worst', 'mid'])
+        self.assertEqual(sorted(kept), ['best', 'tradeoff'])
+
+    def test_half(self):
+        "never more than half of them"
+        scores = {k: {'a': v} for k, v in
+                  [('c1', 0.9), ('c2', 0.5), ('c3', 0.3), ('c4', 0.2),
+                   ('c5', 0.1)]}
+        kept, dropped = select_survivors(scores)
+        self.assertEqual(dropped, ['c5', 'c4'])
+        self.assertEqual(sorted(kept), ['c1', 'c2', 'c3'])
+
+    def test_protect(self):
+        "the protected configuration stays whatever it scores"
+        scores = {'best': {'a': 0.9}, 'test': {'a': 0.1}}
+        kept, dropped = select_survivors(scores, protect='test')
+        self.assertEqual(dropped, [])
+        self.assertEqual(sorted(kept), ['best', 'test'])
+
+    def test_ties(self):
+        "equal scores do not dominate each other"
+        scores = {'x': {'a': 0.5}, 'y': {'a': 0.5}}
+        self.assertEqual(select_survivors(scores)[1], [])
+
+
+class RungTest(unittest.TestCase):
+    "splitting folds into rungs"
+
+    def test_rungs(self):
+        "cumulative sizes, with the last rung taking the rest"
+        folds = list(range(10))
+        self.assertEqual(pruning._rungs(folds, [2, 5]),
+                         [[0, 1], [2, 3, 4], [5, 6, 7, 8, 9]])
+        # sizes that do not make sense are ignored
+        self.assertEqual(pruning._rungs(folds, [3, 3, 12]),
+                         [[0, 1, 2], [3, 4, 5, 6, 7, 8, 9]])
+        self.assertEqual(pruning._rungs(folds, []), [folds])
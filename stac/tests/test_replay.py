@@ -0,0 +1,162 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Replaying soclogs against a (stub) parse server
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+from os import path as fp
+import shutil
+import tempfile
+import threading
+import unittest
+
+import pytest
+
+zmq = pytest.importorskip('zmq')
+pytest.importorskip('educe')
+
+# pylint: disable=wrong-import-position
+from stac.harness.cmd import replay
+# pylint: enable=wrong-import-position
+
+SOCLOG = [b'2012:11:17:23:59:59:000:+0000:SOCGameTextMsg:text=a\n',
+          b'player=x|speaking-queue=[]|text=hi\n',
+          b'\n',
+          # past midnight
+          b'2012:11:18:00:00:01:500:+0000:SOCGameTextMsg:text=b\n',
+          # out of order
+          b'2012:11:18:23:59:58:000:+0000:SOCGameTextMsg:text=c\n']
+
+
+class StubServer(threading.Thread):
+    """
+    Answers requests with a Settlers XML fragment (degraded for the
+    ones containing `degrade`, not at all for the first `ignore`
+    requests), keeping what it was sent
+    """
+
+    def __init__(self, context, address, ignore=0):
+        super(StubServer, self).__init__()
+        self.daemon = True
+        self.payloads = []
+        self._socket = context.socket(zmq.ROUTER)  # pylint: disable=no-member
+        self._socket.bind(address)
+        self._ignore = ignore
+
+    def run(self):
+        try:
+            while True:
+                ident, empty, payload = self._socket.recv_multipart()
+                self.payloads.append(payload)
+                if len(self.payloads) <= self._ignore:
+                    continue
+                answer = b'<game_fragment degraded="true"/>'\
+                    if b'degrade' in payload else b'<game_fragment/>'
+                self._socket.send_multipart([ident, empty, answer])
+        except zmq.ContextTerminated:
+            self._socket.close()
+
+
+class ScheduleTest(unittest.TestCase):
+    "reading soclog timestamps"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test-replay-')
+        self.path = fp.join(self.tmp, 'game.soclog')
+        with open(self.path, 'wb') as stream:
+            stream.writelines(SOCLOG)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_schedule(self):
+        "lines are due at their (sped up, never decreasing) timestamps"
+        schedule = replay.read_schedule(self.path, speedup=2.)
+        self.assertEqual([l for _, l in schedule],
+                         [l for l in SOCLOG if l.strip()])
+        self.assertEqual([t for t, _ in schedule], [0., 0., 1.25, 1.25])
+
+
+class SessionTest(unittest.TestCase):
+    "sessions against a stub server"
+
+    def setUp(self):
+        self.context = zmq.Context()
+        self.address = 'inproc://stub'
+
+    def tearDown(self):
+        self.context.term()
+
+    def _replay(self, schedule, ignore=0, **kwargs):
+        "run a session to the end, returning it and the server"
+        server = StubServer(self.context, self.address, ignore=ignore)
+        server.start()
+        session = replay.Session(0, self.context, self.address, 'game',
+                                 schedule, **kwargs)
+        session.run()
+        return session, server
+
+    def test_incremental(self):
+        "incremental sessions send each line once"
+        schedule = [(0., b'a\n'), (0., b'b\n'), (0.05, b'degrade\n'),
+                    (0.1, b'd\n')]
+        session, server = self._replay(schedule, incremental=True)
+        self.assertEqual(b''.join(server.payloads), b'a\nb\ndegrade\nd\n')
+        self.assertEqual(server.payloads[0], b'a\nb\n')
+        self.assertEqual(len(session.records), len(server.payloads))
+        self.assertEqual(sum(r['lines'] for r in session.records), 4)
+        self.assertTrue(all(r['error'] is None for r in session.records))
+        self.assertEqual(len([r for r in session.records
+                              if r['degraded']]), 1)
+
+    def test_whole_log(self):
+        "otherwise each request has the whole log so far"
+        schedule = [(0., b'a\n'), (0.05, b'b\n'), (0.1, b'c\n')]
+        _, server = self._replay(schedule)
+        self.assertEqual(server.payloads[-1], b'a\nb\nc\n')
+        for before, after in zip(server.payloads, server.payloads[1:]):
+            self.assertTrue(after.startswith(before))
+
+    def test_timeout(self):
+        "unanswered requests are errors, and the session carries on"
+        schedule = [(0., b'a\n'), (0.01, b'b\n')]
+        session, server = self._replay(schedule, ignore=1, timeout=0.2,
+                                       incremental=True)
+        self.assertEqual([r['error'] for r in session.records],
+                         ['timeout', None])
+        self.assertEqual(server.payloads, [b'a\n', b'b\n'])
+
+
+FakeSession = namedtuple('FakeSession', 'number soclog records')
+
+
+def _record(latency, error=None, degraded=False, lag=0.):
+    "what a session records for a request"
+    return {'latency': latency, 'error': error, 'degraded': degraded,
+            'lag': lag, 'request_bytes': 10, 'response_bytes': 5,
+            'lines': 1, 'session': 0}
+
+
+class ReportTest(unittest.TestCase):
+    "summarising the requests"
+
+    def test_report(self):
+        "counts, errors, lag and latency percentiles"
+        sessions = [FakeSession(0, 'a', [_record(1.), _record(3., lag=2.),
+                                         _record(60., error='timeout')]),
+                    FakeSession(1, 'b', [_record(2., degraded=True)])]
+        report = replay.make_report(sessions, 2.)
+        self.assertEqual(report['requests'], 4)
+        self.assertEqual(report['answered'], 3)
+        self.assertEqual(report['throughput'], 1.5)
+        self.assertEqual(report['errors'], {'timeout': 1})
+        self.assertEqual(report['degraded'], 1)
+        self.assertEqual(report['max_lag'], 2.)
+        self.assertEqual(report['request_bytes'], 40)
+        self.assertEqual(report['latency']['p50'], 2.)
+        self.assertEqual(report['latency']['max'], 3.)
+        self.assertEqual([s['errors'] for s in report['per_session']],
+                         [1, 0])
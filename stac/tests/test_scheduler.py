@@ -0,0 +1,117 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Local scheduler for the cluster-mode evaluation stages
+"""
+
+from __future__ import print_function
+from multiprocessing import (Process)
+from os import path as fp
+import json
+import shutil
+import tempfile
+import time
+import unittest
+
+import pytest
+
+pytest.importorskip('attelo')
+pytest.importorskip('educe')
+
+# pylint: disable=wrong-import-position
+from stac.harness import scheduler
+from stac.harness.scheduler import (LocalScheduler, Node)
+# pylint: enable=wrong-import-position
+
+# pylint: disable=protected-access
+
+
+def _job(exitcode):
+    "stands in for an evaluation stage"
+    time.sleep(0.1)
+    raise SystemExit(exitcode)
+
+
+class FakeNode(Node):
+    """
+    A job that just exits with the given code, noting how many
+    of its siblings were running when it started
+    """
+    def __init__(self, name, siblings, exitcode=0):
+        super(FakeNode, self).__init__(name, None)
+        self.exitcode = exitcode
+        self.siblings = siblings
+        self.concurrent = None
+
+    def start(self, mode, n_jobs):
+        self.concurrent = len([n for n in self.siblings
+                               if n.proc is not None and n.proc.is_alive()])
+        self.proc = Process(target=_job, args=(self.exitcode,))
+        self.proc.start()
+        self.started = time.time()
+
+
+class SchedulerTest(unittest.TestCase):
+    "running jobs and remembering which ones finished"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test-scheduler-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _scheduler(self, slots, n_jobs=1):
+        "a scheduler with its state in the scratch directory"
+        sched = LocalScheduler(None, slots=slots, n_jobs=n_jobs)
+        sched._load_state(self.tmp)
+        return sched
+
+    def _nodes(self, names, failing=()):
+        "fake jobs with the given names"
+        nodes = []
+        for name in names:
+            nodes.append(FakeNode(name, nodes,
+                                  exitcode=1 if name in failing else 0))
+        return nodes
+
+    def test_slots(self):
+        "never more jobs at a time than the slots allow"
+        sched = self._scheduler(slots=4, n_jobs=2)
+        nodes = self._nodes(['fold-0', 'fold-1', 'fold-2'])
+        self.assertEqual(sched._run_parallel(nodes), [])
+        self.assertEqual(max(n.concurrent for n in nodes), 1)
+        self.assertEqual(sorted(sched.state), ['fold-0', 'fold-1',
+                                               'fold-2'])
+
+    def test_resume(self):
+        "finished jobs are saved, and not rerun"
+        sched = self._scheduler(slots=2)
+        sched._run_parallel(self._nodes(['combined-models', 'fold-0']))
+        with open(fp.join(self.tmp, scheduler._STATE_FILE)) as stream:
+            self.assertEqual(sorted(json.load(stream)),
+                             ['combined-models', 'fold-0'])
+        sched = self._scheduler(slots=2)
+        nodes = self._nodes(['combined-models', 'fold-0', 'fold-1'])
+        self.assertEqual(sched._run_parallel(nodes), [])
+        self.assertEqual([n.name for n in nodes if n.proc is not None],
+                         ['fold-1'])
+
+    def test_failure(self):
+        "a failed job is reported and nothing new is started"
+        sched = self._scheduler(slots=1)
+        nodes = self._nodes(['fold-0', 'fold-1', 'fold-2'],
+                            failing=['fold-0'])
+        self.assertEqual(sched._run_parallel(nodes), ['fold-0'])
+        self.assertTrue(all(n.proc is None for n in nodes[1:]))
+        self.assertEqual(sched.state, {})
+
+    def test_eta(self):
+        "mean fold time times what is left, spread over the slots"
+        sched = self._scheduler(slots=4, n_jobs=2)
+        pending = self._nodes(['fold-2', 'fold-3', 'combined-models'])
+        self.assertIsNone(sched._eta(pending, []))
+        sched.state = {'fold-0': {'seconds': 10.},
+                       'fold-1': {'seconds': 30.},
+                       'combined-models': {'seconds': 100.}}
+        self.assertEqual(sched._eta(pending, []), 20.)
@@ -0,0 +1,240 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Sharing scores between parsers
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pytest
+import scipy.sparse
+
+from stac.harness import scores
+
+# pylint: disable=protected-access
+
+
+Edu = namedtuple('Edu', 'id')
+
+
+class DataPack(namedtuple('DataPack', 'edus pairings data target')):
+    "stand-in for an attelo datapack"
+
+    def selected(self, idxes):
+        "just the given pairs"
+        return self._replace(pairings=[self.pairings[i] for i in idxes],
+                             data=self.data[idxes],
+                             target=self.target[idxes])
+
+
+def mk_dpack(doc, num_edus, seed=0):
+    "a datapack with all pairs of EDUs and some random features"
+    rng = np.random.RandomState(seed)
+    edus = [Edu('{}_{}'.format(doc, i)) for i in range(num_edus)]
+    pairings = [(e1, e2) for e1 in edus for e2 in edus if e1 != e2]
+    data = scipy.sparse.random(len(pairings), 20, density=0.3,
+                               format='csr', random_state=rng)
+    return DataPack(edus, pairings, data,
+                    rng.randint(2, size=len(pairings)))
+
+
+class Scorer(object):
+    "scores a datapack, counting how many times it was asked to"
+
+    def __init__(self):
+        self.calls = 0
+        self.weights = np.arange(40.).reshape(20, 2) / 40.
+
+    def __call__(self, dpack):
+        self.calls += 1
+        return np.asarray(dpack.data.dot(self.weights))
+
+
+class ScoresTest(unittest.TestCase):
+    "cached_scores and friends"
+
+    def setUp(self):
+        scores.set_cache_dir(None)
+        self.scorer = Scorer()
+
+    def tearDown(self):
+        scores.set_cache_dir(None)
+
+    def _score(self, dpack, model_key='model'):
+        "scores via the cache"
+        return scores.cached_scores(model_key, dpack,
+                                    lambda: self.scorer(dpack))
+
+    def test_shared(self):
+        "same model, same datapack: scored once"
+        dpack = mk_dpack('d1', 5)
+        first = self._score(dpack)
+        first[0, 0] = -1.
+        again = self._score(mk_dpack('d1', 5))
+        self.assertEqual(self.scorer.calls, 1)
+        np.testing.assert_array_equal(again, self.scorer(dpack))
+
+    def test_distinct(self):
+        "other models, documents and selections are scored again"
+        dpack = mk_dpack('d1', 5)
+        self._score(dpack)
+        self._score(dpack, model_key='other')
+        self._score(mk_dpack('d2', 5))
+        self._score(dpack.selected(np.arange(len(dpack.pairings) - 1)))
+        self._score(dpack.selected(np.arange(1, len(dpack.pairings))))
+        self.assertEqual(self.scorer.calls, 5)
+
+    def test_no_model_key(self):
+        "no key, no caching"
+        dpack = mk_dpack('d1', 4)
+        self._score(dpack, model_key=None)
+        self._score(dpack, model_key=None)
+        self.assertEqual(self.scorer.calls, 2)
+
+    def test_memory_bound(self):
+        "only the most recently used scores are kept in memory"
+        dpacks = [mk_dpack('d{}'.format(i), 2)
+                  for i in range(scores.MEMORY_SIZE + 1)]
+        for dpack in dpacks:
+            self._score(dpack)
+        self.assertEqual(len(scores._MEMORY), scores.MEMORY_SIZE)
+        self._score(dpacks[-1])
+        self.assertEqual(self.scorer.calls, len(dpacks))
+        self._score(dpacks[0])
+        self.assertEqual(self.scorer.calls, len(dpacks) + 1)
+
+    def test_report(self):
+        "hits and misses are counted (in memory)"
+        dpack = mk_dpack('d1', 4)
+        self._score(dpack)
+        self._score(dpack)
+        summary = scores.report()
+        self.assertEqual(summary['hits'], 1)
+        self.assertEqual(summary['misses'], 1)
+        scores.clear_cache()
+        self.assertIsNone(scores.report())
+
+
+class DiskScoresTest(unittest.TestCase):
+    "sharing scores on disk"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test-scores-')
+        scores.set_cache_dir(self.tmp)
+        self.scorer = Scorer()
+
+    def tearDown(self):
+        scores.set_cache_dir(None)
+        shutil.rmtree(self.tmp)
+
+    def _pickles(self):
+        "score files in the cache directory"
+        return [x for x in os.listdir(self.tmp) if x.endswith('.pickle')]
+
+    def test_shared_on_disk(self):
+        "scores saved by one process are found by another"
+        dpack = mk_dpack('d1', 5)
+        expected = scores.cached_scores('model', dpack,
+                                        lambda: self.scorer(dpack))
+        self.assertEqual(len(self._pickles()), 1)
+        # as if we were another worker
+        scores._MEMORY.clear()
+        found = scores.cached_scores('model', dpack,
+                                     lambda: self.scorer(dpack))
+        self.assertEqual(self.scorer.calls, 1)
+        np.testing.assert_array_equal(found, expected)
+        self.assertEqual(scores.report()['hits'], 1)
+
+    def test_disk_limit(self):
+        "past the limit, scores are kept in memory only"
+        old_limit = scores.DISK_LIMIT
+        scores.DISK_LIMIT = 1
+        try:
+            dpacks = [mk_dpack('d1', 5), mk_dpack('d2', 5)]
+            for dpack in dpacks * 2:
+                scores.cached_scores('model', dpack,
+                                     lambda d=dpack: self.scorer(d))
+        finally:
+            scores.DISK_LIMIT = old_limit
+        self.assertEqual(len(self._pickles()), 1)
+        self.assertEqual(self.scorer.calls, 2)
+
+    def test_clear(self):
+        "clearing the cache removes the files"
+        dpack = mk_dpack('d1', 5)
+        scores.cached_scores('model', dpack, lambda: self.scorer(dpack))
+        scores.clear_cache()
+        self.assertEqual(os.listdir(self.tmp), [])
+
+
+class PrimeScoresTest(unittest.TestCase):
+    "batched scoring"
+
+    def setUp(self):
+        scores.set_cache_dir(None)
+        self.dpacks = [mk_dpack('d{}'.format(i), 3 + i, seed=i)
+                       for i in range(4)]
+
+    def tearDown(self):
+        scores.set_cache_dir(None)
+
+    def _check_split(self, predict_score):
+        """
+        After priming, the scores for each datapack are what scoring
+        it on its own would have given, and nothing is scored again
+        """
+        expected = [predict_score(d) for d in self.dpacks]
+        calls = []
+
+        def compute(dpack):
+            "count calls"
+            calls.append(len(dpack.pairings))
+            return predict_score(dpack)
+
+        primed = scores.prime_scores('model', self.dpacks, compute)
+        self.assertEqual(primed, len(self.dpacks))
+        self.assertEqual(calls, [sum(len(d.pairings) for d in self.dpacks)])
+        for dpack, want in zip(self.dpacks, expected):
+            got = scores.cached_scores('model', dpack,
+                                       lambda d=dpack: compute(d))
+            np.testing.assert_allclose(got, want)
+        self.assertEqual(len(calls), 1)
+
+    def test_split(self):
+        "scores for the stacked datapacks go back to each of them"
+        self._check_split(Scorer())
+
+    def test_split_sklearn(self):
+        "same with the probabilities from a maxent model"
+        linear_model = pytest.importorskip('sklearn.linear_model')
+        dpack = mk_dpack('train', 8, seed=42)
+        model = linear_model.LogisticRegression()
+        model.fit(dpack.data, dpack.target)
+        self._check_split(lambda d: model.predict_proba(d.data)[:, 1])
+
+    def test_split_on_disk(self):
+        "same when the scores are shared on disk"
+        tmp = tempfile.mkdtemp(prefix='test-scores-')
+        try:
+            scores.set_cache_dir(tmp)
+            self._check_split(Scorer())
+        finally:
+            scores.set_cache_dir(None)
+            shutil.rmtree(tmp)
+
+    def test_already_scored(self):
+        "datapacks that have scores are left out of the batch"
+        scorer = Scorer()
+        for dpack in self.dpacks[:2]:
+            scores.cached_scores('model', dpack,
+                                 lambda d=dpack: scorer(d))
+        primed = scores.prime_scores('model', self.dpacks, scorer)
+        self.assertEqual(primed, 2)
+        self.assertEqual(scorer.calls, 3)
@@ -0,0 +1,100 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Scratch space for the parse server
+"""
+
+from __future__ import print_function
+from os import path as fp
+import os
+import shutil
+import tempfile
+import unittest
+
+from stac.harness.scratch import (ScratchArena)
+
+
+def _write(directory, count, size=10):
+    "fill a directory with some files"
+    for i in range(count):
+        subdir = fp.join(directory, 'sub{}'.format(i % 2))
+        if not fp.exists(subdir):
+            os.makedirs(subdir)
+        with open(fp.join(subdir, 'f{}'.format(i)), 'wb') as stream:
+            stream.write(b'x' * size)
+
+
+class ScratchTest(unittest.TestCase):
+    "working directories and their cleanup"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test-scratch-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _trash_files(self):
+        "files waiting to be deleted"
+        trash = fp.join(self.tmp, 'trash')
+        return sum(len(f) for _, _, f in os.walk(trash))
+
+    def test_fresh(self):
+        "each input gets the same, empty, directory"
+        arena = ScratchArena(root=self.tmp)
+        first = arena.fresh()
+        _write(first, 3)
+        second = arena.fresh()
+        self.assertEqual(first, second)
+        self.assertEqual(os.listdir(second), [])
+        self.assertEqual(self._trash_files(), 3)
+        self.assertEqual(arena.usage(), {'files': 0, 'bytes': 0,
+                                         'written': 0})
+
+    def test_bounded_cleanup(self):
+        "old directories go a few files at a time"
+        arena = ScratchArena(root=self.tmp, cleanup_files=4,
+                             cleanup_seconds=60)
+        _write(arena.fresh(), 10)
+        arena.fresh()
+        stats = arena.collect()
+        self.assertEqual(stats['files'], 4)
+        self.assertEqual(stats['bytes'], 40)
+        self.assertEqual(stats['pending_bytes'], 60)
+        self.assertEqual(self._trash_files(), 6)
+        arena.collect()
+        arena.collect()
+        self.assertEqual(self._trash_files(), 0)
+        # emptied directories are removed too (eventually)
+        arena.collect()
+        self.assertEqual(os.listdir(fp.join(self.tmp, 'trash')), [])
+
+    def test_too_much_pending(self):
+        "past the pending limit, everything goes at once"
+        arena = ScratchArena(root=self.tmp, cleanup_files=1,
+                             cleanup_seconds=60, max_pending_bytes=50)
+        _write(arena.fresh(), 10)
+        arena.fresh()
+        stats = arena.collect()
+        self.assertEqual(stats['files'], 10)
+        self.assertEqual(stats['pending_bytes'], 0)
+
+    def test_usage(self):
+        "files in the working directory, and those written lately"
+        arena = ScratchArena(root=self.tmp)
+        path = arena.fresh()
+        _write(path, 2, size=5)
+        old = fp.join(path, 'sub0', 'f0')
+        os.utime(old, (0, 0))
+        self.assertEqual(arena.usage(since=1), {'files': 2, 'bytes': 10,
+                                                'written': 5})
+
+    def test_default_root(self):
+        "without a root, we get a directory of our own"
+        arena = ScratchArena()
+        try:
+            self.assertTrue(fp.isdir(arena.root))
+            self.assertEqual(arena.in_memory,
+                             arena.root.startswith('/dev/shm/'))
+        finally:
+            shutil.rmtree(arena.root)
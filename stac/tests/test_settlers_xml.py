@@ -0,0 +1,74 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Streaming Settlers XML output against the (minidom) pretty printer
+it replaces
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import io
+import unittest
+
+import pytest
+
+# stac.settlers_xml needs educe (for the resource names)
+pytest.importorskip('educe')
+
+# pylint: disable=wrong-import-position
+from educe.stac.util.prettifyxml import prettify
+
+from stac.settlers_xml import (GameFragment, text_elem, write_fragment)
+import xml.etree.cElementTree as ET
+# pylint: enable=wrong-import-position
+
+
+class _Event(namedtuple('_Event', 'identifier node')):
+    "stand-in for a chat message"
+
+    def to_xml(self):
+        "the node"
+        return self.node
+
+
+def _event(identifier, text, speaker):
+    "an event with awkward characters in its text and attributes"
+    node = ET.Element('chat_message', speaker=speaker, id=identifier)
+    node.append(text_elem('event_id', identifier))
+    node.append(text_elem('text', text))
+    edus = ET.SubElement(node, 'edus')
+    ET.SubElement(edus, 'edu', begin='0', end=str(len(text)))
+    ET.SubElement(node, 'nothing')
+    return _Event(identifier, node)
+
+
+EVENTS = [_event(u'1', u'say "hi" to <Bob> & \'Al\'', u'say "hi"'),
+          _event(u'2', u'I’ll trade wood > sheep', u'Bob & Al'),
+          _event(u'3', u'', u"it's <me>")]
+
+
+class SettlersXmlTest(unittest.TestCase):
+    "write_fragment vs prettify"
+
+    def test_same_as_prettify(self):
+        "full output is what prettify gives for the same tree"
+        fragment = GameFragment(events=EVENTS)
+        stream = io.BytesIO()
+        write_fragment(fragment.events, stream)
+        expected = prettify(fragment.to_xml(), indent=u' ')
+        self.assertEqual(stream.getvalue().decode('utf-8'), expected)
+
+    def test_delta(self):
+        "only changed events are written again"
+        digests, _ = write_fragment(EVENTS, io.BytesIO())
+        changed = [EVENTS[0], _event(u'2', u'no', u'Bob & Al')]
+        stream = io.BytesIO()
+        _, stats = write_fragment(changed, stream, previous=digests)
+        self.assertEqual(stats['written'], 1)
+        self.assertEqual(stats['removed'], 1)
+        self.assertIn(b'<event_id>3</event_id>', stream.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
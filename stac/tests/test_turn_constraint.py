@@ -0,0 +1,186 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Turn constrained MST decoder
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import itertools
+import unittest
+
+import numpy as np
+import pytest
+import scipy.sparse
+
+pytest.importorskip('attelo')
+
+# pylint: disable=wrong-import-position
+from attelo.table import (UNKNOWN, UNRELATED)
+from stac.harness.turn_constraint import (SAME_SPEAKER,
+                                          TC_MstDecoder,
+                                          _chu_liu_edmonds,
+                                          turn_constraint_safe)
+# pylint: enable=wrong-import-position
+
+# pylint: disable=protected-access
+
+
+def _brute_force(nnodes, root, src, tgt, weights):
+    """
+    Weight of the best spanning arborescence (trying every choice of
+    head for every node)
+    """
+    incoming = [[i for i in range(len(src))
+                 if tgt[i] == v and src[i] != v]
+                for v in range(nnodes) if v != root]
+    best = None
+    for choice in itertools.product(*incoming):
+        heads = {tgt[i]: src[i] for i in choice}
+        reaches_root = True
+        for node in heads:
+            seen = set()
+            while node != root and reaches_root:
+                if node in seen:
+                    reaches_root = False
+                seen.add(node)
+                node = heads[node]
+        if reaches_root:
+            weight = sum(weights[i] for i in choice)
+            best = weight if best is None else max(best, weight)
+    return best
+
+
+class ChuLiuEdmondsTest(unittest.TestCase):
+    "maximum spanning arborescence"
+
+    def test_against_brute_force(self):
+        "same weight as trying every tree, on random small graphs"
+        rng = np.random.RandomState(0)
+        for _ in range(50):
+            nnodes = rng.randint(2, 6)
+            pairs = [(u, v) for u in range(nnodes) for v in range(1, nnodes)
+                     if u != v]
+            src = np.array([u for u, _ in pairs])
+            tgt = np.array([v for _, v in pairs])
+            weights = rng.uniform(-5, 0, size=len(pairs))
+            chosen = _chu_liu_edmonds(nnodes, 0, src, tgt, weights)
+            self.assertEqual(sorted(tgt[chosen].tolist()),
+                             list(range(1, nnodes)))
+            self.assertAlmostEqual(weights[chosen].sum(),
+                                   _brute_force(nnodes, 0, src, tgt,
+                                                weights))
+
+    def test_cycle(self):
+        "a cycle of locally best heads is broken"
+        # 1 and 2 prefer each other to the root
+        src = np.array([0, 0, 1, 2])
+        tgt = np.array([1, 2, 2, 1])
+        weights = np.log([0.4, 0.1, 0.9, 0.8])
+        chosen = _chu_liu_edmonds(3, 0, src, tgt, weights)
+        self.assertEqual(chosen.tolist(), [0, 2])
+
+
+Edu = namedtuple('Edu', 'id start end')
+Edu.span = lambda self: (self.start, self.end)
+
+
+class Graph(namedtuple('Graph', 'prediction attach label')):
+    "stand-in for an attelo graph"
+
+    def tweak(self, **kwargs):
+        "copy with some fields replaced"
+        return self._replace(**kwargs)
+
+
+class DataPack(object):
+    "stand-in for an attelo datapack"
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __len__(self):
+        return len(self.pairings)
+
+    def label_number(self, label):
+        "index of a label"
+        return self.labels.index(label)
+
+    def set_graph(self, graph):
+        "copy with a new graph"
+        return DataPack(**dict(self.__dict__, graph=graph))
+
+
+class TC_MstDecoderTest(unittest.TestCase):
+    "decoding from the score arrays"
+
+    def setUp(self):
+        root = Edu('ROOT', 0, 0)
+        edus = [root] + [Edu('e{}'.format(i), i * 10, i * 10 + 5)
+                         for i in range(1, 4)]
+        self.pairings = [(e1, e2) for e1 in edus for e2 in edus[1:]
+                         if e1 != e2]
+        same_speaker = [(e1.id, e2.id) in [('e3', 'e1')]
+                        for e1, e2 in self.pairings]
+        data = scipy.sparse.csr_matrix(
+            np.array([[1., float(s)] for s in same_speaker]))
+        self.labels = [UNKNOWN, 'Elaboration', 'Result', UNRELATED]
+        self.edus = edus
+        self.data = data
+
+    def _dpack(self, attach, label):
+        "datapack with the given scores"
+        return DataPack(edus=self.edus,
+                        pairings=self.pairings,
+                        data=self.data,
+                        labels=self.labels,
+                        vocab=['word=hi', SAME_SPEAKER],
+                        graph=Graph(prediction=None,
+                                    attach=np.asarray(attach),
+                                    label=label))
+
+    def _index(self, id1, id2):
+        "index of a pair"
+        return [(e1.id, e2.id) for e1, e2 in self.pairings].index((id1, id2))
+
+    def test_turn_constraint(self):
+        "only forwards or same speaker edges are kept"
+        kept = turn_constraint_safe(self._dpack(np.zeros(len(self.pairings)),
+                                                None))
+        backwards = [i for i, (e1, e2) in enumerate(self.pairings)
+                     if e1.start > e2.start and
+                     (e1.id, e2.id) != ('e3', 'e1')]
+        self.assertEqual(sorted(set(kept) | set(backwards)),
+                         list(range(len(self.pairings))))
+        self.assertFalse(set(kept) & set(backwards))
+
+    def test_decode(self):
+        "best constrained tree, labelled with the best real label"
+        attach = np.full(len(self.pairings), 0.1)
+        # the best edges into e1 go backwards; only the one from a
+        # same speaker EDU may be used
+        attach[self._index('e2', 'e1')] = 0.99
+        attach[self._index('e3', 'e1')] = 0.9
+        attach[self._index('ROOT', 'e3')] = 0.8
+        attach[self._index('e1', 'e2')] = 0.7
+        label = np.zeros((len(self.pairings), len(self.labels)))
+        label[:, self.labels.index('Elaboration')] = 0.3
+        label[:, self.labels.index(UNRELATED)] = 0.6
+        label[:, self.labels.index(UNKNOWN)] = 0.1
+        label[self._index('ROOT', 'e3'),
+              self.labels.index('Result')] = 0.4
+        res = TC_MstDecoder().decode(self._dpack(attach, label))
+        prediction = [self.labels[i] for i in res.graph.prediction]
+        expected = [UNRELATED] * len(self.pairings)
+        expected[self._index('e3', 'e1')] = 'Elaboration'
+        expected[self._index('ROOT', 'e3')] = 'Result'
+        expected[self._index('e1', 'e2')] = 'Elaboration'
+        self.assertEqual(prediction, expected)
+
+    def test_no_labels(self):
+        "without label scores, attached edges are unknown"
+        attach = np.linspace(0.1, 0.9, len(self.pairings))
+        res = TC_MstDecoder().decode(self._dpack(attach, None))
+        prediction = [self.labels[i] for i in res.graph.prediction]
+        self.assertEqual(prediction.count(UNKNOWN), len(self.edus) - 1)
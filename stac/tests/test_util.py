@@ -0,0 +1,54 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Harness utilities
+"""
+
+from __future__ import print_function
+import types
+import unittest
+
+import pytest
+
+# stac.harness.util reads settings from local.py, which needs educe
+pytest.importorskip('educe')
+
+# pylint: disable=wrong-import-position
+from stac.harness.util import (swapped)
+# pylint: enable=wrong-import-position
+
+
+def _module():
+    "a module to swap things in"
+    module = types.ModuleType('fake_attelo')
+    module.load = lambda: 'original'
+    return module
+
+
+class SwappedTest(unittest.TestCase):
+    "swapped"
+
+    def test_restored(self):
+        "the original comes back after the block"
+        module = _module()
+        with swapped(module, 'load', lambda: 'ours') as original:
+            self.assertEqual(module.load(), 'ours')
+            self.assertEqual(original(), 'original')
+        self.assertEqual(module.load(), 'original')
+
+    def test_restored_on_error(self):
+        "even if the block fails"
+        module = _module()
+        with self.assertRaises(ValueError):
+            with swapped(module, 'load', lambda: 'ours'):
+                raise ValueError('oops')
+        self.assertEqual(module.load(), 'original')
+
+    def test_missing(self):
+        "nothing to replace is an error, and nothing is added"
+        module = _module()
+        with self.assertRaises(AttributeError):
+            with swapped(module, 'jobs', lambda: 'ours'):
+                pass
+        self.assertFalse(hasattr(module, 'jobs'))
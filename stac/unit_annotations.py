@@ -13,7 +13,8 @@ import copy
 import os
 
 import joblib
-from scipy.sparse import lil_matrix
+import numpy as np
+from scipy.sparse import csr_matrix
 from sklearn.datasets import load_svmlight_file
 from attelo.io import (load_labels,
                        load_vocab)
@@ -82,8 +83,13 @@ def get_edus_plus(inputs):
 def extract_features(vocab, edus_plus):
     """
     Return a sparse matrix of features for all edus in the corpus
+
+    The matrix is assembled in one go from coordinate (row, column,
+    value) arrays rather than filled in cell by cell
     """
-    matrix = lil_matrix((len(edus_plus), len(vocab)))
+    rows = []
+    cols = []
+    vals = []
     # this unfortunately duplicates stac_features.extract_single_features
     # but it's the price we pay to ensure we get the edus and vectors in
     # the same order
@@ -91,14 +97,23 @@ def extract_features(vocab, edus_plus):
         vec = stac_features.SingleEduKeys(env.inputs)
         vec.fill(env.current, edu)
         for feat, val in vec.one_hot_values_gen():
-            if feat in vocab:
-                matrix[row, vocab[feat]] = val
-    return matrix.tocsr()
+            col = vocab.get(feat)
+            if col is not None:
+                rows.append(row)
+                cols.append(col)
+                vals.append(val)
+    return csr_matrix((np.array(vals, dtype=np.float64),
+                       (np.array(rows, dtype=np.int32),
+                        np.array(cols, dtype=np.int32))),
+                      shape=(len(edus_plus), len(vocab)))
 
 
 def annotate_edus(model, vocab, labels, inputs):
     """
     Annotate each EDU with its dialogue act and addressee
+
+    EDUs from all documents in the inputs are stacked into a single
+    feature matrix so that the model is only called once
     """
     edus_plus = list(get_edus_plus(inputs))
     feats = extract_features(vocab, edus_plus)